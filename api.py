@@ -1,25 +1,50 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Response, Request, Header
+from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
 from fastapi.security import APIKeyHeader
 from pydantic import BaseModel
 import uvicorn
 import subprocess
-from typing import List, Dict
-from proxy import execute_fabric_command, execute_yt_command, run_command, replace_drive
+from typing import List, Dict, Optional
+from proxy import fabric_listing, run_command, stream_command
+from executors import executor_for
+from engine import LLMEngine, EngineError
+from cache import ResultCache, result_cache, listing_cache, CACHE_DIR
+from scheduler import scheduler, current_priority, PRIORITIES, QueueFullError
+from patterns import PatternIndex
+from chunking import split_input, TranscriptChunker
+from singleflight import single_flight
+import metrics
+from metrics import MetricsMiddleware, PATTERN_DURATION
+from timing import TimingMiddleware, stage
+from capture import CaptureMiddleware
+from deadlines import DeadlineMiddleware, JOB_DEADLINE
+from whisper_pool import whisper_pool, WhisperPoolError
+from shared import shared_limits, SHARED_STATE, WORKER_ID, HEARTBEAT_TIMEOUT
+from segments import transcribe_segmented, ffmpeg_available
+from logs import setup_logging
+from startup import startup_report
+from jobs import JobStore, JobQueue, JobError, JOB_DB_PATH, QUEUED, RUNNING, SUCCEEDED, CANCELLED, job_info
+from transcripts import youtube_video_id, yt_transcript_cache, ts_cache_key, ts_transcript_cache
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 import os
 import sys
 import shlex
-import tempfile
 import shutil
+import tempfile
 import hashlib
+import functools
+import threading
 import uuid
 import re
+import json
+import time
+import asyncio
 
 # Set up logging
 log_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fabric_yt_proxy_api.log')
-logging.basicConfig(filename=log_file, level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging(log_file, logging.INFO)
 
 def get_hardware_uuid():
     if sys.platform == "darwin":
@@ -30,6 +55,12 @@ def get_hardware_uuid():
     elif sys.platform == "win32":
         result = subprocess.run(["wmic", "csproduct", "get", "UUID"], capture_output=True, text=True)
         return result.stdout.split('\n')[1].strip()
+    elif sys.platform.startswith("linux"):
+        for machine_id_path in ("/etc/machine-id", "/var/lib/dbus/machine-id"):
+            if os.path.exists(machine_id_path):
+                with open(machine_id_path) as f:
+                    return f.read().strip()
+        raise Exception("No machine id found")
     else:
         raise Exception("Unsupported platform")
 
@@ -38,15 +69,75 @@ def generate_api_key():
     key = hashlib.sha256(hardware_uuid.encode()).hexdigest()
     return key
 
-API_KEY = generate_api_key()
+# The derived key, so later starts don't have to shell out to ioreg or wmic for it
+API_KEY_PATH = os.environ.get("FABRIC_CONNECTOR_API_KEY_FILE", os.path.join(CACHE_DIR, "api_key"))
+
+@functools.lru_cache(maxsize=None)
+def load_api_key():
+    """
+    Returns the API key, derived from the hardware UUID on the first start and read
+    from API_KEY_PATH after that.
+    """
+    try:
+        with open(API_KEY_PATH, encoding='utf-8') as f:
+            key = f.read().strip()
+        if len(key) == 64 and all(c in "0123456789abcdef" for c in key):
+            return key
+    except OSError:
+        pass
+    key = generate_api_key()
+    try:
+        os.makedirs(os.path.dirname(API_KEY_PATH), exist_ok=True)
+        temp_path = f"{API_KEY_PATH}.{os.getpid()}.tmp"
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding='utf-8') as f:
+            f.write(key)
+        os.replace(temp_path, API_KEY_PATH)
+    except OSError as e:
+        logging.warning(f"Failed to cache the API key in {API_KEY_PATH}: {e}")
+    return key
+
+def __getattr__(name):
+    # API_KEY is looked up on first use rather than when the module is imported
+    if name == "API_KEY":
+        return load_api_key()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
 async def get_api_key(api_key: str = Depends(api_key_header)):
-    if api_key != API_KEY:
+    if api_key != load_api_key():
         raise HTTPException(status_code=403, detail="Invalid API Key")
     return api_key
 
-app = FastAPI(dependencies=[Depends(get_api_key)])
+async def set_priority(x_priority: Optional[str] = Header(None)):
+    """
+    Requests are interactive unless the client marks them as batch work.
+    """
+    if x_priority is None:
+        return
+    if x_priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown priority '{x_priority}', expected one of {list(PRIORITIES)}")
+    current_priority.set(x_priority)
+
+app = FastAPI(dependencies=[Depends(get_api_key), Depends(set_priority)])
+
+@app.exception_handler(EngineError)
+async def engine_error_handler(request: Request, exc: EngineError):
+    logging.error(f"Error from the model provider: {str(exc)}")
+    return JSONResponse(status_code=502, content={"detail": str(exc)})
+
+@app.exception_handler(WhisperPoolError)
+async def whisper_pool_error_handler(request: Request, exc: WhisperPoolError):
+    logging.error(f"Error transcribing in the whisper pool: {str(exc)}")
+    return JSONResponse(status_code=500, content={"detail": str(exc)})
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    logging.warning(str(exc))
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
+# Cancels pipeline requests on client disconnect or deadline; inside CORS so a 504 gets its headers
+app.add_middleware(DeadlineMiddleware)
 
 # Add CORS middleware
 app.add_middleware(
@@ -55,8 +146,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Request-ID", "X-Cache", "X-Cache-Hits"],
 )
 
+# Request counts, latency and body sizes per route for GET /metrics
+app.add_middleware(MetricsMiddleware)
+# Sanitized request traces for bench/replay.py, when FABRIC_CONNECTOR_CAPTURE names a file
+if os.environ.get("FABRIC_CONNECTOR_CAPTURE"):
+    app.add_middleware(CaptureMiddleware, path=os.environ["FABRIC_CONNECTOR_CAPTURE"])
+# Request IDs, Server-Timing headers and the per-request log record
+app.add_middleware(TimingMiddleware)
+
 class Command(BaseModel):
     command: str
 
@@ -70,12 +170,22 @@ class UpdatePatternRequest(BaseModel):
 class DeletePatternRequest(BaseModel):
     pattern: str
 
+class InvalidateCacheRequest(BaseModel):
+    pattern: Optional[str] = None
+
 class FabricRequest(BaseModel):
     pattern: list[str]
     model: str
     data: str
     stream: bool
     goCompatibility: bool = False
+    streamResponse: bool = False
+    noCache: bool = False
+    concurrency: Optional[int] = None
+    chunked: bool = False
+    chunkSize: Optional[int] = None
+    chunkOverlap: Optional[int] = None
+    reducePattern: Optional[str] = None
 
 class YTRequest(BaseModel):
     pattern: list[str]
@@ -83,6 +193,13 @@ class YTRequest(BaseModel):
     url: str
     stream: bool
     goCompatibility: bool = False
+    streamResponse: bool = False
+    noCache: bool = False
+    concurrency: Optional[int] = None
+    chunked: bool = False
+    chunkSize: Optional[int] = None
+    chunkOverlap: Optional[int] = None
+    reducePattern: Optional[str] = None
 
 class TSRequest(BaseModel):
     pattern: list[str]
@@ -90,119 +207,900 @@ class TSRequest(BaseModel):
     path: str
     stream: bool
     goCompatibility: bool = False
+    streamResponse: bool = False
+    noCache: bool = False
+    concurrency: Optional[int] = None
+    chunked: bool = False
+    chunkSize: Optional[int] = None
+    chunkOverlap: Optional[int] = None
+    reducePattern: Optional[str] = None
+    segmented: bool = False
+    pipelined: bool = False
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    data: Optional[str] = None
+    path: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    pattern: list[str]
+    model: str
+    items: list[BatchItem]
+    stream: bool = True
+    goCompatibility: bool = False
+    noCache: bool = False
+    # Inputs processed at a time, and patterns or chunks of each input run at a time
+    concurrency: Optional[int] = None
+    patternConcurrency: Optional[int] = None
+    chunked: bool = False
+    chunkSize: Optional[int] = None
+    chunkOverlap: Optional[int] = None
+    reducePattern: Optional[str] = None
 
 # Use os.path.expanduser to get the current user's home directory
-if sys.platform == "darwin":
-    HOME_DIR = os.path.expanduser("~")
-    FABRIC_PATH = os.path.join(HOME_DIR, ".local", "bin", "fabric")
-    YT_PATH = os.path.join(HOME_DIR, ".local", "bin", "yt")
-    #TS_PATH = os.path.join(HOME_DIR, ".local", "bin", "ts")
-    TS_PATH = "whisper"
-    TS_OUTPUT_PATH = os.path.join(HOME_DIR, ".local", "ts_output")
-    PATTERN_PATH = os.path.join(HOME_DIR, ".config", "fabric", "patterns")
-elif sys.platform == "win32":
-    HOME_DIR = os.path.expanduser("~").replace("Users", "home").replace("C:", "")
-    FABRIC_PATH = os.path.join(HOME_DIR, ".local", "bin", "fabric").replace("\\", "/")
-    YT_PATH = os.path.join(HOME_DIR, ".local", "bin", "yt").replace("\\", "/")
-    TS_PATH = os.path.join(HOME_DIR, ".local", "bin", "ts").replace("\\", "/")
-    TS_OUTPUT_PATH = os.path.join(HOME_DIR, ".local", "ts_output").replace("\\", "/")
-    PATTERN_PATH = os.path.join(os.path.expanduser("~"), ".config", "fabric", "patterns").replace("\\", "/")
-else:
-    print("Unsupported operating system")
-    sys.exit(1)
+HOME_DIR = os.path.expanduser("~")
+TS_OUTPUT_PATH = os.environ.get("FABRIC_CONNECTOR_TS_OUTPUT_PATH", os.path.join(HOME_DIR, ".local", "ts_output"))
+PATTERN_PATH = os.environ.get(
+    "FABRIC_CONNECTOR_PATTERN_PATH",
+    os.path.join(HOME_DIR, ".config", "fabric", "patterns").replace("\\", "/")
+)
 
-@app.post("/fabric")
-async def fabric(request: FabricRequest):
+if SHARED_STATE:
+    # /set_model and pattern edits in one worker have to reach the others' listings too
+    listing_cache.share_invalidations(os.path.join(CACHE_DIR, "listings_invalidated"))
+
+pattern_index = PatternIndex(PATTERN_PATH, poll_interval=float(os.environ.get("FABRIC_CONNECTOR_PATTERN_POLL", 5)))
+
+# Optional in-process pattern engine, falls back to the fabric CLI for unsupported models
+llm_engine = LLMEngine.from_environment(PATTERN_PATH, pattern_index)
+
+@app.on_event("shutdown")
+async def close_llm_engine():
+    await llm_engine.close()
+
+@app.on_event("startup")
+async def start_pattern_index():
+    await asyncio.to_thread(pattern_index.start)
+
+@app.on_event("shutdown")
+async def stop_pattern_index():
+    pattern_index.stop()
+
+# Whisper adds hours to the timestamps of recordings longer than an hour
+TIMESTAMP_PATTERN = r'^\[(?:\d{1,2}:)?\d{1,2}:\d{2}\.\d{3} --> (?:\d{1,2}:)?\d{1,2}:\d{2}\.\d{3}\]'
+# How many unchained patterns of one request may run at the same time
+PATTERN_CONCURRENCY = int(os.environ.get("FABRIC_CONNECTOR_PATTERN_CONCURRENCY", 4))
+# Chunked mode: chunk size and overlap in characters, roughly 4 characters per token
+CHUNK_SIZE = int(os.environ.get("FABRIC_CONNECTOR_CHUNK_SIZE", 12000))
+CHUNK_OVERLAP = int(os.environ.get("FABRIC_CONNECTOR_CHUNK_OVERLAP", 400))
+MIN_CHUNK_SIZE = 500
+# Pattern that combines the partial outputs, defaults to the mapped pattern itself
+REDUCE_PATTERN = os.environ.get("FABRIC_CONNECTOR_REDUCE_PATTERN")
+
+def fabric_command(pattern, model, go_compatibility=False):
     """
-    Runs the Fabric binary with the provided command and returns the output.
+    Builds the command that runs a single pattern. The input is piped to its stdin.
     """
+    return executor_for(go_compatibility).fabric("-sp", pattern, "--model", model)
+
+async def run_pattern(pattern, model, input_data, go_compatibility=False):
+    """
+    Runs a single pattern and returns its complete output.
+    """
+    started = time.perf_counter()
+    with stage("pattern", pattern):
+        if llm_engine.supports(model):
+            output = await llm_engine.complete(pattern, model, input_data)
+        else:
+            command = fabric_command(pattern, model, go_compatibility)
+            output = await run_command(command, pool="llm", model=model, input_data=input_data)
+    PATTERN_DURATION.labels(pattern_label(pattern), model, pattern_backend(model, go_compatibility)).observe(time.perf_counter() - started)
+    return output
+
+async def cached_pattern(pattern, model, input_data, go_compatibility=False, no_cache=False):
+    """
+    Runs a single pattern through the result cache. Identical runs that are already in
+    flight are joined instead of started again.
+    Returns the output and the cache status: "HIT", "MISS" or "BYPASS" when no_cache is set.
+    """
+    key = ResultCache.key(pattern, model, go_compatibility, input_data)
+    if not no_cache:
+        output = await asyncio.to_thread(result_cache.get, key)
+        if output is not None:
+            return output, "HIT"
+
+    async def run():
+        output = await run_pattern(pattern, model, input_data, go_compatibility)
+        await asyncio.to_thread(result_cache.put, pattern, key, output)
+        return output
+
+    output = await single_flight.do(("pattern", key), run)
+    return output, "BYPASS" if no_cache else "MISS"
+
+def input_chunks(request, input_data):
+    """
+    Returns the chunks a chunked request maps the pattern over, or None when the input
+    is processed whole.
+    """
+    if not request.chunked:
+        return None
+    chunks = split_input(input_data, *chunk_settings(request))
+    return chunks if len(chunks) > 1 else None
+
+def chunk_settings(request):
+    """
+    The chunk size and overlap of a request.
+    """
+    size = max(MIN_CHUNK_SIZE, request.chunkSize or CHUNK_SIZE)
+    overlap = CHUNK_OVERLAP if request.chunkOverlap is None else max(0, request.chunkOverlap)
+    return size, overlap
+
+def reduce_pattern(request, pattern):
+    return request.reducePattern or REDUCE_PATTERN or pattern
+
+async def map_chunks(request, pattern, chunks):
+    """
+    Runs a pattern on every chunk, up to request.concurrency at a time, and yields
+    (chunk index, output, cache status) as the chunks complete. Every chunk is cached on
+    its own, so when some fail the others are kept and a retry only reruns the failures.
+    """
+    semaphore = asyncio.Semaphore(pattern_concurrency(request))
+
+    async def run_chunk(index, chunk):
+        try:
+            async with semaphore:
+                output, cache_status = await cached_pattern(pattern, request.model, chunk, request.goCompatibility, request.noCache)
+            return index, output, cache_status
+        except Exception as e:
+            return e
+
+    logging.info(f"Mapping pattern '{pattern}' over {len(chunks)} chunks")
+    tasks = [asyncio.create_task(run_chunk(index, chunk)) for index, chunk in enumerate(chunks)]
+    failures = []
     try:
-        logging.info(f"Running Fabric command with patterns: {request.pattern}")
-        final_output = ""
-        input_data = request.data
-        
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            if isinstance(result, Exception):
+                failures.append(result)
+            else:
+                yield result
+    finally:
+        # Wait for the cancelled runs, so their slots are free and their processes gone
+        # by the time the caller sees the result
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    if failures:
+        raise failures[0]
+
+def combined_cache_status(cache_statuses):
+    if "BYPASS" in cache_statuses:
+        return "BYPASS"
+    return "HIT" if all(status == "HIT" for status in cache_statuses) else "MISS"
+
+async def chunked_pattern(request, pattern, input_data):
+    """
+    Runs a single pattern through the result cache. In chunked mode long input is split,
+    the pattern mapped over the chunks in parallel and the partial outputs combined by
+    the reduce pattern.
+    """
+    chunks = input_chunks(request, input_data)
+    if chunks is None:
+        return await cached_pattern(pattern, request.model, input_data, request.goCompatibility, request.noCache)
+    partials = [None] * len(chunks)
+    cache_statuses = []
+    async for index, output, cache_status in map_chunks(request, pattern, chunks):
+        partials[index] = output
+        cache_statuses.append(cache_status)
+    output, cache_status = await cached_pattern(
+        reduce_pattern(request, pattern), request.model, "\n\n".join(partials), request.goCompatibility, request.noCache
+    )
+    cache_statuses.append(cache_status)
+    return output, combined_cache_status(cache_statuses)
+
+async def stream_pattern(pattern, model, input_data, go_compatibility=False):
+    """
+    Runs a single pattern and yields its output as the fabric process produces it.
+    """
+    started = time.perf_counter()
+    if llm_engine.supports(model):
+        chunks = llm_engine.stream(pattern, model, input_data)
+    else:
+        chunks = stream_command(fabric_command(pattern, model, go_compatibility), pool="llm", model=model, input_data=input_data)
+    with stage("pattern", pattern):
+        async for chunk in chunks:
+            yield chunk
+    PATTERN_DURATION.labels(pattern_label(pattern), model, pattern_backend(model, go_compatibility)).observe(time.perf_counter() - started)
+
+def pattern_label(pattern):
+    # Pattern names come from the client; unknown ones share a label so they can't add series without bound
+    return pattern if pattern in pattern_index else "other"
+
+def pattern_backend(model, go_compatibility=False):
+    return "engine" if llm_engine.supports(model) else executor_for(go_compatibility).name
+
+async def stored_stream(pattern, key, model, input_data, go_compatibility=False):
+    """
+    Streams a pattern run and stores the complete output in the result cache.
+    """
+    output = ""
+    async for chunk in stream_pattern(pattern, model, input_data, go_compatibility):
+        output += chunk
+        yield chunk
+    await asyncio.to_thread(result_cache.put, pattern, key, output.strip())
+
+async def run_patterns(request, input_data):
+    """
+    Runs the requested patterns over the input data. When request.stream is set the
+    patterns are chained, otherwise every pattern receives the same input and they run
+    concurrently, up to request.concurrency at a time.
+    Returns the output, the cache status of every pattern and the patterns that failed.
+    """
+    if request.stream:
+        output = ""
+        cache_statuses = []
         for pattern in request.pattern:
-            if request.goCompatibility:
-                goFabric = FABRIC_PATH.replace(".local", "go")
-                if sys.platform == "darwin":
-                    if input_data:
-                        with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-                            temp_file.write(input_data)
-                            temp_file_path = temp_file.name
-                    command = f"cat '{temp_file_path}' | {goFabric} -sp '{pattern}' --model '{request.model}'"
-                    output = await run_command(["sh", "-c", command])
-                elif sys.platform == "win32":
-                    goFabric = goFabric.replace("/home", "c:/Users")
-                    if input_data:
-                        with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-                            temp_file.write(input_data)
-                            temp_file_path = temp_file.name
-                    powershell_command = f"gc '{temp_file_path}' | {goFabric} -sp '{pattern}' --model '{request.model}'"
-                    output = await run_command(["C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe", "-WindowStyle", "Hidden", "-Command", powershell_command])
-                    os.unlink(temp_file_path)
+            output, cache_status = await chunked_pattern(request, pattern, input_data)
+            cache_statuses.append(cache_status)
+            input_data = output  # Use the output of the current pattern as the input for the next
+        return output, cache_statuses, []  # The final output is the last pattern's output
+
+    semaphore = asyncio.Semaphore(pattern_concurrency(request))
+
+    async def run_one(pattern):
+        async with semaphore:
+            return await chunked_pattern(request, pattern, input_data)
+
+    results = await asyncio.gather(*(run_one(pattern) for pattern in request.pattern), return_exceptions=True)
+    failures = [(pattern, result) for pattern, result in zip(request.pattern, results) if isinstance(result, Exception)]
+    if failures and len(failures) == len(results):
+        raise failures[0][1]
+
+    final_output = ""
+    cache_statuses = []
+    for result in results:
+        if not isinstance(result, Exception):
+            output, cache_status = result
+            final_output += output + "\n\n"  # Concatenate outputs in request order
+            cache_statuses.append(cache_status)
+    errors = []
+    for pattern, error in failures:
+        logging.error(f"Pattern '{pattern}' failed: {str(error)}")
+        errors.append({"pattern": pattern, "detail": str(error)})
+    return final_output.strip(), cache_statuses, errors
+
+def pattern_concurrency(request):
+    if request.concurrency is None:
+        return PATTERN_CONCURRENCY
+    return max(1, request.concurrency)
+
+def pattern_response(output, errors):
+    if errors:
+        return {"output": output, "errors": errors}
+    return {"output": output}
+
+def set_cache_headers(response, cache_statuses):
+    """
+    X-Cache is HIT only when every pattern was served from the cache.
+    """
+    hits = cache_statuses.count("HIT")
+    if "BYPASS" in cache_statuses:
+        response.headers["X-Cache"] = "BYPASS"
+    else:
+        response.headers["X-Cache"] = "HIT" if hits == len(cache_statuses) else "MISS"
+    response.headers["X-Cache-Hits"] = f"{hits}/{len(cache_statuses)}"
+
+def stream_event(event, **fields):
+    return (json.dumps({"event": event, **fields}) + "\n").encode("utf-8")
+
+async def pattern_events(request, pattern, index, input_data, outputs):
+    """
+    Yields the events of a single pattern run and stores its output in outputs[index].
+    In chunked mode the map step reports each finished chunk with a "map" event and the
+    "chunk" events carry the output of the reduce pattern.
+    """
+    chunks = input_chunks(request, input_data)
+    run = pattern
+    if chunks is not None:
+        yield stream_event("stage", stage="map", pattern=pattern, index=index, chunks=len(chunks))
+        partials = [None] * len(chunks)
+        async for chunk_index, output, cache_status in map_chunks(request, pattern, chunks):
+            partials[chunk_index] = output
+            yield stream_event("map", pattern=pattern, index=index, chunk=chunk_index, cached=cache_status == "HIT")
+        yield stream_event("stage_end", stage="map", pattern=pattern, index=index)
+        run = reduce_pattern(request, pattern)
+        input_data = "\n\n".join(partials)
+    async for event in run_events(request, run, pattern, index, input_data, outputs):
+        yield event
+
+async def run_events(request, run, pattern, index, input_data, outputs):
+    """
+    Yields the "pattern" stage of a run of `run`, the pattern itself or the reduce
+    pattern combining its partial outputs, and stores the output in outputs[index].
+    """
+    yield stream_event("stage", stage="pattern", pattern=pattern, index=index)
+    key = ResultCache.key(run, request.model, request.goCompatibility, input_data)
+    output = None if request.noCache else await asyncio.to_thread(result_cache.get, key)
+    cached = output is not None
+    if cached:
+        yield stream_event("chunk", pattern=pattern, index=index, data=output)
+    else:
+        output = ""
+        # Concurrent identical runs share one stream, late joiners get the output so far first
+        chunks = single_flight.stream(
+            ("pattern", key), lambda: stored_stream(run, key, request.model, input_data, request.goCompatibility)
+        )
+        async for chunk in chunks:
+            output += chunk
+            yield stream_event("chunk", pattern=pattern, index=index, data=chunk)
+        output = output.strip()
+    outputs[index] = output
+    yield stream_event("stage_end", stage="pattern", pattern=pattern, index=index, cached=cached)
+
+async def isolated_events(pattern, index, events):
+    """
+    Passes on the events of a pattern run, but reports a failure as an error event so
+    the other patterns of the request keep running.
+    """
+    try:
+        async for event in events:
+            yield event
+    except Exception as e:
+        logging.error(f"Pattern '{pattern}' failed: {str(e)}")
+        yield stream_event("error", pattern=pattern, index=index, detail=str(e))
+
+async def merge_streams(streams, limit):
+    """
+    Runs up to `limit` async generators at a time and yields their items as they arrive.
+    """
+    queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(limit)
+    done = object()
+
+    async def pump(stream):
+        try:
+            async with semaphore:
+                async for item in stream:
+                    await queue.put(item)
+        finally:
+            queue.put_nowait(done)
+
+    tasks = [asyncio.create_task(pump(stream)) for stream in streams]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            item = await queue.get()
+            if item is done:
+                remaining -= 1
             else:
-                if sys.platform == "darwin":
-                    output = await run_command([FABRIC_PATH, "-sp", pattern, "--text", input_data, "--model", request.model])
-                elif sys.platform == "win32":
-                    if input_data:
-                        with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-                            temp_file.write(input_data)
-                            temp_file_path = temp_file.name
-                    powershell_command = f"gc '{temp_file_path}' | wsl -e {FABRIC_PATH} -sp '{pattern}' --model '{request.model}'"
-                    output = await run_command(["C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe", "-WindowStyle", "Hidden", "-Command", powershell_command])
-                    os.unlink(temp_file_path)
-            
-            if request.stream:
-                input_data = output  # Use the output of the current pattern as the input for the next
-                final_output = output  # The final output is the last pattern's output
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def stream_patterns(request, load_input):
+    """
+    Yields NDJSON events for a pattern run: a "stage" marker before each step, "chunk"
+    events carrying fabric's stdout as it arrives and a final "done" event with the
+    complete output. Errors are reported in-band since the response has already started.
+    Unchained patterns run concurrently, so their events interleave; every event carries
+    the pattern's index.
+    """
+    try:
+        if load_input is None:
+            input_data = request.data
+        else:
+            yield stream_event("stage", stage="transcript")
+            with stage("transcript"):
+                input_data = await load_input(request)
+            yield stream_event("stage_end", stage="transcript")
+
+        outputs = [None] * len(request.pattern)
+        if request.stream:
+            for index, pattern in enumerate(request.pattern):
+                async for event in pattern_events(request, pattern, index, input_data, outputs):
+                    yield event
+                input_data = outputs[index]
+            final_output = input_data
+        else:
+            streams = [isolated_events(pattern, index, pattern_events(request, pattern, index, input_data, outputs))
+                       for index, pattern in enumerate(request.pattern)]
+            async for event in merge_streams(streams, pattern_concurrency(request)):
+                yield event
+            final_output = "\n\n".join(output for output in outputs if output is not None)
+        yield stream_event("done", output=final_output.strip())
+    except (subprocess.CalledProcessError, EngineError, QueueFullError, WhisperPoolError) as e:
+        logging.error(f"Error executing streamed command: {str(e)}")
+        yield stream_event("error", detail=str(e))
+
+def streaming_response(request, load_input=None):
+    return StreamingResponse(stream_patterns(request, load_input), media_type="application/x-ndjson")
+
+# How many inputs of a batch are processed at the same time
+BATCH_CONCURRENCY = int(os.environ.get("FABRIC_CONNECTOR_BATCH_CONCURRENCY", 4))
+
+def read_text_file(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+async def batch_item_events(request, index, item):
+    """
+    Runs the pattern chain over one input of a batch and yields whether it succeeded
+    together with a single "result" or "error" event tagged with the item's ID.
+    """
+    item_id = item.id if item.id is not None else str(index)
+    try:
+        if item.data is not None:
+            input_data = item.data
+        elif item.path is not None:
+            input_data = await asyncio.to_thread(read_text_file, item.path)
+        else:
+            raise ValueError("Item needs either data or a path")
+        item_request = FabricRequest(
+            **request.dict(exclude={"items", "concurrency", "patternConcurrency"}),
+            data=input_data,
+            concurrency=request.patternConcurrency,
+        )
+        output, cache_statuses, errors = await run_patterns(item_request, input_data)
+        event = {"id": item_id, "index": index, "output": output, "cached": combined_cache_status(cache_statuses) == "HIT"}
+        if errors:
+            event["errors"] = errors
+        yield True, stream_event("result", **event)
+    except Exception as e:
+        logging.error(f"Batch item {item_id} failed: {str(e)}")
+        yield False, stream_event("error", id=item_id, index=index, detail=str(e))
+
+async def stream_batch(request):
+    """
+    Yields one event per input in completion order, followed by a "done" summary.
+    """
+    succeeded = failed = 0
+    limit = max(1, request.concurrency or BATCH_CONCURRENCY)
+    streams = [batch_item_events(request, index, item) for index, item in enumerate(request.items)]
+    async for ok, event in merge_streams(streams, limit):
+        if ok:
+            succeeded += 1
+        else:
+            failed += 1
+        yield event
+    yield stream_event("done", succeeded=succeeded, failed=failed)
+
+async def fetch_yt_transcript(request):
+    """
+    Returns the transcript for the requested URL, running the yt binary only when the
+    video's transcript is not cached yet.
+    """
+    video_id = youtube_video_id(request.url)
+    if video_id and not request.noCache:
+        transcript = await asyncio.to_thread(yt_transcript_cache.get, video_id)
+        if transcript is not None:
+            logging.info(f"Using cached transcript for video {video_id}")
+            return transcript
+
+    async def fetch():
+        transcript = await run_yt(request)
+        if video_id and transcript:
+            await asyncio.to_thread(yt_transcript_cache.put, video_id, transcript, "yt")
+        return transcript
+
+    # Requests for the same video share one yt run
+    return await single_flight.do(("yt", video_id or request.url, request.goCompatibility), fetch)
+
+async def run_yt(request):
+    """
+    Runs the yt binary against the requested URL and returns the transcript.
+    """
+    with stage("yt"):
+        return await run_command(executor_for(request.goCompatibility).yt(request.url))
+
+async def fetch_ts_transcript(request):
+    """
+    Returns the transcript for the requested audio file, running whisper only when the
+    file hasn't been transcribed with the same settings before.
+    """
+    cache_key = await asyncio.to_thread(ts_cache_key, request.path, *whisper_settings(request))
+    if cache_key and not request.noCache:
+        transcript = await asyncio.to_thread(ts_transcript_cache.get, cache_key)
+        if transcript is not None:
+            logging.info(f"Using cached transcript for {request.path}")
+            return transcript
+
+    async def transcribe():
+        transcript = await run_ts(request)
+        if cache_key and transcript:
+            await asyncio.to_thread(ts_transcript_cache.put, cache_key, transcript, "ts")
+        return transcript
+
+    # Requests for the same recording share one whisper run
+    return await single_flight.do(("ts", cache_key or request.path, request.goCompatibility), transcribe)
+
+def whisper_settings(request):
+    """
+    Everything besides the audio itself that changes what whisper produces.
+    """
+    executor = executor_for(request.goCompatibility)
+    split = "segmented" if use_segments(request, executor) else "whole"
+    if use_whisper_pool(executor):
+        return "pool", whisper_pool.backend, whisper_pool.model, split, TIMESTAMP_PATTERN
+    return executor.name, executor.ts_path, "txt", split, TIMESTAMP_PATTERN
+
+def use_whisper_pool(executor):
+    # The pool runs on this machine, so it can't stand in for whisper inside WSL
+    return whisper_pool is not None and whisper_pool.available and executor.runs_locally
+
+def use_segments(request, executor):
+    # Segments are cut with the local ffmpeg, so WSL setups transcribe in one piece
+    return request.segmented and executor.runs_locally and ffmpeg_available()
+
+async def whisper_cli(executor, path, pool="whisper", threads=None):
+    """
+    Runs the whisper CLI on an audio file and returns its timestamped lines.
+    """
+    # Every run writes to its own directory, removed whether whisper finishes, fails or
+    # is killed, so concurrent runs don't clean up each other's output
+    os.makedirs(TS_OUTPUT_PATH, exist_ok=True)
+    output_dir = tempfile.mkdtemp(dir=TS_OUTPUT_PATH)
+    try:
+        transcript = await run_command(executor.whisper(path, output_dir, threads), pool=pool)
+    finally:
+        await asyncio.to_thread(shutil.rmtree, output_dir, ignore_errors=True)
+    if not executor.timestamped_transcripts:
+        return transcript
+    return '\n'.join(re.findall(f'{TIMESTAMP_PATTERN}.*', transcript, re.MULTILINE))
+
+async def transcribe_in_segments(path, transcribe, workers):
+    """
+    Transcribes the audio file in segments cut at pauses, up to `workers` at a time.
+    Returns None when the file is too short to be worth splitting.
+    """
+    os.makedirs(TS_OUTPUT_PATH, exist_ok=True)
+    segment_dir = tempfile.mkdtemp(dir=TS_OUTPUT_PATH)
+    try:
+        return await transcribe_segmented(path, segment_dir, transcribe, workers)
+    finally:
+        await asyncio.to_thread(shutil.rmtree, segment_dir, ignore_errors=True)
+
+async def run_ts(request):
+    """
+    Runs whisper on the requested audio file and returns the timestamped transcript.
+    Uses the resident whisper pool when it's enabled, the whisper CLI otherwise. With
+    segmented, long files are cut at pauses and the segments transcribed in parallel.
+    """
+    executor = executor_for(request.goCompatibility)
+    if use_whisper_pool(executor):
+        logging.info(f"Transcribing {request.path} in the whisper pool")
+        try:
+            async with scheduler.slot("whisper"):
+                with stage("whisper"):
+                    transcript = None
+                    if use_segments(request, executor):
+                        transcript = await transcribe_in_segments(request.path, whisper_pool.transcribe, whisper_pool.workers)
+                    if transcript is None:
+                        transcript = await whisper_pool.transcribe(request.path)
+                    return transcript
+        except WhisperPoolError:
+            if whisper_pool.available:
+                raise
+            # The model couldn't be loaded, use the CLI from now on
+    logging.info(f"Transcribing {executor.path(request.path)} with the {executor.name} backend")
+    if use_segments(request, executor):
+        # Segments hold one whisper slot together and run their processes in the
+        # segments pool, each with an equal share of the cores
+        workers = scheduler.pools["segments"].limit
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        async with scheduler.slot("whisper"):
+            with stage("whisper"):
+                transcript = await transcribe_in_segments(
+                    request.path, lambda path: whisper_cli(executor, path, "segments", threads), workers
+                )
+        if transcript is not None:
+            return transcript
+    with stage("whisper"):
+        return await whisper_cli(executor, request.path)
+
+async def transcript_lines(request):
+    """
+    Yields the lines of the transcript of the requested audio file. Lines of the
+    whisper CLI are passed on as it prints them; cached transcripts and those from the
+    whisper pool or a segmented run arrive whole.
+    """
+    executor = executor_for(request.goCompatibility)
+    cache_key = await asyncio.to_thread(ts_cache_key, request.path, *whisper_settings(request))
+    transcript = None
+    if cache_key and not request.noCache:
+        transcript = await asyncio.to_thread(ts_transcript_cache.get, cache_key)
+    if transcript is None and (not executor.timestamped_transcripts or use_whisper_pool(executor) or use_segments(request, executor)):
+        transcript = await fetch_ts_transcript(request)
+    if transcript is not None:
+        for line in transcript.splitlines():
+            yield line
+        return
+    logging.info(f"Transcribing {executor.path(request.path)} with the {executor.name} backend, pipelined")
+    # Requests for the same recording share one whisper run
+    lines = single_flight.stream(
+        ("ts_lines", cache_key or request.path, request.goCompatibility),
+        lambda: whisper_cli_lines(executor, request.path, cache_key)
+    )
+    async for line in lines:
+        yield line
+
+async def whisper_cli_lines(executor, path, cache_key):
+    """
+    Runs the whisper CLI on an audio file and yields its timestamped lines as whisper
+    prints them. The complete transcript is cached once whisper is done.
+    """
+    os.makedirs(TS_OUTPUT_PATH, exist_ok=True)
+    output_dir = tempfile.mkdtemp(dir=TS_OUTPUT_PATH)
+    timestamped = re.compile(TIMESTAMP_PATTERN)
+    lines = []
+    pending = ""
+    try:
+        with stage("whisper"):
+            # Unbuffered, so the lines arrive as whisper recognizes them and not in blocks
+            output = stream_command(executor.whisper(path, output_dir), pool="whisper", env={"PYTHONUNBUFFERED": "1"})
+            async for text in output:
+                *complete, pending = (pending + text).split("\n")
+                for line in complete:
+                    if timestamped.match(line):
+                        lines.append(line)
+                        yield line
+        if timestamped.match(pending):
+            lines.append(pending)
+            yield pending
+    finally:
+        await asyncio.to_thread(shutil.rmtree, output_dir, ignore_errors=True)
+    transcript = "\n".join(lines)
+    if cache_key and transcript:
+        await asyncio.to_thread(ts_transcript_cache.put, cache_key, transcript, "ts")
+
+async def pipelined_map(request, patterns, lines):
+    """
+    Packs transcript lines into chunks as they arrive and runs every pattern on each
+    chunk as soon as it is complete, up to request.concurrency runs at a time, while
+    the transcription goes on. Yields ("map", pattern index, chunk index, output, cache
+    status) as runs finish, ("map_failed", pattern index, error) when a pattern fails
+    on a chunk, after which it isn't run on further chunks, and ("transcribed", chunk
+    count) after the last line. Raises the error once every pattern has failed.
+    """
+    chunker = TranscriptChunker(*chunk_settings(request))
+    semaphore = asyncio.Semaphore(pattern_concurrency(request))
+    results = asyncio.Queue()
+    tasks = []
+    failed = set()
+    chunk_count = 0
+
+    async def run_chunk(index, chunk_index, chunk):
+        try:
+            async with semaphore:
+                if index in failed:
+                    # The pattern failed on another chunk while this run waited for its turn
+                    results.put_nowait(("map_skipped", index))
+                    return
+                output, cache_status = await cached_pattern(patterns[index], request.model, chunk, request.goCompatibility, request.noCache)
+            results.put_nowait(("map", index, chunk_index, output, cache_status))
+        except Exception as e:
+            results.put_nowait(("map_failed", index, e))
+
+    def dispatch(chunk):
+        nonlocal chunk_count
+        for index in range(len(patterns)):
+            if index not in failed:
+                tasks.append(asyncio.create_task(run_chunk(index, chunk_count, chunk)))
+        chunk_count += 1
+
+    async def read():
+        try:
+            async for line in lines:
+                for chunk in chunker.add_line(line):
+                    dispatch(chunk)
+            last = chunker.finish()
+            if last is not None or not chunk_count:
+                # An empty transcript still runs the patterns once, as it would unpipelined
+                dispatch(last or "")
+            results.put_nowait(("transcribed", chunk_count))
+        except Exception as e:
+            results.put_nowait(("failed", e))
+
+    reader = asyncio.create_task(read())
+    transcribed = False
+    finished = 0
+    try:
+        while not transcribed or finished < len(tasks):
+            result = await results.get()
+            if result[0] == "failed":
+                raise result[1]
+            if result[0] == "transcribed":
+                transcribed = True
+                yield result
+                continue
+            finished += 1
+            if result[0] == "map_failed":
+                _, index, error = result
+                if index in failed:
+                    # A run on another chunk that had already started failed as well
+                    continue
+                failed.add(index)
+                if len(failed) == len(patterns):
+                    raise error
+                yield result
+            elif result[0] == "map" and result[1] not in failed:
+                yield result
+    finally:
+        # Stop whisper and the chunk runs, and wait until their processes are gone
+        for task in [reader, *tasks]:
+            task.cancel()
+        await asyncio.gather(reader, *tasks, return_exceptions=True)
+
+async def pipelined_events(request):
+    """
+    Yields the NDJSON events of a pipelined /ts run. The patterns that read the
+    transcript (the first one when they're chained) are mapped over its chunks while
+    whisper is still transcribing, the reduce pattern merges their partial outputs
+    once the transcript is complete and chained patterns then run as usual.
+    """
+    mapped = request.pattern[:1] if request.stream else request.pattern
+    yield stream_event("stage", stage="transcript")
+    for index, pattern in enumerate(mapped):
+        yield stream_event("stage", stage="map", pattern=pattern, index=index, chunks=None)
+    partials = [{} for _ in mapped]
+    cached = [True] * len(mapped)
+    failed = set()
+    chunk_count = 0
+    async for result in pipelined_map(request, mapped, transcript_lines(request)):
+        if result[0] == "transcribed":
+            chunk_count = result[1]
+            yield stream_event("stage_end", stage="transcript", chunks=chunk_count)
+            continue
+        if result[0] == "map_failed":
+            # Like isolated_events: the other patterns keep running
+            _, index, error = result
+            failed.add(index)
+            logging.error(f"Pattern '{mapped[index]}' failed: {str(error)}")
+            yield stream_event("error", pattern=mapped[index], index=index, detail=str(error))
+            continue
+        _, index, chunk_index, output, cache_status = result
+        partials[index][chunk_index] = output
+        cached[index] = cached[index] and cache_status == "HIT"
+        yield stream_event("map", pattern=mapped[index], index=index, chunk=chunk_index, cached=cache_status == "HIT")
+    succeeded = [(index, pattern) for index, pattern in enumerate(mapped) if index not in failed]
+    for index, pattern in succeeded:
+        yield stream_event("stage_end", stage="map", pattern=pattern, index=index)
+
+    outputs = [None] * len(request.pattern)
+    if chunk_count == 1:
+        # The transcript fit into one chunk, so its map output is the pattern's output
+        for index, pattern in succeeded:
+            outputs[index] = partials[index][0]
+            yield stream_event("stage", stage="pattern", pattern=pattern, index=index)
+            yield stream_event("chunk", pattern=pattern, index=index, data=outputs[index])
+            yield stream_event("stage_end", stage="pattern", pattern=pattern, index=index, cached=cached[index])
+    else:
+        streams = [
+            run_events(
+                request, reduce_pattern(request, pattern), pattern, index,
+                "\n\n".join(partials[index][chunk_index] for chunk_index in range(chunk_count)), outputs
+            )
+            for index, pattern in succeeded
+        ]
+        if not request.stream:
+            # Unchained patterns keep running when one fails, a failed reduce stops a chain
+            streams = [isolated_events(mapped[index], index, stream) for (index, _), stream in zip(succeeded, streams)]
+        async for event in merge_streams(streams, pattern_concurrency(request)):
+            yield event
+
+    if request.stream:
+        input_data = outputs[0]
+        for index in range(1, len(request.pattern)):
+            async for event in pattern_events(request, request.pattern[index], index, input_data, outputs):
+                yield event
+            input_data = outputs[index]
+        final_output = input_data or ""
+    else:
+        final_output = "\n\n".join(output for output in outputs if output is not None)
+    yield stream_event("done", output=final_output.strip())
+
+async def stream_pipelined(request):
+    """
+    Like stream_patterns for a pipelined /ts run: errors are reported in-band.
+    """
+    try:
+        async for event in pipelined_events(request):
+            yield event
+    except (subprocess.CalledProcessError, EngineError, QueueFullError, WhisperPoolError) as e:
+        logging.error(f"Error executing streamed command: {str(e)}")
+        yield stream_event("error", detail=str(e))
+
+async def pipelined_output(request):
+    """
+    Runs a pipelined /ts request to the end. Returns the output, the cache status of
+    every pattern that succeeded, combined over its chunks and reduce run as in
+    chunked_pattern, and the patterns that failed.
+    """
+    errors = []
+    cached = {}  # pattern index -> whether every run of the pattern was a cache hit
+    async for line in pipelined_events(request):
+        event = json.loads(line)
+        if event["event"] == "map" or (event["event"] == "stage_end" and event["stage"] == "pattern"):
+            cached[event["index"]] = cached.get(event["index"], True) and event["cached"]
+        elif event["event"] == "error":
+            cached.pop(event["index"], None)
+            errors.append({"pattern": event["pattern"], "detail": event["detail"]})
+        elif event["event"] == "done":
+            if request.noCache:
+                cache_statuses = ["BYPASS"] * len(cached)
             else:
-                final_output += output + "\n\n"  # Concatenate outputs if not streaming
-        
+                cache_statuses = ["HIT" if hit else "MISS" for hit in cached.values()]
+            return event["output"], cache_statuses, errors
+
+def ts_events(request):
+    if request.pipelined:
+        return stream_pipelined(request)
+    return stream_patterns(request, fetch_ts_transcript)
+
+@app.post("/fabric")
+async def fabric(request: FabricRequest, response: Response):
+    """
+    Runs the Fabric binary with the provided command and returns the output.
+    Set streamResponse to receive the output incrementally as NDJSON events.
+    """
+    try:
+        logging.info(f"Running Fabric command with patterns: {request.pattern}")
+        if request.streamResponse:
+            return streaming_response(request)
+        final_output, cache_statuses, errors = await run_patterns(request, request.data)
+        set_cache_headers(response, cache_statuses)
         logging.info("Fabric command executed successfully")
-        return {"output": final_output.strip()}
+        return pattern_response(final_output, errors)
     except subprocess.CalledProcessError as e:
         logging.error(f"Error executing Fabric command: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/fabric/batch")
+async def fabric_batch(request: BatchRequest, x_priority: Optional[str] = Header(None)):
+    """
+    Runs the pattern chain over many inputs, given inline as data or as paths of text
+    files, and streams one NDJSON event per input as it completes. A failing input is
+    reported as an error event and doesn't stop the others. Batches run at batch
+    priority unless the client sends an X-Priority header.
+    """
+    logging.info(f"Running batch of {len(request.items)} inputs with patterns: {request.pattern}")
+    if x_priority is None:
+        current_priority.set("batch")
+    return StreamingResponse(stream_batch(request), media_type="application/x-ndjson")
+
+async def load_models(goCompatibility):
+    if goCompatibility:
+        result = await fabric_listing("--listmodels", executor_for(True), goCompatible=True)
+        pattern = r'^\[(\d+)\]\s*(.+)$'
+        filtered_models = []
+        
+        # Split the result string into lines
+        lines = result.split('\n')
+        
+        for line in lines:
+            line = line.strip()
+            match = re.match(pattern, line)
+            if match:
+                filtered_models.append({"name": match.group(2).strip()})
+        return filtered_models
+
+    result = await fabric_listing("--listmodels", executor_for(False))
+    return [
+        {"name": item['name']} for item in result 
+        if 'name' in item and item['name'] not in [
+            'GPT Models:', 'Local Models:', 'Claude Models:', 'Google Models:'
+        ] and item['name'].strip()
+    ]
+
 @app.get("/models")
 async def get_models(goCompatibility: bool = False):
+    """
+    Lists the available models. The listing is cached and refreshed in the background.
+    """
     try:
         logging.info("Retrieving models")
-        if goCompatibility:
-            goFabric = FABRIC_PATH.replace(".local", "go")
-            if sys.platform in ["darwin", "win32"]:
-                if sys.platform == "win32":
-                    goFabric = goFabric.replace("/home", "c:/Users")
-                    logging.info(f"Using goFabric: {goFabric}")
-                result = execute_fabric_command(command = "--listmodels", path = goFabric, goCompatible=True)
-            else:
-                logging.error(f"Unsupported platform: {sys.platform}")
-                raise HTTPException(status_code=500, detail="Unsupported platform")
-            pattern = r'^\[(\d+)\]\s*(.+)$'
-            filtered_models = []
-            
-            # Split the result string into lines
-            lines = result.split('\n')
-            
-            for line in lines:
-                line = line.strip()
-                match = re.match(pattern, line)
-                if match:
-                    filtered_models.append({"name": match.group(2).strip()})
-        else:
-            if sys.platform in ["darwin", "win32"]:
-                result = execute_fabric_command(command = "--listmodels", path = FABRIC_PATH)
-            else:
-                logging.error(f"Unsupported platform: {sys.platform}")
-                raise HTTPException(status_code=500, detail="Unsupported platform")
-            if isinstance(result, list):
-                filtered_models = [
-                    {"name": item['name']} for item in result 
-                    if 'name' in item and item['name'] not in [
-                        'GPT Models:', 'Local Models:', 'Claude Models:', 'Google Models:'
-                    ] and item['name'].strip()
-                ]
-            
+        filtered_models = await listing_cache.get(("models", goCompatibility), lambda: load_models(goCompatibility))
         logging.info(f"Models retrieved successfully. Count: {len(filtered_models)}")
         return {
             "data": {
@@ -220,218 +1118,252 @@ async def set_model(request: Model, goCompatibility: bool = False):
     """
     try:
         logging.info(f"Setting model to: {request.model}")
-        if goCompatibility:
-            goFabric = FABRIC_PATH.replace(".local", "go")
-            if sys.platform == "darwin":
-                output = await run_command([goFabric, "--changeDefaultModel", request.model])
-            elif sys.platform == "win32":
-                goFabric = goFabric.replace("/home", "c:/Users")
-                powershell_command = f"{goFabric} --changeDefaultModel '{request.model}'"
-                output = await run_command(["C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe", "-WindowStyle", "Hidden", "-Command", powershell_command])
-            logging.info("Model set successfully")
-            return {"output": output}
-        else:
-            if sys.platform == "darwin":
-                output = await run_command([FABRIC_PATH, "--changeDefaultModel", request.model])
-            elif sys.platform == "win32":
-                powershell_command = f"wsl -e {FABRIC_PATH} --changeDefaultModel '{request.model}'"
-                output = await run_command(["C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe", "-WindowStyle", "Hidden", "-Command", powershell_command])
-            logging.info("Model set successfully")
-            return {"output": output}
+        output = await run_command(executor_for(goCompatibility).fabric("--changeDefaultModel", request.model))
+        # Only now, so a listing loaded while the command ran can't keep the old default
+        listing_cache.invalidate()
+        logging.info("Model set successfully")
+        return {"output": output}
     except subprocess.CalledProcessError as e:
         logging.error(f"Error setting model: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.post("/yt")
-async def yt(request: YTRequest):
+async def yt(request: YTRequest, response: Response):
     """
     Runs the yt binary with the provided command and returns the output.
+    Set streamResponse to receive the output incrementally as NDJSON events.
     """
     try:
         logging.info(f"Running YT command with URL: {request.url}")
-        if request.goCompatibility:
-            goYT = YT_PATH.replace(".local", "go")
-            if sys.platform == "darwin":
-                transcript = await run_command([goYT, request.url])
-            elif sys.platform == "win32":
-                goYT = goYT.replace("/home", "c:/Users")
-                transcript = await run_command([goYT, request.url])
-        else:
-            if sys.platform == "darwin":
-                transcript = await run_command([YT_PATH, request.url])
-            elif sys.platform == "win32":
-                transcript = await run_command(["wsl", "-e", YT_PATH, request.url])
-        
+        if request.streamResponse:
+            return streaming_response(request, fetch_yt_transcript)
+        with stage("transcript"):
+            transcript = await fetch_yt_transcript(request)
         logging.info("YT command executed successfully, running Fabric command")
-        
-        final_output = ""
-        input_data = transcript
-        
-        for pattern in request.pattern:
-            if request.goCompatibility:
-                goFabric = FABRIC_PATH.replace(".local", "go")
-                if sys.platform == "darwin":
-                    with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-                        temp_file.write(input_data)
-                        temp_file_path = temp_file.name
-                    command = f"cat '{temp_file_path}' | {goFabric} -sp '{pattern}' --model {request.model}"
-                    output = await run_command(["sh", "-c", command])
-                elif sys.platform == "win32":
-                    goFabric = goFabric.replace("/home", "c:/Users")
-                    with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-                        temp_file.write(input_data)
-                        temp_file_path = temp_file.name
-                    powershell_command = f"gc '{temp_file_path}' | {goFabric} -sp '{pattern}' --model {request.model}"
-                    output = await run_command(["C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe", "-WindowStyle", "Hidden", "-Command", powershell_command])
-                    os.unlink(temp_file_path)
-            else:
-                if sys.platform == "darwin":
-                    output = await run_command([FABRIC_PATH, "-sp", pattern, "--text", input_data, "--model", request.model])
-                elif sys.platform == "win32":
-                    with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-                        temp_file.write(input_data)
-                        temp_file_path = temp_file.name
-                    powershell_command = f"gc '{temp_file_path}' | wsl -e {FABRIC_PATH} -sp '{pattern}' --model {request.model}"
-                    output = await run_command(["C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe", "-WindowStyle", "Hidden", "-Command", powershell_command])
-                    os.unlink(temp_file_path)
-                
-                
-            if request.stream:
-                input_data = output  # Use the output of the current pattern as the input for the next
-                final_output = output  # The final output is the last pattern's output
-            else:
-                final_output += output + "\n\n"  # Concatenate outputs if not streaming
-        
+        final_output, cache_statuses, errors = await run_patterns(request, transcript)
+        set_cache_headers(response, cache_statuses)
         logging.info("Fabric command executed successfully")
-        return {"output": final_output.strip()}
+        return pattern_response(final_output, errors)
     except subprocess.CalledProcessError as e:
         logging.error(f"Error executing YT or Fabric command: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.post("/ts")
-async def ts(request: TSRequest):
+async def ts(request: TSRequest, response: Response):
     """
     Runs the ts binary with the provided command and returns the output.
+    Set streamResponse to receive the output incrementally as NDJSON events, and
+    pipelined to start on the patterns while whisper is still transcribing.
     """
     try:
         logging.info(f"Running TS command with file: {request.path}")
-        if request.goCompatibility:
-            if sys.platform == "darwin":
-                transcript = await run_command(["whisper", request.path, "--output_format", "txt", "--output_dir", TS_OUTPUT_PATH])
-                ## clean up the ouput folder
-                for filename in os.listdir(TS_OUTPUT_PATH):
-                    file_path = os.path.join(TS_OUTPUT_PATH, filename)
-                    try:
-                        if os.path.isfile(file_path) or os.path.islink(file_path):
-                            os.unlink(file_path)
-
-                        elif os.path.isdir(file_path):
-                            shutil.rmtree(file_path)
-                    except Exception as e:
-                        logging.info('Failed to delete %s. Reason: %s' % (file_path, e))
-                final_output = ""
-                timestamp_pattern = r'^\[\d{1,2}:\d{2}\.\d{3} --> \d{1,2}:\d{2}\.\d{3}\]'
-                input_data = '\n'.join(re.findall(f'{timestamp_pattern}.*', transcript, re.MULTILINE))
-            elif sys.platform == "win32":
-                drive_pattern = r'(?i)([a-z]):\\?\\?'
-                corrected_path = re.sub(drive_pattern, replace_drive, request.path).replace("\\", "/")
-                logging.info(f"Corrected path: {corrected_path}")
-                powershell_command =  f"whisper '{corrected_path}'"
-                transcript = await run_command(["C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe", "-WindowStyle", "Hidden", "-Command", powershell_command])
-                final_output = ""
-                input_data = transcript
-        else:
-            if sys.platform == "darwin":
-                transcript = await run_command([TS_PATH, request.path, "--output_format", "txt", "--output_dir", TS_OUTPUT_PATH])
-                ## clean up the ouput folder
-                for filename in os.listdir(TS_OUTPUT_PATH):
-                    file_path = os.path.join(TS_OUTPUT_PATH, filename)
-                    try:
-                        if os.path.isfile(file_path) or os.path.islink(file_path):
-                            os.unlink(file_path)
-                        elif os.path.isdir(file_path):
-                            shutil.rmtree(file_path)
-                    except Exception as e:
-                        logging.info('Failed to delete %s. Reason: %s' % (file_path, e))
-                final_output = ""
-                timestamp_pattern = r'^\[\d{1,2}:\d{2}\.\d{3} --> \d{1,2}:\d{2}\.\d{3}\]'
-                input_data = '\n'.join(re.findall(f'{timestamp_pattern}.*', transcript, re.MULTILINE))
-            elif sys.platform == "win32":
-                drive_pattern = r'(?i)([a-z]):\\?\\?'
-                corrected_path = re.sub(drive_pattern, replace_drive, request.path).replace("\\", "/")
-                logging.info(f"Corrected path: {corrected_path}")
-                powershell_command =  f"wsl --cd /tmp -e {TS_PATH} '{corrected_path}'"
-                transcript = await run_command(["C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe", "-WindowStyle", "Hidden", "-Command", powershell_command])
-                final_output = ""
-                input_data = transcript
-        
+        if request.streamResponse:
+            return StreamingResponse(ts_events(request), media_type="application/x-ndjson")
+        if request.pipelined:
+            final_output, cache_statuses, errors = await pipelined_output(request)
+            if errors and len(errors) == len(request.pattern):
+                raise HTTPException(status_code=500, detail=errors[0]["detail"])
+            set_cache_headers(response, cache_statuses)
+            return pattern_response(final_output, errors)
+        with stage("transcript"):
+            input_data = await fetch_ts_transcript(request)
         logging.info("TS command executed successfully, running Fabric command")
-        
-        for pattern in request.pattern:
-            if request.goCompatibility:
-                goFabric = FABRIC_PATH.replace(".local", "go")
-                if sys.platform == "darwin":
-                    with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-                        temp_file.write(input_data)
-                        temp_file_path = temp_file.name
-                    command = f"cat '{temp_file_path}' | {goFabric} -sp '{pattern}' --model {request.model}"
-                    output = await run_command(["sh", "-c", command])
-                elif sys.platform == "win32":
-                    goFabric = goFabric.replace("/home", "c:/Users")
-                    with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-                        temp_file.write(input_data)
-                        temp_file_path = temp_file.name
-                    powershell_command = f"gc '{temp_file_path}' | {goFabric} -sp '{pattern}' --model {request.model}"
-                    output = await run_command(["C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe", "-WindowStyle", "Hidden", "-Command", powershell_command])
-                    os.unlink(temp_file_path)
-            else:
-                if sys.platform == "darwin":
-                    with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-                        temp_file.write(input_data)
-                        temp_file_path = temp_file.name
-                    command = f"cat '{temp_file_path}' | {FABRIC_PATH} -sp '{pattern}' --model {request.model}"
-                    output = await run_command(["sh", "-c", command])
-                elif sys.platform == "win32":
-                    with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-                        temp_file.write(input_data)
-                        temp_file_path = temp_file.name
-                    powershell_command = f"gc '{temp_file_path}' | wsl -e {FABRIC_PATH} -sp '{pattern}' --model {request.model}"
-                    output = await run_command(["C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe", "-WindowStyle", "Hidden", "-Command", powershell_command])
-                    os.unlink(temp_file_path)
-            
-            if request.stream:
-                input_data = output  # Use the output of the current pattern as the input for the next
-                final_output = output  # The final output is the last pattern's output
-            else:
-                final_output += output + "\n\n"  # Concatenate outputs if not streaming
-        
+        final_output, cache_statuses, errors = await run_patterns(request, input_data)
+        set_cache_headers(response, cache_statuses)
         logging.info("Fabric command executed successfully")
-        return {"output": final_output.strip()}
+        return pattern_response(final_output, errors)
     except subprocess.CalledProcessError as e:
         logging.error(f"Error executing YT or Fabric command: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Requests accepted by the job API and the events they're run through
+JOB_KINDS = {
+    "fabric": (FabricRequest, lambda request: stream_patterns(request, None)),
+    "yt": (YTRequest, lambda request: stream_patterns(request, fetch_yt_transcript)),
+    "ts": (TSRequest, ts_events),
+}
+
+async def run_job(job, report_progress):
+    """
+    Runs a job through the streaming pipeline and records every stage as its progress.
+    Returns the same body the synchronous endpoint would.
+    """
+    request_model, events = JOB_KINDS[job["kind"]]
+    request = request_model.parse_raw(job["request"])
+    progress = {"stage": None, "pattern": None, "patterns": len(request.pattern), "patterns_done": 0}
+    errors = []
+    async for line in events(request):
+        event = json.loads(line)
+        if event["event"] == "stage":
+            progress.update(stage=event["stage"], pattern=event.get("pattern"))
+            if event["stage"] == "map":
+                progress.update(chunks=event["chunks"], chunks_done=0)
+        elif event["event"] == "map":
+            progress["chunks_done"] += 1
+        elif event["event"] == "stage_end" and event["stage"] == "pattern":
+            progress["patterns_done"] += 1
+        elif event["event"] == "error":
+            if "pattern" not in event:
+                raise JobError(event["detail"])
+            errors.append({"pattern": event["pattern"], "detail": event["detail"]})
+            progress["patterns_done"] += 1
+        elif event["event"] == "done":
+            if errors and len(errors) == len(request.pattern):
+                raise JobError(errors[0]["detail"])
+            return pattern_response(event["output"], errors)
+        else:
+            continue
+        await report_progress(progress)
+    raise JobError("The pattern run ended without a result")
+
+job_queue = JobQueue(
+    JobStore(JOB_DB_PATH),
+    run_job,
+    workers=int(os.environ.get("FABRIC_CONNECTOR_JOB_WORKERS", 2)),
+    result_ttl=float(os.environ.get("FABRIC_CONNECTOR_JOB_RESULT_TTL", 86400)),
+    deadline=JOB_DEADLINE,
+    # Worker processes of server.py share the job database
+    worker_id=WORKER_ID if SHARED_STATE else None,
+    stale_after=HEARTBEAT_TIMEOUT,
+)
+
+@app.on_event("startup")
+async def start_shared_limits():
+    # Before the job queue, whose jobs may need process slots right away
+    if shared_limits is not None:
+        await shared_limits.start()
+
+@app.on_event("startup")
+async def start_job_queue():
+    await job_queue.start()
+
+@app.on_event("shutdown")
+async def stop_job_queue():
+    await job_queue.stop()
+    job_queue.store.close()
+
+@app.on_event("shutdown")
+async def stop_shared_limits():
+    if shared_limits is not None:
+        await shared_limits.stop()
+    metrics.mark_process_dead()
+
+async def submit_job(kind, request):
+    job_id = await job_queue.submit(kind, request.dict(), current_priority.get())
+    logging.info(f"Queued {kind} job {job_id}")
+    return {"data": {"id": job_id, "status": QUEUED}}
+
+@app.post("/jobs/fabric", status_code=202)
+async def submit_fabric_job(request: FabricRequest):
+    """
+    Queues a /fabric request and returns its job ID immediately.
+    """
+    return await submit_job("fabric", request)
+
+@app.post("/jobs/yt", status_code=202)
+async def submit_yt_job(request: YTRequest):
+    """
+    Queues a /yt request and returns its job ID immediately.
+    """
+    return await submit_job("yt", request)
+
+@app.post("/jobs/ts", status_code=202)
+async def submit_ts_job(request: TSRequest):
+    """
+    Queues a /ts request and returns its job ID immediately.
+    """
+    return await submit_job("ts", request)
+
+@app.get("/jobs")
+async def list_jobs(status: Optional[str] = None, limit: int = 100):
+    """
+    Lists the most recent jobs, optionally only those with the given status.
+    """
+    jobs = await asyncio.to_thread(job_queue.store.list, status, max(1, min(limit, 1000)))
+    counts = await asyncio.to_thread(job_queue.store.counts)
+    return {"data": {"jobs": [job_info(job) for job in jobs], "counts": counts}}
+
+async def find_job(job_id):
+    job = await asyncio.to_thread(job_queue.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Returns the status and progress of a job.
+    """
+    return {"data": job_info(await find_job(job_id))}
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """
+    Returns the output of a finished job. Results are kept for
+    FABRIC_CONNECTOR_JOB_RESULT_TTL seconds after the job finished.
+    """
+    job = await find_job(job_id)
+    if job["status"] in (QUEUED, RUNNING):
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    if job["status"] == CANCELLED:
+        raise HTTPException(status_code=409, detail="Job was cancelled")
+    if job["status"] != SUCCEEDED:
+        raise HTTPException(status_code=500, detail=job["error"])
+    return json.loads(job["result"])
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """
+    Cancels a queued or running job, or deletes a finished one.
+    """
+    job = await find_job(job_id)
+    if job["status"] in (QUEUED, RUNNING) and await job_queue.cancel(job_id):
+        return {"message": "Job cancelled"}
+    await asyncio.to_thread(job_queue.store.delete, job_id)
+    return {"message": "Job deleted"}
+
+async def load_patterns(goCompatibility):
+    if goCompatibility:
+        return await fabric_listing("--listpatterns", executor_for(True), goCompatible=True)
+    return await fabric_listing("--list", executor_for(False))
+
 @app.get("/patterns")
 async def get_patterns(goCompatibility: bool = False):
+    """
+    Lists the available patterns. The listing is cached and refreshed in the background.
+    """
     logging.info("Retrieving patterns")
-    if goCompatibility:
-        goFabric = FABRIC_PATH.replace(".local", "go")
-        if sys.platform == "darwin":
-            result = execute_fabric_command(command = "--listpatterns", path = goFabric, goCompatible=True)
-        elif sys.platform == "win32":
-            goFabric = goFabric.replace("/home", "c:/Users")
-            result = execute_fabric_command(command = "--listpatterns", path = goFabric, goCompatible=True)
-    else:
-        if sys.platform == "darwin":
-            result = execute_fabric_command("--list", path = FABRIC_PATH)
-        elif sys.platform == "win32":
-            result = execute_fabric_command("--list", path = FABRIC_PATH)
-    if isinstance(result, list):
-        logging.info("Patterns retrieved successfully")
-        return {"data": {"patterns": result}}
-    else:
-        logging.error(f"Error retrieving patterns: {str(result)}")
-        raise HTTPException(status_code=500, detail=str(result))
+    try:
+        result = await listing_cache.get(("patterns", goCompatibility), lambda: load_patterns(goCompatibility))
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error retrieving patterns: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    logging.info("Patterns retrieved successfully")
+    return {"data": {"patterns": result}}
+
+@app.get("/patterns/index")
+async def get_pattern_index():
+    """
+    Lists the patterns straight from the in-memory pattern index, without running fabric.
+    """
+    return {"data": {"patterns": pattern_index.list(), "last_scan": pattern_index.last_scan}}
+
+@app.get("/patterns/search")
+async def search_patterns(q: str, limit: Optional[int] = None):
+    """
+    Case-insensitive substring search over pattern names and descriptions.
+    """
+    return {"data": {"patterns": pattern_index.search(q, limit)}}
+
+@app.get("/pattern/{name}")
+async def get_pattern(name: str):
+    """
+    Returns a pattern's system.md content along with its index entry.
+    """
+    entry = pattern_index.get(name)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Pattern '{name}' not found")
+    return {"data": entry}
 
 @app.post("/update_pattern")
 async def update_pattern(request: UpdatePatternRequest):
@@ -452,6 +1384,11 @@ async def update_pattern(request: UpdatePatternRequest):
         with open(pattern_file_path, 'w', encoding='utf-8') as f:
             f.write(request.content)
 
+        # Results produced with the old pattern text are no longer valid
+        await asyncio.to_thread(result_cache.invalidate, request.pattern)
+        listing_cache.invalidate()
+        await asyncio.to_thread(pattern_index.refresh, request.pattern)
+
         if file_existed:
             logging.info(f"Pattern '{request.pattern}' updated successfully")
             return {"message": f"Pattern '{request.pattern}' updated successfully"}
@@ -473,14 +1410,18 @@ async def delete_pattern(request: DeletePatternRequest):
     """
     try:
         pattern_folder_path = os.path.join(PATTERN_PATH, request.pattern)
+        await asyncio.to_thread(result_cache.invalidate, request.pattern)
+        listing_cache.invalidate()
         
         if os.path.exists(pattern_folder_path):
             if os.path.isdir(pattern_folder_path):
                 shutil.rmtree(pattern_folder_path)
+                await asyncio.to_thread(pattern_index.refresh, request.pattern)
                 logging.info(f"Pattern folder '{request.pattern}' deleted successfully")
                 return {"message": f"Pattern folder '{request.pattern}' deleted successfully"}
             else:
                 os.remove(pattern_folder_path)
+                await asyncio.to_thread(pattern_index.refresh, request.pattern)
                 logging.info(f"Pattern file '{request.pattern}' deleted successfully")
                 return {"message": f"Pattern file '{request.pattern}' deleted successfully"}
         else:
@@ -497,12 +1438,104 @@ async def delete_pattern(request: DeletePatternRequest):
         logging.error(f"Unexpected error: {e}")
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
+@app.get("/cache")
+async def get_cache_stats():
+    """
+    Returns the size of the result and transcript caches.
+    """
+    return {
+        "data": {
+            "results": await asyncio.to_thread(result_cache.stats),
+            "yt_transcripts": await asyncio.to_thread(yt_transcript_cache.stats),
+            "ts_transcripts": await asyncio.to_thread(ts_transcript_cache.stats),
+        }
+    }
+
+@app.post("/cache/invalidate")
+async def invalidate_cache(request: InvalidateCacheRequest):
+    """
+    Drops cached results for a single pattern, or all cached results when no pattern is given.
+    """
+    await asyncio.to_thread(result_cache.invalidate, request.pattern)
+    if request.pattern:
+        logging.info(f"Result cache invalidated for pattern '{request.pattern}'")
+        return {"message": f"Cache invalidated for pattern '{request.pattern}'"}
+    logging.info("Result cache cleared")
+    return {"message": "Cache cleared"}
+
+@app.get("/scheduler")
+async def get_scheduler_stats():
+    """
+    Returns the running processes, queue depth and wait times of every scheduler pool,
+    how many requests joined identical work that was already in flight and the state of
+    the whisper pool. With several workers, "shared" holds the slots taken by all of them
+    while the rest describes the worker that answered.
+    """
+    stats = {"pools": scheduler.stats(), "single_flight": single_flight.stats()}
+    if whisper_pool is not None:
+        stats["whisper_pool"] = whisper_pool.stats()
+    if shared_limits is not None:
+        stats["shared"] = await asyncio.to_thread(shared_limits.stats)
+    return {"data": stats}
+
+# Gauges read from the scheduler, caches and job store when metrics are scraped
+metrics.gauge_collector("scheduler_running", "Processes running per scheduler pool", "pool",
+                        lambda: {name: pool["running"] for name, pool in scheduler.stats().items()})
+metrics.gauge_collector("scheduler_queued", "Requests waiting for a process slot per scheduler pool", "pool",
+                        lambda: {name: pool["queued"] for name, pool in scheduler.stats().items()})
+metrics.gauge_collector("cache_bytes", "Size of the on-disk caches", "cache", lambda: {
+    "results": result_cache.stats()["bytes"],
+    "yt_transcripts": yt_transcript_cache.stats()["bytes"],
+    "ts_transcripts": ts_transcript_cache.stats()["bytes"],
+})
+metrics.gauge_collector("jobs", "Jobs per status", "status", lambda: job_queue.store.counts())
+metrics.gauge_collector("single_flight_in_flight", "Shared executions in flight", "kind",
+                        lambda: {"all": single_flight.stats()["in_flight"]})
+
+@app.on_event("startup")
+async def start_whisper_pool():
+    # Load the model in the background now rather than on the first /ts request
+    if whisper_pool is not None:
+        await whisper_pool.start()
+
+@app.on_event("shutdown")
+async def stop_whisper_pool():
+    if whisper_pool is not None:
+        await whisper_pool.stop()
+
+@app.on_event("startup")
+async def start_metrics_server():
+    port = os.environ.get("FABRIC_CONNECTOR_METRICS_PORT")
+    # With several workers server.py serves the metrics port for all of them
+    if port and not SHARED_STATE:
+        metrics.start_metrics_server(int(port))
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Returns the metrics in the Prometheus text format.
+    """
+    body, content_type = await asyncio.to_thread(metrics.render)
+    if body is None:
+        raise HTTPException(status_code=501, detail="prometheus_client is not installed")
+    return Response(content=body, headers={"Content-Type": content_type})
+
+@app.on_event("startup")
+async def load_api_key_on_startup():
+    # Registered last, so "API ready" is marked after the other startup handlers ran
+    await asyncio.to_thread(load_api_key)
+    startup_report.mark("API ready")
+
 server = None
 
+# Seconds requests in flight get to finish when the server stops before they're cancelled
+SHUTDOWN_TIMEOUT = float(os.environ.get("FABRIC_CONNECTOR_SHUTDOWN_TIMEOUT", 10))
+
 def start_api_server():
     global server
     logging.info("Starting API server")
-    config = uvicorn.Config(app, host="0.0.0.0", port=49152, loop="asyncio", log_config=None)
+    config = uvicorn.Config(app, host="0.0.0.0", port=49152, loop="asyncio", log_config=None,
+                            timeout_graceful_shutdown=SHUTDOWN_TIMEOUT)
     server = uvicorn.Server(config)
     try:
         server.run()
@@ -510,10 +1543,24 @@ def start_api_server():
         logging.error(f"Error starting API server: {str(e)}")
         raise
 
+def start_api_thread():
+    """
+    Serves the API from a daemon thread, so it accepts requests while the caller goes
+    on to set up the tray application.
+    """
+    thread = threading.Thread(target=start_api_server, daemon=True)
+    thread.start()
+    return thread
+
 def stop_api_server():
+    """
+    Drains the server: it stops accepting connections, gives the requests in flight up
+    to SHUTDOWN_TIMEOUT seconds, cancels what is left and runs the shutdown handlers,
+    which put running jobs back into the queue. start_api_server returns after that.
+    """
     global server
     if server:
-        logging.info("Stopping API server")
+        logging.info(f"Stopping API server, waiting up to {SHUTDOWN_TIMEOUT:g}s for requests in flight")
         server.should_exit = True
     else:
         logging.warning("Attempted to stop API server, but it was not running")
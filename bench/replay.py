@@ -0,0 +1,204 @@
+"""
+Replays a traffic capture recorded with FABRIC_CONNECTOR_CAPTURE, keeping the original
+timing (or a multiple of it with --speed) and request mix, and reports latency per
+endpoint next to the latencies that were captured.
+
+Inputs were only captured as sizes and digests, so the replay sends generated text of
+the same size; identical inputs get identical text, so cache hits and coalescing
+happen as they did. By default the app runs in-process against the stub binaries of
+bench/run.py; --url sends the requests to a running connector instead.
+
+    python bench/replay.py capture.jsonl
+    python bench/replay.py capture.jsonl --speed 4
+    python bench/replay.py capture.jsonl --url http://127.0.0.1:49152 --api-key KEY
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+from collections import defaultdict
+
+from run import REPO_DIR, install_stubs, text_of, percentile
+
+# Endpoints that change settings or patterns; only replayed with --all
+MUTATING = {"/set_model", "/update_pattern", "/delete_pattern", "/cache/invalidate"}
+
+def load_trace(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def replayable(record, include_mutating):
+    """
+    Requests for IDs of the original session (like GET /jobs/{job_id}) can't be
+    replayed, nor can requests that didn't match a route.
+    """
+    endpoint = record["endpoint"]
+    if endpoint == "unmatched" or "{" in endpoint:
+        return False
+    return include_mutating or endpoint not in MUTATING
+
+class BodyBuilder:
+    """
+    Turns the sanitized strings of a captured body back into inputs of the same size.
+    Audio paths become files in directory, one per distinct captured path.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def text(self, value):
+        # The digest goes first, so different inputs of the same size stay different
+        return (value["digest"] + " " + text_of(value["bytes"]))[:value["bytes"]]
+
+    def audio(self, value):
+        path = os.path.join(self.directory, f"{value['digest']}.mp3")
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(value["digest"].encode() + os.urandom(64 * 1024))
+        return path
+
+    def build(self, value, key=None):
+        if isinstance(value, dict) and set(value) == {"bytes", "digest"}:
+            if key == "url":
+                return f"https://youtu.be/{value['digest'][:11]}"
+            if key == "path":
+                return self.audio(value)
+            return self.text(value)
+        if isinstance(value, dict):
+            return {k: self.build(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.build(item) for item in value]
+        return value
+
+async def replay(client, api_key, records, builder, speed):
+    results = []
+    started = time.perf_counter()
+
+    async def send(record):
+        due = record["t"] / speed
+        await asyncio.sleep(max(0.0, due - (time.perf_counter() - started)))
+        # How far behind the schedule the replay is, high values mean this client can't keep up
+        late = time.perf_counter() - started - due
+        body = builder.build(record["body"]) if record["body"] is not None else None
+        sent = time.perf_counter()
+        try:
+            response = await client.request(record["method"], record["endpoint"], params=builder.build(record["query"]) or None,
+                                            json=body, headers={"X-API-Key": api_key})
+            await response.aread()
+            status = response.status_code
+            failed = status >= 400 or b'"event": "error"' in response.content
+        except Exception as e:
+            logging.warning(f"{record['method']} {record['endpoint']} failed: {e}")
+            status, failed = None, True
+        results.append({
+            "endpoint": f"{record['method']} {record['endpoint']}",
+            "latency": time.perf_counter() - sent,
+            "late": late,
+            "status": status,
+            "failed": failed,
+            "captured_ms": record["duration_ms"],
+            "captured_status": record["status"],
+        })
+
+    await asyncio.gather(*(send(record) for record in records))
+    return results, time.perf_counter() - started
+
+def report(results, elapsed):
+    by_endpoint = defaultdict(list)
+    for result in results:
+        by_endpoint[result["endpoint"]].append(result)
+    summary = {}
+    for endpoint, entries in sorted(by_endpoint.items()):
+        latencies = [entry["latency"] for entry in entries]
+        captured = [entry["captured_ms"] / 1000 for entry in entries]
+        summary[endpoint] = {
+            "requests": len(entries),
+            "errors": sum(entry["failed"] for entry in entries),
+            "status_changed": sum(entry["status"] != entry["captured_status"] for entry in entries),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "captured_p50_ms": round(percentile(captured, 0.50) * 1000, 2),
+            "captured_p95_ms": round(percentile(captured, 0.95) * 1000, 2),
+        }
+    return {
+        "requests": len(results),
+        "elapsed_s": round(elapsed, 2),
+        "late_p99_ms": round(percentile([result["late"] for result in results], 0.99) * 1000, 2),
+        "endpoints": summary,
+    }
+
+async def run(args, records, builder):
+    import httpx
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=None) as client:
+            return await replay(client, args.api_key, records, builder, args.speed)
+
+    sys.path.insert(0, REPO_DIR)
+    import api
+
+    await api.start_job_queue()
+    try:
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=None) as client:
+            return await replay(client, api.API_KEY, records, builder, args.speed)
+    finally:
+        await api.stop_job_queue()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", help="Capture file written with FABRIC_CONNECTOR_CAPTURE")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay rate as a multiple of the captured rate")
+    parser.add_argument("--limit", type=int, help="Only replay the first LIMIT requests")
+    parser.add_argument("--all", action="store_true", help="Also replay requests that change settings or patterns")
+    parser.add_argument("--url", help="Replay against a running connector instead of in-process")
+    parser.add_argument("--api-key", help="API key of the connector at --url")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds every stub binary takes (in-process only)")
+    parser.add_argument("--output-bytes", type=int, default=2048, help="Output size of the stub binaries (in-process only)")
+    parser.add_argument("--output", help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+    if args.url and not args.api_key:
+        parser.error("--url needs --api-key")
+
+    trace = load_trace(args.trace)
+    records = sorted((record for record in trace if replayable(record, args.all)), key=lambda record: record["t"])
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        parser.error("the trace has no replayable requests")
+    # Start with the first request rather than waiting for its offset in the capture
+    first = records[0]["t"]
+    records = [{**record, "t": record["t"] - first} for record in records]
+    print(f"Replaying {len(records)} of {len(trace)} requests at {args.speed}x")
+
+    directory = tempfile.mkdtemp(prefix="fabric-connector-replay-")
+    if not args.url:
+        os.environ["BENCH_STUB_LATENCY"] = str(args.latency)
+        os.environ["BENCH_STUB_OUTPUT_BYTES"] = str(args.output_bytes)
+        install_stubs(directory)
+        # Keep api.py from writing the replayed requests to the application log
+        logging.basicConfig(level=logging.WARNING)
+    audio_dir = os.path.join(directory, "audio")
+    os.makedirs(audio_dir)
+    try:
+        results, elapsed = asyncio.run(run(args, records, BodyBuilder(audio_dir)))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    summary = report(results, elapsed)
+    for endpoint, result in summary["endpoints"].items():
+        print(f"{endpoint:<24} {result['requests']:>5} req  p50 {result['p50_ms']:>8.1f}ms  p95 {result['p95_ms']:>8.1f}ms  "
+              f"p99 {result['p99_ms']:>8.1f}ms  (captured p50 {result['captured_p50_ms']:>8.1f}ms  p95 {result['captured_p95_ms']:>8.1f}ms)  "
+              f"errors {result['errors']}  status changed {result['status_changed']}")
+    print(f"Finished in {summary['elapsed_s']}s, dispatch late by up to {summary['late_p99_ms']}ms (p99)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    main()
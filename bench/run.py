@@ -0,0 +1,275 @@
+"""
+Benchmarks the connector's own overhead against stub fabric, yt and whisper binaries.
+
+The FastAPI app is driven in-process through httpx's ASGI transport, so no network or
+real models are involved. Every scenario runs at each concurrency level and reports
+throughput, p50/p95/p99 latency, peak RSS and event-loop lag. Results can be stored as
+a baseline and later runs compared against it:
+
+    python bench/run.py --save-baseline
+    python bench/run.py --compare        # exits with 1 on a regression
+
+Latencies are absolute, so --compare refuses (exit code 2) to compare against a
+baseline recorded with other settings or on another machine.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baselines", "default.json")
+
+def install_stubs(directory):
+    """
+    Links fabric, yt and whisper to the stub script and points the native executor at them.
+    """
+    bin_dir = os.path.join(directory, "bin")
+    os.makedirs(bin_dir)
+    for name in ("fabric", "yt", "whisper"):
+        os.symlink(os.path.join(BENCH_DIR, "stub.py"), os.path.join(bin_dir, name))
+        os.environ[f"FABRIC_CONNECTOR_NATIVE_{'TS' if name == 'whisper' else name.upper()}_PATH"] = os.path.join(bin_dir, name)
+    os.environ["FABRIC_CONNECTOR_EXECUTOR"] = "native"
+    # stub-* models run through the in-process engine against the stub endpoint
+    from stub import PATTERNS, serve_chat_completions
+    engine_server = serve_chat_completions()
+    os.environ["FABRIC_CONNECTOR_ENGINE"] = "http"
+    os.environ["FABRIC_CONNECTOR_ENGINE_BASE_URL"] = f"http://127.0.0.1:{engine_server.server_address[1]}/v1"
+    os.environ["FABRIC_CONNECTOR_ENGINE_API_KEY"] = "bench"
+    os.environ["FABRIC_CONNECTOR_ENGINE_MODELS"] = "stub-*"
+    # Measure the connector's overhead rather than its admission control
+    for pool in ("LLM", "WHISPER", "DEFAULT"):
+        os.environ.setdefault(f"FABRIC_CONNECTOR_{pool}_QUEUE", "4096")
+    os.environ["FABRIC_CONNECTOR_CACHE_DIR"] = os.path.join(directory, "cache")
+    os.environ["FABRIC_CONNECTOR_TS_OUTPUT_PATH"] = os.path.join(directory, "ts_output")
+    os.environ["FABRIC_CONNECTOR_PATTERN_PATH"] = os.path.join(directory, "patterns")
+    os.makedirs(os.environ["FABRIC_CONNECTOR_TS_OUTPUT_PATH"])
+    for pattern in PATTERNS:
+        os.makedirs(os.path.join(directory, "patterns", pattern))
+        with open(os.path.join(directory, "patterns", pattern, "system.md"), "w") as f:
+            f.write(f"# IDENTITY and PURPOSE\n\nApply {pattern} to the input.\n")
+    audio = os.path.join(directory, "audio.mp3")
+    with open(audio, "wb") as f:
+        f.write(os.urandom(64 * 1024))
+    return audio
+
+def text_of(size):
+    sentence = "The quick brown fox jumps over the lazy dog. "
+    return (sentence * (size // len(sentence) + 1))[:size]
+
+def scenarios(audio):
+    """
+    name -> (method, path, json body factory). Bodies get a per-request index so
+    uncached scenarios don't turn into cache hits. fabric_4_patterns runs four
+    different patterns, identical ones would be coalesced into a single run.
+    """
+    from stub import PATTERNS
+    def fabric(size, **extra):
+        return lambda i: {"pattern": ["summarize"], "model": "gpt-4o", "data": f"{i} " + text_of(size),
+                          "stream": True, "noCache": True, **extra}
+    return {
+        "fabric_1k": ("POST", "/fabric", fabric(1024)),
+        "fabric_1m": ("POST", "/fabric", fabric(1024 * 1024)),
+        "fabric_cached": ("POST", "/fabric", lambda i: {"pattern": ["summarize"], "model": "gpt-4o", "data": text_of(1024), "stream": True}),
+        "fabric_stream": ("POST", "/fabric", fabric(1024, streamResponse=True)),
+        "engine": ("POST", "/fabric", fabric(1024, model="stub-model")),
+        "engine_stream": ("POST", "/fabric", fabric(1024, model="stub-model", streamResponse=True)),
+        "fabric_4_patterns": ("POST", "/fabric", lambda i: {**fabric(1024)(i), "pattern": list(PATTERNS), "stream": False}),
+        "yt": ("POST", "/yt", lambda i: {"pattern": ["summarize"], "model": "gpt-4o", "url": f"https://youtu.be/video{i:06d}",
+                                          "stream": True, "noCache": True}),
+        "ts": ("POST", "/ts", lambda i: {"pattern": ["summarize"], "model": "gpt-4o", "path": audio, "stream": True, "noCache": True}),
+        "batch_10": ("POST", "/fabric/batch", lambda i: {"pattern": ["summarize"], "model": "gpt-4o", "noCache": True,
+                                                         "items": [{"data": f"{i}-{j} " + text_of(1024)} for j in range(10)]}),
+        "models": ("GET", "/models", None),
+    }
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(fraction * (len(values) - 1))))
+    return values[index]
+
+async def monitor_loop_lag(samples, interval=0.005):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - started - interval)
+
+def failed(response):
+    """
+    Error statuses and error events count as errors, and so do pattern runs without
+    output, like replies of the model provider that weren't parsed.
+    """
+    if response.status_code != 200 or b'"event": "error"' in response.content:
+        return True
+    if response.headers.get("content-type", "").startswith("application/x-ndjson"):
+        last = json.loads(response.content.splitlines()[-1])
+        return last["event"] == "done" and "output" in last and not last["output"]
+    if response.headers.get("content-type", "").startswith("application/json"):
+        body = response.json()
+        return isinstance(body, dict) and "output" in body and not body["output"]
+    return False
+
+async def run_scenario(client, api_key, scenario, requests, concurrency):
+    method, path, body = scenario
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+    lag_samples = []
+    monitor = asyncio.create_task(monitor_loop_lag(lag_samples))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            response = await client.request(method, path, json=body(i) if body else None, headers={"X-API-Key": api_key})
+            # Read streamed bodies to the end, that's when the client has its result
+            await response.aread()
+            latencies.append(time.perf_counter() - started)
+            if failed(response):
+                errors += 1
+
+    # One untimed request first, so one-off costs like cache misses and lazy imports don't count
+    response = await client.request(method, path, json=body(-1) if body else None, headers={"X-API-Key": api_key})
+    await response.aread()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    monitor.cancel()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "loop_lag_p99_ms": round(percentile(lag_samples, 0.99) * 1000, 2),
+        "loop_lag_max_ms": round(max(lag_samples, default=0.0) * 1000, 2),
+        # ru_maxrss is in KiB on Linux and bytes on macOS
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+    }
+
+async def run(args, audio):
+    import httpx
+    import api
+
+    await api.start_job_queue()
+    results = {}
+    try:
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            available = scenarios(audio)
+            for name in args.scenarios or list(available):
+                for concurrency in args.concurrency:
+                    result = await run_scenario(client, api.API_KEY, available[name], args.requests, concurrency)
+                    results[f"{name}@{concurrency}"] = result
+                    print(f"{name:<18} c={concurrency:<3} {result['throughput']:>8.1f} req/s  "
+                          f"p50 {result['p50_ms']:>8.1f}ms  p95 {result['p95_ms']:>8.1f}ms  p99 {result['p99_ms']:>8.1f}ms  "
+                          f"lag p99 {result['loop_lag_p99_ms']:>6.1f}ms  rss {result['peak_rss_mb']:>6.1f}MB  errors {result['errors']}")
+    finally:
+        await api.stop_job_queue()
+    return results
+
+def compare(results, baseline, threshold, min_delta_ms=5.0):
+    """
+    Returns the regressions: p95 latency above or throughput below the baseline by more
+    than threshold (a fraction). Latency changes below min_delta_ms are noise on
+    scenarios that only take a millisecond or two.
+    """
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if result["p95_ms"] > base["p95_ms"] + max(base["p95_ms"] * threshold, min_delta_ms):
+            regressions.append(f"{key}: p95 {result['p95_ms']}ms vs {base['p95_ms']}ms")
+        if result["throughput"] < base["throughput"] * (1 - threshold):
+            regressions.append(f"{key}: throughput {result['throughput']} vs {base['throughput']} req/s")
+        if result["errors"] > base["errors"]:
+            regressions.append(f"{key}: {result['errors']} errors vs {base['errors']}")
+    return regressions
+
+def baseline_differences(baseline, report):
+    """
+    Settings and machine properties that differ between the baseline and this run.
+    """
+    differences = []
+    for section in ("settings", "machine"):
+        recorded = baseline.get(section, {})
+        for key, value in report[section].items():
+            if recorded.get(key) != value:
+                differences.append(f"{key} is {value}, the baseline was recorded with {recorded.get(key)}")
+    return differences
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", help="Scenarios to run, all by default")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per scenario and concurrency level")
+    parser.add_argument("--concurrency", type=lambda value: [int(c) for c in value.split(",")], default=[1, 8, 32],
+                        help="Comma separated concurrency levels")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds every stub binary takes")
+    parser.add_argument("--output-bytes", type=int, default=2048, help="Output size of the stub binaries")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="Compare against the baseline and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed regression as a fraction")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Ignore p95 changes smaller than this")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="fabric-connector-bench-")
+    os.environ["BENCH_STUB_LATENCY"] = str(args.latency)
+    os.environ["BENCH_STUB_OUTPUT_BYTES"] = str(args.output_bytes)
+    audio = install_stubs(directory)
+    # Keep api.py from writing the benchmark's requests to the application log
+    logging.basicConfig(level=logging.WARNING)
+    sys.path.insert(0, REPO_DIR)
+    try:
+        results = asyncio.run(run(args, audio))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        "settings": {"requests": args.requests, "concurrency": args.concurrency, "latency": args.latency,
+                     "output_bytes": args.output_bytes},
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        differences = baseline_differences(baseline, report)
+        if differences:
+            # Latencies only compare between runs with the same settings on the same machine
+            for difference in differences:
+                print(f"Baseline mismatch: {difference}")
+            print("Record a baseline for this machine and these settings with --save-baseline")
+            sys.exit(2)
+        regressions = compare(results, baseline["results"], args.threshold, args.min_delta_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
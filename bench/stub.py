@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Stands in for the fabric, yt and whisper binaries during benchmarks; which one is
+decided by the name it was started as. Latency and output size come from
+BENCH_STUB_LATENCY (seconds) and BENCH_STUB_OUTPUT_BYTES.
+
+Started as stub.py it serves an OpenAI-compatible /chat/completions endpoint for the
+in-process engine (FABRIC_CONNECTOR_ENGINE=http) instead:
+
+    python bench/stub.py --port 8089
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY = float(os.environ.get("BENCH_STUB_LATENCY", 0.05))
+OUTPUT_BYTES = int(os.environ.get("BENCH_STUB_OUTPUT_BYTES", 2048))
+# Streamed output is written in this many pieces, spread over the latency
+PIECES = 8
+# Patterns fabric --list reports; bench/run.py creates them in the pattern directory
+PATTERNS = ("summarize", "extract_wisdom", "extract_ideas", "create_summary")
+
+def emit(text):
+    piece = max(1, len(text) // PIECES)
+    for start in range(0, len(text), piece):
+        sys.stdout.write(text[start:start + piece])
+        sys.stdout.flush()
+        time.sleep(LATENCY / PIECES)
+    sys.stdout.write("\n")
+
+def fabric(args):
+    if "--listmodels" in args:
+        print("gpt-4o\ngpt-4o-mini")
+    elif "--list" in args or "--listpatterns" in args:
+        print("\n".join(PATTERNS))
+    elif "--changeDefaultModel" in args:
+        print("Default model changed")
+    else:
+        # Consume stdin like fabric does before answering
+        sys.stdin.read()
+        emit("x" * OUTPUT_BYTES)
+
+def yt(args):
+    time.sleep(LATENCY)
+    words = ("lorem ipsum dolor sit amet " * (OUTPUT_BYTES // 27 + 1))[:OUTPUT_BYTES]
+    print(words)
+
+def whisper(args):
+    time.sleep(LATENCY)
+    line_count = max(1, OUTPUT_BYTES // 64)
+    for i in range(line_count):
+        print(f"[{i // 60:02d}:{i % 60:02d}.000 --> {(i + 1) // 60:02d}:{(i + 1) % 60:02d}.000] spoken words of line {i}")
+
+class ChatCompletionsHandler(BaseHTTPRequestHandler):
+    """
+    Answers every chat completion with OUTPUT_BYTES of text after LATENCY seconds,
+    streamed in PIECES server-sent events when the request asks for a stream.
+    """
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes, which Nagle's algorithm would hold back
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        if self.path.rstrip("/").rsplit("/", 1)[-1] != "completions":
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        text = "x" * OUTPUT_BYTES
+        if not body.get("stream"):
+            time.sleep(LATENCY)
+            self.send_json({"choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        piece = max(1, len(text) // PIECES)
+        for start in range(0, len(text), piece):
+            time.sleep(LATENCY / PIECES)
+            self.send_chunk(f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'content': text[start:start + piece]}}]})}\n\n")
+        self.send_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def send_json(self, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+class StubServer(ThreadingHTTPServer):
+    # Benchmarks open many connections at once, more than the default backlog of 5
+    request_queue_size = 128
+    daemon_threads = True
+
+def serve_chat_completions(port=0):
+    """
+    Starts the stub endpoint in a daemon thread and returns its server; port 0 picks
+    a free port, see server.server_address.
+    """
+    server = StubServer(("127.0.0.1", port), ChatCompletionsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    name = os.path.basename(sys.argv[0])
+    if name == "stub.py":
+        parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+        parser.add_argument("--port", type=int, default=8089, help="Port of the /chat/completions endpoint")
+        args = parser.parse_args()
+        server = StubServer(("127.0.0.1", args.port), ChatCompletionsHandler)
+        print(f"Serving /chat/completions on http://127.0.0.1:{args.port}/v1")
+        server.serve_forever()
+    else:
+        {"fabric": fabric, "yt": yt, "whisper": whisper}[name](sys.argv[1:])
@@ -0,0 +1,417 @@
+import os
+import time
+import asyncio
+import gzip
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from metrics import CACHE_LOOKUPS
+
+# Caches live in the user's cache directory unless overridden
+CACHE_DIR = os.environ.get(
+    "FABRIC_CONNECTOR_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "fabric-connector")
+)
+
+def digest(*parts):
+    """
+    Returns a stable sha256 hex digest over the given string parts.
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+class LRUCache:
+    """
+    Bounded in-memory cache that evicts the least recently used entry.
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._entries.pop(key, None)
+
+    def remove_if(self, predicate):
+        with self._lock:
+            for key in [key for key, value in self._entries.items() if predicate(key, value)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class DiskStore:
+    """
+    Directory-backed text store with size and age based eviction.
+    Entries are files named `<tag>_<key>` so everything sharing a tag can be dropped
+    without opening the files. The file mtime records when an entry was written and
+    the atime when it was last read, which drives the LRU eviction.
+    Several processes can share the directory: a key missing from the index is looked
+    up again after re-reading the directory when another process changed it.
+    """
+    def __init__(self, directory, max_bytes, max_age=None, compress=False, name=None):
+        self.directory = directory
+        self.name = name  # Lookups are counted in the cache metrics when set
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compress = compress
+        self._suffix = ".gz" if compress else ".txt"
+        self._index = None  # key -> [filename, tag, size, created, last_used]
+        self._total_bytes = 0
+        self._directory_mtime = None  # Of the directory when the index was last in sync with it
+        self._lock = threading.Lock()
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        self._total_bytes = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._directory_mtime = self._mtime()
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(self._suffix) or "_" not in filename:
+                continue
+            tag, key = filename[:-len(self._suffix)].split("_", 1)
+            try:
+                stat = os.stat(os.path.join(self.directory, filename))
+            except OSError:
+                continue
+            self._index[key] = [filename, tag, stat.st_size, stat.st_mtime, stat.st_atime]
+            self._total_bytes += stat.st_size
+
+    def _mtime(self):
+        try:
+            return os.stat(self.directory).st_mtime_ns
+        except OSError:
+            return None
+
+    def _changed_elsewhere(self):
+        return self._mtime() != self._directory_mtime
+
+    def _sync(self, in_sync):
+        # After changing the directory ourselves; when it was in sync before, the index
+        # still is, otherwise another process's change still needs to be read
+        if in_sync:
+            self._directory_mtime = self._mtime()
+
+    def _expired(self, entry, now):
+        return self.max_age is not None and now - entry[3] > self.max_age
+
+    def _remove(self, key):
+        filename, _, size, _, _ = self._index.pop(key)
+        self._total_bytes -= size
+        try:
+            os.unlink(os.path.join(self.directory, filename))
+        except OSError as e:
+            logging.info(f"Failed to delete cache file {filename}: {e}")
+
+    def get(self, key):
+        value = self._get(key)
+        if self.name is not None:
+            CACHE_LOOKUPS.labels(self.name, "miss" if value is None else "hit").inc()
+        return value
+
+    def _get(self, key):
+        with self._lock:
+            self._load_index()
+            entry = self._index.get(key)
+            if entry is None and self._changed_elsewhere():
+                self._index = None
+                self._load_index()
+                entry = self._index.get(key)
+            if entry is None:
+                return None
+            now = time.time()
+            if self._expired(entry, now):
+                in_sync = not self._changed_elsewhere()
+                self._remove(key)
+                self._sync(in_sync)
+                return None
+            path = os.path.join(self.directory, entry[0])
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path, (now, entry[3]))
+            except OSError:
+                self._index.pop(key, None)
+                self._total_bytes -= entry[2]
+                return None
+            entry[4] = now
+        if self.compress:
+            data = gzip.decompress(data)
+        return data.decode('utf-8')
+
+    def put(self, key, value, tag="none"):
+        data = value.encode('utf-8')
+        if self.compress:
+            data = gzip.compress(data)
+        if len(data) > self.max_bytes:
+            # Too big to store, but an older value under the key mustn't be served instead
+            self.delete(key)
+            return
+        filename = f"{tag}_{key}{self._suffix}"
+        path = os.path.join(self.directory, filename)
+        with self._lock:
+            self._load_index()
+            in_sync = not self._changed_elsewhere()
+            if key in self._index:
+                self._remove(key)
+            # Write to a temporary name first so readers never see a partial entry
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            now = time.time()
+            self._index[key] = [filename, tag, len(data), now, now]
+            self._total_bytes += len(data)
+            self._evict(now)
+            self._sync(in_sync)
+
+    def _evict(self, now):
+        for key in [key for key, entry in self._index.items() if self._expired(entry, now)]:
+            self._remove(key)
+        if self._total_bytes <= self.max_bytes:
+            return
+        for key, _ in sorted(self._index.items(), key=lambda item: item[1][4]):
+            self._remove(key)
+            if self._total_bytes <= self.max_bytes:
+                break
+
+    def tag_of(self, key):
+        with self._lock:
+            entry = (self._index or {}).get(key)
+            return entry[1] if entry else None
+
+    def delete(self, key):
+        with self._lock:
+            self._reload_index()
+            if key in self._index:
+                self._remove(key)
+            self._sync(True)
+
+    def delete_tag(self, tag):
+        with self._lock:
+            self._reload_index()
+            keys = [key for key, entry in self._index.items() if entry[1] == tag]
+            for key in keys:
+                self._remove(key)
+            self._sync(True)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._reload_index()
+            for key in list(self._index):
+                self._remove(key)
+            self._sync(True)
+
+    def _reload_index(self):
+        # Deletions must also reach the entries other processes wrote
+        if self._index is None or self._changed_elsewhere():
+            self._index = None
+            self._load_index()
+
+    def stats(self):
+        with self._lock:
+            self._load_index()
+            return {"entries": len(self._index), "bytes": self._total_bytes, "max_bytes": self.max_bytes}
+
+class ResultCache:
+    """
+    Caches pattern outputs keyed on (pattern, model, goCompatibility, sha256 of the input).
+    A small in-memory LRU sits in front of a persistent DiskStore. Invalidations touch
+    a marker file in the directory, so other processes sharing it drop their LRU too.
+    """
+    def __init__(self, directory, max_entries=256, max_bytes=200 * 1024 * 1024, max_age=7 * 24 * 3600):
+        self.memory = LRUCache(max_entries)
+        self.disk = DiskStore(directory, max_bytes, max_age)
+        self.max_age = max_age
+        self._marker = os.path.join(directory, "invalidated")
+        self._invalidated = self._marker_mtime()
+
+    def _marker_mtime(self):
+        try:
+            return os.stat(self._marker).st_mtime_ns
+        except OSError:
+            return None
+
+    def _touch_marker(self):
+        os.makedirs(os.path.dirname(self._marker), exist_ok=True)
+        with open(self._marker, "w") as f:
+            f.write(str(time.time()))
+        self._invalidated = self._marker_mtime()
+
+    @staticmethod
+    def key(pattern, model, go_compatibility, input_data):
+        input_hash = hashlib.sha256(input_data.encode('utf-8')).hexdigest()
+        return digest(pattern, model, bool(go_compatibility), input_hash)
+
+    @staticmethod
+    def tag(pattern):
+        return digest(pattern)[:16]
+
+    def get(self, key):
+        invalidated = self._marker_mtime()
+        if invalidated != self._invalidated:
+            # Another process invalidated results this process may still hold
+            self._invalidated = invalidated
+            self.memory.clear()
+        entry = self.memory.get(key)
+        if entry is not None:
+            _, value, created = entry
+            if time.time() - created <= self.max_age:
+                CACHE_LOOKUPS.labels("results", "hit").inc()
+                return value
+            self.memory.pop(key)
+        value = self.disk.get(key)
+        if value is not None:
+            self.memory.put(key, (self.disk.tag_of(key), value, time.time()))
+        CACHE_LOOKUPS.labels("results", "miss" if value is None else "hit").inc()
+        return value
+
+    def put(self, pattern, key, value):
+        tag = self.tag(pattern)
+        self.memory.put(key, (tag, value, time.time()))
+        self.disk.put(key, value, tag=tag)
+
+    def invalidate(self, pattern=None):
+        """
+        Drops every cached result for the pattern, or the whole cache when no pattern is given.
+        """
+        if pattern is None:
+            self.memory.clear()
+            self.disk.clear()
+            self._touch_marker()
+            return
+        tag = self.tag(pattern)
+        self.memory.remove_if(lambda key, entry: entry[0] == tag)
+        removed = self.disk.delete_tag(tag)
+        self._touch_marker()
+        logging.info(f"Invalidated {removed} cached results for pattern '{pattern}'")
+
+    def stats(self):
+        return {"memory_entries": len(self.memory), **self.disk.stats()}
+
+class TTLCache:
+    """
+    Async cache for values that are fine to serve slightly stale. Values younger than
+    ttl are returned directly; older ones are still returned while a background task
+    reloads them (stale-while-revalidate), and past max_stale the caller waits for the
+    reload. Concurrent loads of the same key share a single loader call.
+    """
+    def __init__(self, ttl, max_stale, name="ttl"):
+        self.name = name
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._entries = {}  # key -> (value, loaded_at)
+        self._loading = {}  # key -> task
+        self._generation = 0
+        self._marker = None
+        self._invalidated = None
+
+    def share_invalidations(self, marker):
+        """
+        Invalidations touch the marker file, and every process using the same marker
+        drops its entries once it sees the file change, like ResultCache does.
+        """
+        self._marker = marker
+        self._invalidated = self._marker_mtime()
+
+    def _marker_mtime(self):
+        try:
+            return os.stat(self._marker).st_mtime_ns
+        except OSError:
+            return None
+
+    async def get(self, key, loader):
+        if self._marker is not None:
+            invalidated = self._marker_mtime()
+            if invalidated != self._invalidated:
+                # Another process invalidated listings this process may still hold
+                self._invalidated = invalidated
+                self._drop()
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, loaded_at = entry
+            age = time.monotonic() - loaded_at
+            if age < self.ttl:
+                CACHE_LOOKUPS.labels(self.name, "hit").inc()
+                return value
+            if age < self.max_stale:
+                CACHE_LOOKUPS.labels(self.name, "stale").inc()
+                self._load(key, loader)
+                return value
+        CACHE_LOOKUPS.labels(self.name, "miss").inc()
+        # Shield the shared load so one cancelled caller doesn't fail the others
+        return await asyncio.shield(self._load(key, loader))
+
+    def _load(self, key, loader):
+        task = self._loading.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run_loader(key, loader, self._generation))
+            self._loading[key] = task
+            task.add_done_callback(lambda done: self._loaded(key, done))
+        return task
+
+    async def _run_loader(self, key, loader, generation):
+        value = await loader()
+        # Don't store a value that was loaded before an invalidation
+        if generation == self._generation:
+            self._entries[key] = (value, time.monotonic())
+        return value
+
+    def _loaded(self, key, task):
+        if self._loading.get(key) is task:
+            del self._loading[key]
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Refreshing cached '{key}' failed: {task.exception()}")
+
+    def _drop(self):
+        self._entries.clear()
+        self._loading.clear()
+        self._generation += 1
+
+    def invalidate(self):
+        self._drop()
+        if self._marker is not None:
+            os.makedirs(os.path.dirname(self._marker), exist_ok=True)
+            with open(self._marker, "w") as f:
+                f.write(str(time.time()))
+            self._invalidated = self._marker_mtime()
+
+result_cache = ResultCache(
+    os.path.join(CACHE_DIR, "results"),
+    max_entries=int(os.environ.get("FABRIC_CONNECTOR_RESULT_CACHE_ENTRIES", 256)),
+    max_bytes=int(os.environ.get("FABRIC_CONNECTOR_RESULT_CACHE_MB", 200)) * 1024 * 1024,
+    max_age=int(os.environ.get("FABRIC_CONNECTOR_RESULT_CACHE_MAX_AGE", 7 * 24 * 3600)),
+)
+
+# /models and /patterns listings
+listing_cache = TTLCache(
+    ttl=int(os.environ.get("FABRIC_CONNECTOR_LISTING_TTL", 300)),
+    max_stale=int(os.environ.get("FABRIC_CONNECTOR_LISTING_MAX_STALE", 24 * 3600)),
+    name="listings",
+)
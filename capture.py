@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import queue
+import hashlib
+import logging
+import threading
+from urllib.parse import parse_qsl
+from timing import request_timings
+
+# Request fields that are recorded as they are; every other string is replaced by its
+# size and a salted digest, so repeated inputs stay recognisable without being stored
+SAFE_FIELDS = {
+    "pattern", "model", "stream", "streamResponse", "goCompatibility", "noCache",
+    "concurrency", "chunked", "chunkSize", "chunkOverlap", "reducePattern",
+}
+SAFE_QUERY_PARAMS = {"goCompatibility", "limit", "status"}
+# Larger bodies are only counted, not parsed
+MAX_CAPTURED_BODY = 32 * 1024 * 1024
+
+class TraceWriter:
+    """
+    Appends trace records to a JSON lines file from a background thread.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.started = time.time()
+        # Digests are only comparable within one capture, which keeps short inputs from
+        # being recovered by hashing guesses
+        self.salt = os.urandom(16)
+        self._records = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def digest(self, value):
+        return hashlib.sha256(self.salt + value.encode("utf-8")).hexdigest()[:16]
+
+    def sanitize(self, value, key=None):
+        if key in SAFE_FIELDS:
+            return value
+        if isinstance(value, str):
+            return {"bytes": len(value.encode("utf-8")), "digest": self.digest(value)}
+        if isinstance(value, dict):
+            return {k: self.sanitize(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.sanitize(item) for item in value]
+        return value
+
+    def record(self, record):
+        self._records.put(record)
+
+    def _write(self):
+        while True:
+            record = self._records.get()
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+                    # Write whatever else is queued while the file is open
+                    while not self._records.empty():
+                        f.write(json.dumps(self._records.get()) + "\n")
+            except OSError as e:
+                logging.error(f"Failed to write traffic capture: {e}")
+
+class CaptureMiddleware:
+    """
+    ASGI middleware that records a sanitized trace of every request: route, query
+    parameters, the request body with inputs reduced to sizes and digests, status,
+    duration, stage timings and response size. bench/replay.py replays the traces.
+    """
+    def __init__(self, app, path):
+        self.app = app
+        self.writer = TraceWriter(path)
+        logging.info(f"Capturing traffic to {path}")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        offset = time.time() - self.writer.started
+        started = time.perf_counter()
+        body = bytearray()
+        received = 0
+        status = 500
+        sent = 0
+
+        async def capturing_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                received += len(chunk)
+                if received <= MAX_CAPTURED_BODY:
+                    body.extend(chunk)
+            return message
+
+        async def capturing_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, capturing_receive, capturing_send)
+        finally:
+            self.writer.record(self.trace(scope, offset, started, bytes(body), received, status, sent))
+
+    def trace(self, scope, offset, started, body, received, status, sent):
+        route = scope.get("route")
+        query = {}
+        for name, value in parse_qsl(scope.get("query_string", b"").decode("latin-1")):
+            query[name] = value if name in SAFE_QUERY_PARAMS else self.writer.sanitize(value)
+        parsed = None
+        if body and received <= MAX_CAPTURED_BODY:
+            try:
+                parsed = self.writer.sanitize(json.loads(body))
+            except ValueError:
+                parsed = None
+        timings = request_timings.get()
+        return {
+            "t": round(offset, 3),
+            "method": scope["method"],
+            "endpoint": getattr(route, "path", "unmatched"),
+            "path_params": {key: self.writer.digest(str(value)) for key, value in (scope.get("path_params") or {}).items()},
+            "query": query,
+            "body": parsed,
+            "request_bytes": received,
+            "status": status,
+            "response_bytes": sent,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            "stages": timings.records() if timings is not None else [],
+        }
@@ -0,0 +1,140 @@
+import re
+
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+# Whisper transcript lines start with "[mm:ss.mmm --> ...]"
+TIMESTAMP_LINE = re.compile(r'^\[(\d{1,2}:)?\d{1,2}:\d{2}\.\d{3} -->')
+
+def _fit(text, size):
+    """
+    Breaks a piece of text that is longer than size at sentence ends, then at
+    whitespace and as a last resort anywhere.
+    """
+    if len(text) <= size:
+        return [text]
+    sentences = [sentence for sentence in SENTENCE_END.split(text) if sentence]
+    if len(sentences) > 1:
+        return [piece for sentence in sentences for piece in _fit(sentence, size)]
+    pieces = []
+    current = ""
+    for word in text.split():
+        while len(word) > size:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(word[:size])
+            word = word[size:]
+        if current and len(current) + 1 + len(word) > size:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {word}" if current else word
+    if current:
+        pieces.append(current)
+    return pieces
+
+def _join(pieces):
+    return "".join(piece if i == 0 else separator + piece for i, (separator, piece) in enumerate(pieces))
+
+class Packer:
+    """
+    Packs (separator, text) pieces into chunks of at most size characters as they are
+    added. Each chunk starts with the trailing pieces of the previous one that fit into
+    overlap characters.
+    """
+    def __init__(self, size, overlap):
+        self.size = size
+        self.overlap = overlap
+        self.current = []
+        self.length = 0
+
+    def add(self, separator, piece):
+        """
+        Adds a piece and returns the chunk it completed, if any.
+        """
+        chunk = None
+        if self.current and self.length + len(separator) + len(piece) > self.size:
+            chunk = _join(self.current)
+            carried = []
+            carried_length = 0
+            for previous_separator, previous in reversed(self.current):
+                if carried_length + len(previous) + (len(carried[0][0]) if carried else 0) > self.overlap:
+                    break
+                carried_length += len(previous) + (len(carried[0][0]) if carried else 0)
+                carried.insert(0, (previous_separator, previous))
+            self.current, self.length = [], 0
+            if carried and carried_length + len(separator) + len(piece) <= self.size:
+                self.current, self.length = carried, carried_length
+        self.length += len(piece) + (len(separator) if self.current else 0)
+        self.current.append((separator, piece))
+        return chunk
+
+    def finish(self):
+        """
+        Returns the last, incomplete chunk, if any.
+        """
+        return _join(self.current) if self.current else None
+
+def _pack(pieces, size, overlap):
+    packer = Packer(size, overlap)
+    chunks = []
+    for separator, piece in pieces:
+        chunk = packer.add(separator, piece)
+        if chunk is not None:
+            chunks.append(chunk)
+    last = packer.finish()
+    if last is not None:
+        chunks.append(last)
+    return chunks
+
+def split_text(text, size, overlap=0):
+    """
+    Splits prose on paragraph boundaries, falling back to sentence and word boundaries
+    for paragraphs that don't fit into a chunk.
+    """
+    pieces = []
+    for paragraph in PARAGRAPH_BREAK.split(text.strip()):
+        for i, piece in enumerate(_fit(paragraph.strip(), size)):
+            pieces.append(("\n\n" if i == 0 else " ", piece))
+    return _pack(pieces, size, overlap)
+
+def split_transcript(text, size, overlap=0):
+    """
+    Splits a timestamped transcript between lines, so every chunk keeps its timestamps.
+    """
+    pieces = [("\n", piece) for line in text.splitlines() if line.strip() for piece in _fit(line.strip(), size)]
+    return _pack(pieces, size, overlap)
+
+class TranscriptChunker:
+    """
+    Splits a transcript into the chunks split_transcript would produce while its lines
+    are still arriving.
+    """
+    def __init__(self, size, overlap=0):
+        self.size = size
+        self.packer = Packer(size, min(overlap, size // 2))
+
+    def add_line(self, line):
+        """
+        Adds a line and returns the chunks it completed.
+        """
+        if not line.strip():
+            return []
+        chunks = [self.packer.add("\n", piece) for piece in _fit(line.strip(), self.size)]
+        return [chunk for chunk in chunks if chunk is not None]
+
+    def finish(self):
+        return self.packer.finish()
+
+def is_timestamped(text):
+    lines = [line for line in text.splitlines() if line.strip()]
+    return bool(lines) and sum(1 for line in lines if TIMESTAMP_LINE.match(line)) * 2 >= len(lines)
+
+def split_input(text, size, overlap=0):
+    """
+    Splits pattern input into chunks of at most size characters that overlap by up to
+    overlap characters, choosing the boundaries by the kind of input.
+    """
+    overlap = min(overlap, size // 2)
+    if is_timestamped(text):
+        return split_transcript(text, size, overlap)
+    return split_text(text, size, overlap)
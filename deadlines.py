@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from metrics import CANCELLED_WORK
+
+def _seconds(name, default):
+    value = float(os.environ.get(name, default))
+    return value if value > 0 else None
+
+# Seconds a request to each pipeline endpoint may take, None for no limit. Work still
+# running at the deadline is cancelled and its processes are killed.
+DEADLINES = {
+    "/fabric": _seconds("FABRIC_CONNECTOR_FABRIC_DEADLINE", 900),
+    "/fabric/batch": _seconds("FABRIC_CONNECTOR_BATCH_DEADLINE", 0),
+    "/yt": _seconds("FABRIC_CONNECTOR_YT_DEADLINE", 1800),
+    "/ts": _seconds("FABRIC_CONNECTOR_TS_DEADLINE", 3600),
+}
+# Seconds a job may run, None for no limit
+JOB_DEADLINE = _seconds("FABRIC_CONNECTOR_JOB_DEADLINE", 0)
+
+def request_deadline(path, headers):
+    """
+    The endpoint's deadline, shortened by an X-Request-Timeout header (seconds) when
+    the client sends one.
+    """
+    deadline = DEADLINES.get(path)
+    try:
+        requested = float(headers.get(b"x-request-timeout", b"").decode("latin-1"))
+    except ValueError:
+        return deadline
+    if requested <= 0:
+        return deadline
+    return requested if deadline is None else min(requested, deadline)
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware that cancels pipeline requests when the client disconnects or the
+    deadline of the endpoint passes. Cancelling the handler kills the processes it is
+    waiting for and frees their scheduler slots. A request that runs into its deadline
+    gets a 504, or a final error event when its NDJSON stream has already started.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in DEADLINES:
+            await self.app(scope, receive, send)
+            return
+        deadline = request_deadline(scope["path"], dict(scope.get("headers") or []))
+        messages = asyncio.Queue()
+        response_started = False
+        ndjson = False
+        response_complete = False
+
+        async def watch():
+            # Read the client's messages here so a disconnect is noticed while the handler
+            # is busy, not only when it next reads from the request
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    return
+
+        async def queued_receive():
+            message = await messages.get()
+            if message["type"] == "http.disconnect":
+                # Every later read sees the disconnect as well
+                messages.put_nowait(message)
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started, ndjson, response_complete
+            if message["type"] == "http.response.start":
+                response_started = True
+                ndjson = any(name.lower() == b"content-type" and value.startswith(b"application/x-ndjson")
+                             for name, value in message.get("headers", []))
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        started = time.perf_counter()
+        handler = asyncio.create_task(self.app(scope, queued_receive, tracking_send))
+        watcher = asyncio.create_task(watch())
+        try:
+            done, _ = await asyncio.wait({handler, watcher}, timeout=deadline, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            handler.cancel()
+            raise
+        finally:
+            watcher.cancel()
+
+        if handler in done:
+            handler.result()
+            return
+        handler.cancel()
+        await asyncio.gather(handler, return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        if watcher in done:
+            CANCELLED_WORK.labels(scope["path"], "disconnect").inc()
+            logging.warning(f"Cancelled {scope['method']} {scope['path']} after {elapsed:.1f}s: the client disconnected")
+            return
+
+        CANCELLED_WORK.labels(scope["path"], "deadline").inc()
+        detail = f"Deadline of {deadline:g}s exceeded"
+        logging.warning(f"Cancelled {scope['method']} {scope['path']} after {elapsed:.1f}s: {detail}")
+        if not response_started:
+            await send({"type": "http.response.start", "status": 504, "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": json.dumps({"detail": detail}).encode("utf-8")})
+        elif not response_complete:
+            body = (json.dumps({"event": "error", "detail": detail}) + "\n").encode("utf-8") if ndjson else b""
+            await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,187 @@
+import os
+import json
+import asyncio
+import logging
+import fnmatch
+import importlib.util
+from scheduler import scheduler
+
+# httpx takes a while to import and is only needed once an enabled engine sends a
+# request, so it is imported by load_httpx
+httpx = None
+HTTPX_INSTALLED = importlib.util.find_spec("httpx") is not None
+
+def load_httpx():
+    global httpx
+    import httpx
+    return httpx
+
+FABRIC_ENV_PATH = os.path.join(os.path.expanduser("~"), ".config", "fabric", ".env")
+
+class EngineError(Exception):
+    """
+    Raised when the model provider rejects or fails a request.
+    """
+
+def load_env_file(path):
+    """
+    Reads KEY=VALUE lines from fabric's .env file.
+    """
+    values = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#") or "=" not in line:
+                    continue
+                key, value = line.split("=", 1)
+                values[key.strip()] = value.strip().strip('"').strip("'")
+    except OSError:
+        pass
+    return values
+
+class LLMEngine:
+    """
+    Applies patterns in-process: PATTERN_PATH/<pattern>/system.md becomes the system
+    message and the input the user message of a request to an OpenAI-compatible
+    /chat/completions endpoint. Requests share one keep-alive connection pool, so
+    chained patterns pay neither a process start nor a TLS handshake.
+    Models that don't match the configured globs keep using the fabric CLI.
+    """
+    def __init__(self, pattern_path, base_url, api_key=None, models=("*",), enabled=True,
+                 max_connections=20, timeout=600.0, pattern_index=None):
+        self.pattern_path = pattern_path
+        self.pattern_index = pattern_index
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.models = models
+        self.enabled = enabled and HTTPX_INSTALLED
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._client = None
+        self._patterns = {}  # name -> (mtime, content)
+        if enabled and not HTTPX_INSTALLED:
+            logging.warning("httpx is not installed, patterns will run through the fabric CLI")
+
+    @classmethod
+    def from_environment(cls, pattern_path, pattern_index=None):
+        fabric_env = load_env_file(FABRIC_ENV_PATH)
+        def setting(name, fabric_name=None, default=None):
+            value = os.environ.get(f"FABRIC_CONNECTOR_ENGINE_{name}")
+            if value is None and fabric_name:
+                value = os.environ.get(fabric_name, fabric_env.get(fabric_name))
+            return value if value is not None else default
+        return cls(
+            pattern_path,
+            base_url=setting("BASE_URL", "OPENAI_BASE_URL", "https://api.openai.com/v1"),
+            api_key=setting("API_KEY", "OPENAI_API_KEY"),
+            models=tuple(filter(None, (model.strip() for model in setting("MODELS", default="gpt-*,o1*,o3*,o4*,chatgpt-*").split(",")))),
+            enabled=os.environ.get("FABRIC_CONNECTOR_ENGINE", "cli") == "http",
+            max_connections=int(setting("CONNECTIONS", default=20)),
+            timeout=float(setting("TIMEOUT", default=600)),
+            pattern_index=pattern_index,
+        )
+
+    def supports(self, model):
+        return self.enabled and any(fnmatch.fnmatchcase(model, glob) for glob in self.models)
+
+    @property
+    def client(self):
+        if self._client is None:
+            headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+            load_httpx()
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=headers,
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def system_prompt(self, pattern):
+        """
+        Returns the pattern's system.md from the pattern index, which holds the contents
+        in memory. Patterns it hasn't picked up yet are read from disk in a thread.
+        """
+        if self.pattern_index is not None:
+            entry = self.pattern_index.get(pattern)
+            if entry is not None:
+                return entry["content"]
+        return await asyncio.to_thread(self._read_system_prompt, pattern)
+
+    def _read_system_prompt(self, pattern):
+        path = os.path.join(self.pattern_path, pattern, "system.md")
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            raise EngineError(f"Pattern '{pattern}' not found")
+        cached = self._patterns.get(pattern)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, encoding='utf-8') as f:
+            content = f.read()
+        self._patterns[pattern] = (mtime, content)
+        return content
+
+    async def _payload(self, pattern, model, input_data, stream):
+        return {
+            "model": model,
+            "stream": stream,
+            "messages": [
+                {"role": "system", "content": await self.system_prompt(pattern)},
+                {"role": "user", "content": input_data},
+            ],
+        }
+
+    async def complete(self, pattern, model, input_data):
+        """
+        Runs a pattern and returns the complete response text.
+        """
+        payload = await self._payload(pattern, model, input_data, stream=False)
+        async with scheduler.slot("llm", model):
+            try:
+                response = await self.client.post("/chat/completions", json=payload)
+            except httpx.HTTPError as e:
+                raise EngineError(f"Request to {self.base_url} failed: {e}")
+        if response.status_code != 200:
+            raise EngineError(f"Model provider returned {response.status_code}: {response.text}")
+        try:
+            content = response.json()["choices"][0]["message"]["content"]
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise EngineError(f"Unexpected response from {self.base_url}: {e!r}")
+        # Tool calls and refusals come without content
+        return (content or "").strip()
+
+    async def stream(self, pattern, model, input_data):
+        """
+        Runs a pattern and yields the response text as the provider streams it.
+        """
+        payload = await self._payload(pattern, model, input_data, stream=True)
+        async with scheduler.slot("llm", model):
+            try:
+                async with self.client.stream("POST", "/chat/completions", json=payload) as response:
+                    if response.status_code != 200:
+                        body = (await response.aread()).decode('utf-8', errors='replace')
+                        raise EngineError(f"Model provider returned {response.status_code}: {body}")
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            # Read on to the end of the body, a connection left mid-response
+                            # is closed rather than returned to the pool
+                            continue
+                        try:
+                            choices = json.loads(data).get("choices") or [{}]
+                            content = (choices[0].get("delta") or {}).get("content")
+                        except (ValueError, AttributeError, IndexError, TypeError) as e:
+                            raise EngineError(f"Unexpected event from {self.base_url}: {e!r}")
+                        if content:
+                            yield content
+            except httpx.HTTPError as e:
+                raise EngineError(f"Request to {self.base_url} failed: {e}")
@@ -0,0 +1,126 @@
+import os
+import re
+import sys
+
+# Drive letters of Windows paths, e.g. C:\ or c:/
+DRIVE_PATTERN = r'(?i)([a-z]):\\?\\?'
+
+def replace_drive(match):
+    drive_letter = match.group(1).lower()  # Get the drive letter and convert to lowercase
+    return f'/mnt/{drive_letter}/'
+
+class Executor:
+    """
+    Builds the command lines for the fabric, yt and whisper binaries of one backend.
+    Commands are plain argument lists that are executed directly, without a shell.
+    """
+    name = None
+    # Whether whisper prints "[mm:ss.mmm --> mm:ss.mmm] text" lines that need filtering
+    timestamped_transcripts = True
+    # Whether the binaries run on this machine and see its paths
+    runs_locally = True
+
+    def __init__(self, fabric_path, yt_path, ts_path):
+        # e.g. FABRIC_CONNECTOR_NATIVE_FABRIC_PATH overrides the fabric binary of the native backend
+        prefix = f"FABRIC_CONNECTOR_{self.name.upper()}"
+        self.fabric_path = os.environ.get(f"{prefix}_FABRIC_PATH", fabric_path)
+        self.yt_path = os.environ.get(f"{prefix}_YT_PATH", yt_path)
+        self.ts_path = os.environ.get(f"{prefix}_TS_PATH", ts_path)
+
+    def wrap(self, command):
+        return command
+
+    def fabric(self, *args):
+        return self.wrap([self.fabric_path, *args])
+
+    def yt(self, *args):
+        return self.wrap([self.yt_path, *args])
+
+    def whisper(self, path, output_dir, threads=None):
+        command = [self.ts_path, self.path(path), "--output_format", "txt", "--output_dir", output_dir]
+        if threads:
+            command += ["--threads", str(threads)]
+        return self.wrap(command)
+
+    def path(self, path):
+        """
+        Translates a path on this machine to the path the binaries see.
+        """
+        return path
+
+class NativeExecutor(Executor):
+    """
+    Runs the binaries installed on this machine directly (macOS, Linux).
+    """
+    name = "native"
+
+    def __init__(self):
+        home_dir = os.path.expanduser("~")
+        super().__init__(
+            os.path.join(home_dir, ".local", "bin", "fabric"),
+            os.path.join(home_dir, ".local", "bin", "yt"),
+            "whisper",
+        )
+
+class GoFabricExecutor(Executor):
+    """
+    Runs the Go rewrite of fabric installed with `go install`, directly on this machine.
+    """
+    name = "go"
+
+    def __init__(self):
+        home_dir = os.path.expanduser("~")
+        if sys.platform == "win32":
+            home_dir = home_dir.replace("\\", "/")
+        super().__init__(
+            os.path.join(home_dir, "go", "bin", "fabric").replace("\\", "/"),
+            os.path.join(home_dir, "go", "bin", "yt").replace("\\", "/"),
+            "whisper",
+        )
+
+class WSLExecutor(Executor):
+    """
+    Runs the python fabric installed in the default WSL distribution from Windows.
+    The WSL user is expected to match the Windows user.
+    """
+    name = "wsl"
+    timestamped_transcripts = False
+    runs_locally = False
+
+    def __init__(self):
+        home_dir = os.path.expanduser("~").replace("Users", "home").replace("C:", "")
+        super().__init__(
+            os.path.join(home_dir, ".local", "bin", "fabric").replace("\\", "/"),
+            os.path.join(home_dir, ".local", "bin", "yt").replace("\\", "/"),
+            os.path.join(home_dir, ".local", "bin", "ts").replace("\\", "/"),
+        )
+
+    def wrap(self, command):
+        return ["wsl", "-e", *command]
+
+    def whisper(self, path, output_dir, threads=None):
+        return ["wsl", "--cd", "/tmp", "-e", self.ts_path, self.path(path)]
+
+    def path(self, path):
+        return re.sub(DRIVE_PATTERN, replace_drive, path).replace("\\", "/")
+
+EXECUTORS = {
+    "native": NativeExecutor,
+    "wsl": WSLExecutor,
+    "go": GoFabricExecutor,
+}
+
+def create_executor(name):
+    if name not in EXECUTORS:
+        raise ValueError(f"Unknown executor '{name}', expected one of {list(EXECUTORS)}")
+    return EXECUTORS[name]()
+
+# Python fabric runs through WSL on Windows and natively everywhere else
+default_executor = create_executor(
+    os.environ.get("FABRIC_CONNECTOR_EXECUTOR", "wsl" if sys.platform == "win32" else "native")
+)
+# goCompatibility requests use the Go rewrite of fabric
+go_executor = create_executor(os.environ.get("FABRIC_CONNECTOR_GO_EXECUTOR", "go"))
+
+def executor_for(go_compatibility=False):
+    return go_executor if go_compatibility else default_executor
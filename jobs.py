@@ -0,0 +1,360 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import sqlite3
+import threading
+from cache import CACHE_DIR
+from scheduler import PRIORITIES, current_priority
+from metrics import CANCELLED_WORK
+
+JOB_DB_PATH = os.environ.get("FABRIC_CONNECTOR_JOB_DB", os.path.join(CACHE_DIR, "jobs.sqlite3"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    request TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    expires REAL,
+    worker TEXT,
+    heartbeat REAL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority, created);
+"""
+# Columns added since the first release, for databases created before them
+MIGRATIONS = {
+    "worker": "ALTER TABLE jobs ADD COLUMN worker TEXT",
+    "heartbeat": "ALTER TABLE jobs ADD COLUMN heartbeat REAL",
+    "cancel_requested": "ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0",
+}
+
+class JobError(Exception):
+    """
+    Raised by a job runner when the job failed.
+    """
+
+class JobStore:
+    """
+    SQLite table of jobs, their progress and results. Claiming a job happens in an
+    immediate transaction, so several processes can share one database file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+            self._connection.row_factory = sqlite3.Row
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+            columns = {row["name"] for row in self._connection.execute("PRAGMA table_info(jobs)")}
+            for column, sql in MIGRATIONS.items():
+                if column not in columns:
+                    self._connection.execute(sql)
+        return self._connection
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            return self.connection.execute(sql, parameters)
+
+    def add(self, kind, request, priority):
+        job_id = uuid.uuid4().hex
+        self._execute(
+            "INSERT INTO jobs (id, kind, request, priority, status, created) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(request), PRIORITIES[priority], QUEUED, time.time()),
+        )
+        return job_id
+
+    def claim(self, worker=None):
+        """
+        Marks the oldest queued job of the highest priority as running on worker and
+        returns it.
+        """
+        with self._lock:
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY priority, created LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    now = time.time()
+                    connection.execute(
+                        "UPDATE jobs SET status = ?, started = ?, worker = ?, heartbeat = ?, cancel_requested = 0 WHERE id = ?",
+                        (RUNNING, now, worker, now, row["id"]),
+                    )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return dict(row) if row is not None else None
+
+    def get(self, job_id):
+        row = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (row["expires"] is not None and row["expires"] < time.time()):
+            return None
+        return dict(row)
+
+    def list(self, status=None, limit=100):
+        if status:
+            rows = self._execute("SELECT * FROM jobs WHERE status = ? ORDER BY created DESC LIMIT ?", (status, limit))
+        else:
+            rows = self._execute("SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,))
+        return [dict(row) for row in rows.fetchall()]
+
+    def set_progress(self, job_id, progress):
+        self._execute("UPDATE jobs SET progress = ? WHERE id = ?", (json.dumps(progress), job_id))
+
+    def finish(self, job_id, status, result=None, error=None, ttl=None):
+        now = time.time()
+        self._execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, expires = ? WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, now, now + ttl if ttl else None, job_id),
+        )
+
+    def cancel_queued(self, job_id, ttl=None):
+        now = time.time()
+        cursor = self._execute(
+            "UPDATE jobs SET status = ?, finished = ?, expires = ? WHERE id = ? AND status = ?",
+            (CANCELLED, now, now + ttl if ttl else None, job_id, QUEUED),
+        )
+        return cursor.rowcount > 0
+
+    def requeue(self, job_id=None):
+        """
+        Puts a running job, or every running job, back into the queue.
+        """
+        if job_id is None:
+            return self._execute("UPDATE jobs SET status = ?, started = NULL WHERE status = ?", (QUEUED, RUNNING)).rowcount
+        return self._execute("UPDATE jobs SET status = ?, started = NULL WHERE id = ? AND status = ?", (QUEUED, job_id, RUNNING)).rowcount
+
+    def requeue_stale(self, max_age):
+        """
+        Puts running jobs back into the queue whose worker hasn't reported for max_age
+        seconds, because it crashed or was killed.
+        """
+        return self._execute(
+            "UPDATE jobs SET status = ?, started = NULL WHERE status = ? AND (heartbeat IS NULL OR heartbeat < ?)",
+            (QUEUED, RUNNING, time.time() - max_age),
+        ).rowcount
+
+    def touch(self, job_ids):
+        """
+        Records that the given running jobs are still being worked on.
+        """
+        self._execute(
+            f"UPDATE jobs SET heartbeat = ? WHERE id IN ({', '.join('?' * len(job_ids))})",
+            (time.time(), *job_ids),
+        )
+
+    def request_cancel(self, job_id):
+        """
+        Asks the worker running a job to cancel it. Returns False when it isn't running.
+        """
+        return self._execute(
+            "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?", (job_id, RUNNING)
+        ).rowcount > 0
+
+    def cancel_requests(self, job_ids):
+        rows = self._execute(
+            f"SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({', '.join('?' * len(job_ids))})", tuple(job_ids)
+        ).fetchall()
+        return [row["id"] for row in rows]
+
+    def delete(self, job_id):
+        return self._execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount > 0
+
+    def purge_expired(self):
+        return self._execute("DELETE FROM jobs WHERE expires IS NOT NULL AND expires < ?", (time.time(),)).rowcount
+
+    def counts(self):
+        rows = self._execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["count"] for row in rows}
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+class JobQueue:
+    """
+    Runs queued jobs on a fixed number of worker tasks, independent of the HTTP handlers.
+    `runner(job, report_progress)` executes a job and returns its result. Jobs that were
+    running when the server stopped are queued again on the next start. A job that runs
+    longer than `deadline` seconds is cancelled and fails.
+    With a worker_id, several processes share the store: each keeps a heartbeat on its
+    running jobs, only jobs whose heartbeat is older than stale_after are queued again,
+    and a job running in another process is cancelled by flagging it in the store.
+    """
+    def __init__(self, store, runner, workers=2, result_ttl=86400, poll_interval=5.0, deadline=None,
+                 worker_id=None, stale_after=15.0):
+        self.store = store
+        self.runner = runner
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.deadline = deadline
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id
+        self.stale_after = stale_after
+        self._wakeup = None
+        self._tasks = []
+        self._running = {}  # job id -> task
+        self._cancelled = set()
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        if self.worker_id is None:
+            requeued = await asyncio.to_thread(self.store.requeue)
+        else:
+            # Other processes may be running jobs right now
+            requeued = await asyncio.to_thread(self.store.requeue_stale, self.stale_after)
+        if requeued:
+            logging.info(f"Requeued {requeued} interrupted jobs")
+        await asyncio.to_thread(self.store.purge_expired)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        if self.worker_id is not None:
+            self._tasks.append(asyncio.create_task(self._monitor()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind, request, priority="batch"):
+        job_id = await asyncio.to_thread(self.store.add, kind, request, priority)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def cancel(self, job_id):
+        """
+        Cancels a queued or running job. Returns False when the job has already finished.
+        """
+        if await asyncio.to_thread(self.store.cancel_queued, job_id, self.result_ttl):
+            return True
+        task = self._running.get(job_id)
+        if task is None:
+            if self.worker_id is None:
+                return False
+            # Possibly running in another process, which sees the request on its next check
+            return await asyncio.to_thread(self.store.request_cancel, job_id)
+        self._cancelled.add(job_id)
+        task.cancel()
+        return True
+
+    async def _work(self):
+        while True:
+            job = await asyncio.to_thread(self.store.claim, self.worker_id)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    await asyncio.to_thread(self.store.purge_expired)
+                continue
+            # Wake another worker in case more jobs are waiting
+            self._wakeup.set()
+            task = asyncio.create_task(self._run(job))
+            self._running[job["id"]] = task
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.done():
+                    # The server is stopping: interrupt the job and leave it for the next start
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    await asyncio.to_thread(self.store.requeue, job["id"])
+                    raise
+            finally:
+                self._running.pop(job["id"], None)
+
+    async def _monitor(self):
+        """
+        Keeps the heartbeat of this process's running jobs, cancels those that another
+        process was asked to cancel and queues the jobs of crashed processes again.
+        """
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                running = list(self._running)
+                if running:
+                    await asyncio.to_thread(self.store.touch, running)
+                    for job_id in await asyncio.to_thread(self.store.cancel_requests, running):
+                        task = self._running.get(job_id)
+                        if task is not None:
+                            self._cancelled.add(job_id)
+                            task.cancel()
+                requeued = await asyncio.to_thread(self.store.requeue_stale, self.stale_after)
+                if requeued:
+                    logging.warning(f"Requeued {requeued} jobs of a worker that stopped responding")
+                    self._wakeup.set()
+            except sqlite3.Error as e:
+                logging.error(f"Checking running jobs failed: {e}")
+
+    async def _run(self, job):
+        job_id = job["id"]
+        current_priority.set(next(name for name, value in PRIORITIES.items() if value == job["priority"]))
+        logging.info(f"Running {job['kind']} job {job_id}")
+
+        def report_progress(progress):
+            return asyncio.to_thread(self.store.set_progress, job_id, progress)
+
+        try:
+            result = await asyncio.wait_for(self.runner(job, report_progress), self.deadline)
+        except asyncio.CancelledError:
+            if job_id in self._cancelled:
+                self._cancelled.discard(job_id)
+                CANCELLED_WORK.labels(f"/jobs/{job['kind']}", "cancelled").inc()
+                logging.info(f"Cancelled job {job_id}")
+                await asyncio.to_thread(self.store.finish, job_id, CANCELLED, ttl=self.result_ttl)
+            raise
+        except asyncio.TimeoutError:
+            CANCELLED_WORK.labels(f"/jobs/{job['kind']}", "deadline").inc()
+            error = f"Deadline of {self.deadline:g}s exceeded"
+            logging.warning(f"Job {job_id} cancelled: {error}")
+            await asyncio.to_thread(self.store.finish, job_id, FAILED, error=error, ttl=self.result_ttl)
+        except Exception as e:
+            logging.error(f"Job {job_id} failed: {str(e)}")
+            await asyncio.to_thread(self.store.finish, job_id, FAILED, error=str(e), ttl=self.result_ttl)
+        else:
+            logging.info(f"Job {job_id} finished")
+            await asyncio.to_thread(self.store.finish, job_id, SUCCEEDED, result=result, ttl=self.result_ttl)
+
+def job_info(job):
+    """
+    The public view of a job, without its request and result.
+    """
+    return {
+        "id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "progress": json.loads(job["progress"]) if job["progress"] else None,
+        "error": job["error"],
+        "created": job["created"],
+        "started": job["started"],
+        "finished": job["finished"],
+        "expires": job["expires"],
+    }
@@ -0,0 +1,81 @@
+import os
+import copy
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from timing import request_id
+
+class RequestIdFilter(logging.Filter):
+    """
+    Stamps records with the ID of the request they were written for. Filters run in
+    the thread that logs, before the record is queued, where the request is still known.
+    """
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line; fields passed as extra={"data": {...}} are merged in.
+    """
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        entry.update(getattr(record, "data", None) or {})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Formatted by StructuredQueueHandler before the record was queued
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler.prepare formats the traceback into the message and drops exc_info.
+    This keeps the message as it is and the traceback apart in exc_text, where the
+    JSON formatter gives it its own field and the text formatter appends it as usual.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+def setup_logging(log_file, level=logging.INFO):
+    """
+    Sends log records through a queue to a background thread that writes the log file,
+    so request handlers never wait for disk I/O. FABRIC_CONNECTOR_LOG_FORMAT=text keeps
+    the plain text format.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+    if os.environ.get("FABRIC_CONNECTOR_LOG_FORMAT", "json") == "text":
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s')
+    else:
+        formatter = JsonFormatter()
+    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    file_handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(records)
+    queue_handler.addFilter(RequestIdFilter())
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(records, file_handler, respect_handler_level=True)
+    listener.start()
+    # Flush what's still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
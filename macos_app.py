@@ -1,32 +1,33 @@
 import rumps
-import threading
 import os
 import webbrowser
-import sys
-import importlib
-import pyperclip
 from Foundation import NSURL
 from AppKit import NSWorkspace
-from LaunchServices import (
-    LSSharedFileListCreate,
-    LSSharedFileListCopySnapshot,
-    LSSharedFileListItemCopyResolvedURL,
-    kLSSharedFileListSessionLoginItems,
-    kLSSharedFileListItemLast,
-    LSSharedFileListItemRemove,
-    LSSharedFileListInsertItemURL
-)
-
-from api import start_api_server, stop_api_server, API_KEY
+from PyObjCTools import AppHelper
+
+from api import start_api_thread, stop_api_server, load_api_key, SHUTDOWN_TIMEOUT
+from startup import startup_report
 
 class FabricYTProxyApp(rumps.App):
-    def __init__(self):
+    def __init__(self, api_thread=None):
         super(FabricYTProxyApp, self).__init__("FabricYTProxy", icon=os.path.join("assets", "icons", "fabric-brain.icns"))
         self.menu = ["API Status", "Start API", "Stop API", None, "Copy API Key", None, "Open API Docs", "Start at Login"]
-        self.api_thread = None
-        self.start_api()
+        # main.py starts the API before it imports this module
+        self.api_thread = api_thread
+        if api_thread is not None and api_thread.is_alive():
+            self.api_started()
+        else:
+            self.start_api()
+        # Queued on the main run loop, so it runs as soon as the loop starts and the
+        # menu bar icon shows
+        AppHelper.callAfter(self.on_ready)
+
+    def on_ready(self):
+        startup_report.mark("tray ready")
+        # LaunchServices is slow to import, look the login item up after the icon shows
         self.login_item_exists = self.check_login_item()
         self.menu["Start at Login"].state = self.login_item_exists
+        startup_report.finish()
 
     @rumps.clicked("Start at Login")
     def start_at_login(self, sender):
@@ -47,13 +48,19 @@ class FabricYTProxyApp(rumps.App):
             NSWorkspace.sharedWorkspace().frontmostApplication().bundleIdentifier()
         )
 
+    def launch_services(self):
+        # Imported on first use, it's the largest of the pyobjc frameworks the app uses
+        import LaunchServices
+        return LaunchServices
+
     def check_login_item(self):
         # Check if the app is in the login items list
+        ls = self.launch_services()
         app_path = self.get_app_path()
-        login_items = LSSharedFileListCreate(None, kLSSharedFileListSessionLoginItems, None)
-        snapshot = LSSharedFileListCopySnapshot(login_items, None)[0]
+        login_items = ls.LSSharedFileListCreate(None, ls.kLSSharedFileListSessionLoginItems, None)
+        snapshot = ls.LSSharedFileListCopySnapshot(login_items, None)[0]
         for item in snapshot:
-            result = LSSharedFileListItemCopyResolvedURL(item, 0, None)
+            result = ls.LSSharedFileListItemCopyResolvedURL(item, 0, None)
             if result is not None:
                 item_url = result[0]
                 if item_url is not None and item_url.path() == app_path:
@@ -62,11 +69,12 @@ class FabricYTProxyApp(rumps.App):
 
     def add_login_item(self):
         # Add the app to the login items list
+        ls = self.launch_services()
         app_path = self.get_app_path()
-        login_items = LSSharedFileListCreate(None, kLSSharedFileListSessionLoginItems, None)
-        LSSharedFileListInsertItemURL(
+        login_items = ls.LSSharedFileListCreate(None, ls.kLSSharedFileListSessionLoginItems, None)
+        ls.LSSharedFileListInsertItemURL(
             login_items,
-            kLSSharedFileListItemLast,
+            ls.kLSSharedFileListItemLast,
             None,
             None,
             NSURL.fileURLWithPath_(app_path),
@@ -76,28 +84,31 @@ class FabricYTProxyApp(rumps.App):
 
     def remove_login_item(self):
         # Remove the app from the login items list
+        ls = self.launch_services()
         app_path = self.get_app_path()
-        login_items = LSSharedFileListCreate(None, kLSSharedFileListSessionLoginItems, None)
-        snapshot = LSSharedFileListCopySnapshot(login_items, None)[0]
+        login_items = ls.LSSharedFileListCreate(None, ls.kLSSharedFileListSessionLoginItems, None)
+        snapshot = ls.LSSharedFileListCopySnapshot(login_items, None)[0]
         for item in snapshot:
-            result = LSSharedFileListItemCopyResolvedURL(item, 0, None)
+            result = ls.LSSharedFileListItemCopyResolvedURL(item, 0, None)
             if result is not None:
                 item_url = result[0]
                 if item_url is not None and item_url.path() == app_path:
-                    LSSharedFileListItemRemove(login_items, item)
+                    ls.LSSharedFileListItemRemove(login_items, item)
 
     def start_api(self):
         # Start the API server in a separate thread if it's not already running
         if self.api_thread is None or not self.api_thread.is_alive():
-            self.api_thread = threading.Thread(target=start_api_server, daemon=True)
-            self.api_thread.start()
-            rumps.notification("FabricYTProxy", "API Started", "The API server is now running")
-            self.menu["API Status"].title = "API Status: Running"
-            self.menu["Start API"].set_callback(None)
-            self.menu["Stop API"].set_callback(self.stop_api)
+            self.api_thread = start_api_thread()
+            self.api_started()
         else:
             rumps.notification("FabricYTProxy", "API Already Running", "The API server is already active")
 
+    def api_started(self):
+        rumps.notification("FabricYTProxy", "API Started", "The API server is now running")
+        self.menu["API Status"].title = "API Status: Running"
+        self.menu["Start API"].set_callback(None)
+        self.menu["Stop API"].set_callback(self.stop_api)
+
     @rumps.clicked("API Status")
     def check_api_status(self, _):
         # Check and notify the current status of the API server
@@ -119,7 +130,7 @@ class FabricYTProxyApp(rumps.App):
             stop_api_server()
             # Give the server a moment to start shutting down
             rumps.timer(2)
-            self.api_thread.join(timeout=5)
+            self.api_thread.join(timeout=SHUTDOWN_TIMEOUT + 5)
             if not self.api_thread.is_alive():
                 self.api_thread = None
                 rumps.notification("FabricYTProxy", "API Stopped", "The API server has been stopped")
@@ -133,7 +144,8 @@ class FabricYTProxyApp(rumps.App):
 
     @rumps.clicked("Copy API Key")
     def copy_api_key(self, _):
-        pyperclip.copy(API_KEY)
+        import pyperclip
+        pyperclip.copy(load_api_key())
         rumps.notification("FabricYTProxy", "API Key Copied", "The API key has been copied to your clipboard")
 
     @rumps.clicked("Open API Docs")
@@ -141,15 +153,6 @@ class FabricYTProxyApp(rumps.App):
         # Open the API documentation in a web browser
         webbrowser.open('http://127.0.0.1:49152/docs')
 
-    def custom_import(name, *args, **kwargs):
-        # Custom import function to log attempts to import 'imp'
-        if name == 'imp':
-            print(f"Attempted to import 'imp' from: {sys._getframe(1).f_code.co_filename}")
-        return importlib.__import__(name, *args, **kwargs)
-
-    # Override the built-in import function with the custom one
-    sys.modules['builtins'].__import__ = custom_import
-
-def run():
+def run(api_thread=None):
     # Run the FabricYTProxyApp application
-    FabricYTProxyApp().run()
\ No newline at end of file
+    FabricYTProxyApp(api_thread).run()
\ No newline at end of file
@@ -1,14 +1,27 @@
 import sys
 import os
+import multiprocessing
+
+if __name__ == "__main__":
+    # Worker processes of the whisper pool start this executable again in frozen builds;
+    # they have to branch off here, before the tray application is imported
+    multiprocessing.freeze_support()
+    from startup import startup_report
+    startup_report.begin()
 
 if sys.platform == "darwin":
     os.environ["PATH"] = os.pathsep.join(("/opt/homebrew/bin", "/opt/homebrew/anaconda3/bin/", os.environ["PATH"]))
-    from macos_app import run
-elif sys.platform == "win32":
-    from windows_app import run
-else:
+elif sys.platform != "win32":
     print("Unsupported operating system")
     sys.exit(1)
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    # Serve the API first; the tray application's GUI frameworks take a while to import
+    # and set up, and requests are accepted in the meantime
+    from api import start_api_thread
+    api_thread = start_api_thread()
+    if sys.platform == "darwin":
+        from macos_app import run
+    else:
+        from windows_app import run
+    run(api_thread)
@@ -16,8 +16,26 @@ a = Analysis(
     binaries=[],
     datas=[
         ('api.py', '.'),
+        ('cache.py', '.'),
+        ('capture.py', '.'),
+        ('chunking.py', '.'),
+        ('deadlines.py', '.'),
+        ('engine.py', '.'),
+        ('executors.py', '.'),
+        ('jobs.py', '.'),
+        ('logs.py', '.'),
         ('macos_app.py', '.'),
+        ('metrics.py', '.'),
+        ('patterns.py', '.'),
         ('proxy.py', '.'),
+        ('scheduler.py', '.'),
+        ('segments.py', '.'),
+        ('shared.py', '.'),
+        ('singleflight.py', '.'),
+        ('startup.py', '.'),
+        ('timing.py', '.'),
+        ('transcripts.py', '.'),
+        ('whisper_pool.py', '.'),
         ('windows_app.py', '.'),
         ('assets/icons/fabric-logo-gif.icns', 'assets/icons/'),
         ('assets/icons/fabric-brain.icns', 'assets/icons/'),
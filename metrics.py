@@ -0,0 +1,175 @@
+import os
+import time
+import logging
+
+try:
+    import prometheus_client
+    import prometheus_client.multiprocess
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError:
+    prometheus_client = None
+
+# server.py sets this for its worker processes, which then write their metrics to files
+# in the directory so that every worker reports the totals of all of them
+MULTIPROCESS = prometheus_client is not None and bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+PREFIX = "fabric_connector"
+# Pattern runs and transcriptions take from milliseconds (cache hits) to many minutes
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+SPAWN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+class _NoopMetric:
+    """
+    Stands in for every metric when prometheus_client isn't installed.
+    """
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+def _metric(kind, name, documentation, labels, **kwargs):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return getattr(prometheus_client, kind)(f"{PREFIX}_{name}", documentation, labels, **kwargs)
+
+HTTP_REQUESTS = _metric("Counter", "http_requests_total", "HTTP requests by endpoint and status", ["method", "endpoint", "status"])
+HTTP_DURATION = _metric("Histogram", "http_request_duration_seconds", "Time until the response was complete, including streamed bodies",
+                        ["method", "endpoint"], buckets=DURATION_BUCKETS)
+HTTP_REQUEST_BYTES = _metric("Counter", "http_request_bytes_total", "Request body bytes received", ["endpoint"])
+HTTP_RESPONSE_BYTES = _metric("Counter", "http_response_bytes_total", "Response body bytes sent", ["endpoint"])
+
+PATTERN_DURATION = _metric("Histogram", "pattern_duration_seconds", "Execution time of pattern runs that weren't served from the cache",
+                           ["pattern", "model", "backend"], buckets=DURATION_BUCKETS)
+
+SUBPROCESS_SPAWN = _metric("Histogram", "subprocess_spawn_seconds", "Time to start a child process", ["pool"], buckets=SPAWN_BUCKETS)
+SUBPROCESS_DURATION = _metric("Histogram", "subprocess_duration_seconds", "Lifetime of child processes", ["pool"], buckets=DURATION_BUCKETS)
+SUBPROCESS_EXITS = _metric("Counter", "subprocess_exits_total", "Child process exits by exit code", ["pool", "code"])
+SUBPROCESS_BYTES = _metric("Counter", "subprocess_bytes_total", "Bytes written to the stdin and read from the stdout of child processes",
+                           ["pool", "direction"])
+CHILD_PROCESSES = _metric("Gauge", "child_processes", "Child processes currently running", ["pool"], multiprocess_mode="livesum")
+SUBPROCESS_KILLS = _metric("Counter", "subprocess_kills_total", "Child process trees killed because nobody waited for their output anymore",
+                           ["pool"])
+SCHEDULER_REJECTED = _metric("Counter", "scheduler_rejected_total", "Requests rejected with 429 because the pool's queue was full", ["pool"])
+CANCELLED_WORK = _metric("Counter", "cancelled_work_total", "Requests and jobs stopped before they finished, by reason", ["endpoint", "reason"])
+
+CACHE_LOOKUPS = _metric("Counter", "cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"])
+
+class _GaugeCollector:
+    def __init__(self, name, documentation, label, values):
+        self.name = f"{PREFIX}_{name}"
+        self.documentation = documentation
+        self.label = label
+        self.values = values
+
+    def collect(self):
+        family = GaugeMetricFamily(self.name, self.documentation, labels=[self.label])
+        try:
+            for label_value, value in self.values().items():
+                family.add_metric([str(label_value)], value)
+        except Exception as e:
+            logging.error(f"Collecting {self.name} failed: {e}")
+        yield family
+
+def multiprocess_registry():
+    """
+    A registry that adds up the metrics of all worker processes.
+    """
+    registry = prometheus_client.CollectorRegistry()
+    prometheus_client.multiprocess.MultiProcessCollector(registry)
+    return registry
+
+_registry = None
+
+def registry():
+    global _registry
+    if _registry is None:
+        _registry = multiprocess_registry() if MULTIPROCESS else prometheus_client.REGISTRY
+    return _registry
+
+def gauge_collector(name, documentation, label, values):
+    """
+    Registers a gauge that is read at scrape time; values() returns {label value: number}.
+    With several workers these report the worker that serves the scrape.
+    """
+    if prometheus_client is not None:
+        registry().register(_GaugeCollector(name, documentation, label, values))
+
+def render():
+    """
+    Returns the metrics in the Prometheus text format and its content type.
+    """
+    if prometheus_client is None:
+        return None, None
+    return prometheus_client.generate_latest(registry()), prometheus_client.CONTENT_TYPE_LATEST
+
+def mark_process_dead():
+    """
+    Drops this worker's live gauges from the totals when it exits.
+    """
+    if MULTIPROCESS:
+        prometheus_client.multiprocess.mark_process_dead(os.getpid())
+
+def start_metrics_server(port):
+    """
+    Serves the metrics without authentication on localhost, for scrapers that can't
+    send the X-API-Key header.
+    """
+    if prometheus_client is None:
+        logging.warning("prometheus_client is not installed, not starting the metrics server")
+        return
+    prometheus_client.start_http_server(port, addr="127.0.0.1", registry=registry())
+    logging.info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records request counts, latency and body sizes per route.
+    Streamed responses are measured until their last chunk was sent.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+        received = sent = 0
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            # The router stores the matched route in the scope; label by its path template
+            # so IDs in URLs don't create a time series each
+            route = scope.get("route")
+            endpoint = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            HTTP_REQUESTS.labels(method, endpoint, str(status)).inc()
+            HTTP_DURATION.labels(method, endpoint).observe(time.perf_counter() - started)
+            HTTP_REQUEST_BYTES.labels(endpoint).inc(received)
+            HTTP_RESPONSE_BYTES.labels(endpoint).inc(sent)
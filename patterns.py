@@ -0,0 +1,176 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+PATTERN_FILE = "system.md"
+
+def describe(content):
+    """
+    Returns the first line of prose in a pattern. Most patterns open with a
+    "# IDENTITY and PURPOSE" heading, so headings are only used when there is no prose.
+    """
+    heading = ""
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith("#"):
+            return line
+        heading = heading or line.lstrip("#").strip()
+    return heading
+
+class PatternIndex:
+    """
+    In-memory index of the `<name>/system.md` files under the pattern directory.
+    Entries are refreshed by a watchdog observer when it is installed and otherwise
+    by a polling thread that only rereads files whose size or mtime changed.
+    """
+    def __init__(self, root, poll_interval=5.0):
+        self.root = root
+        self.poll_interval = poll_interval
+        self._entries = {}  # name -> dict with name, size, mtime, description, sha256, content
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._observer = None
+        self.last_scan = None
+
+    def _read(self, name, stat):
+        path = os.path.join(self.root, name, PATTERN_FILE)
+        with open(path, 'rb') as f:
+            data = f.read()
+        content = data.decode('utf-8', errors='replace')
+        return {
+            "name": name,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "description": describe(content),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "content": content,
+        }
+
+    def refresh(self, name=None):
+        """
+        Rescans the pattern directory, or a single pattern when a name is given.
+        """
+        names = [name] if name is not None else self._list_names()
+        seen = set()
+        for pattern in names:
+            path = os.path.join(self.root, pattern, PATTERN_FILE)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            seen.add(pattern)
+            current = self._entries.get(pattern)
+            # A single pattern is only refreshed after an edit, so always reread it
+            if name is None and current and current["size"] == stat.st_size and current["mtime"] == stat.st_mtime:
+                continue
+            try:
+                entry = self._read(pattern, stat)
+            except OSError as e:
+                logging.info(f"Failed to index pattern {pattern}: {e}")
+                continue
+            with self._lock:
+                self._entries[pattern] = entry
+        with self._lock:
+            removed = [pattern for pattern in (names if name is not None else list(self._entries)) if pattern not in seen]
+            for pattern in removed:
+                self._entries.pop(pattern, None)
+        self.last_scan = time.time()
+
+    def _list_names(self):
+        try:
+            return [name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name))]
+        except OSError:
+            return []
+
+    def list(self):
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda entry: entry["name"])
+        return [{key: value for key, value in entry.items() if key != "content"} for entry in entries]
+
+    def search(self, query, limit=None):
+        """
+        Case-insensitive substring search; matches on the name rank before matches
+        that only appear in the description.
+        """
+        query = query.lower()
+        matches = []
+        for entry in self.list():
+            if query in entry["name"].lower():
+                matches.append((0, entry["name"], entry))
+            elif query in entry["description"].lower():
+                matches.append((1, entry["name"], entry))
+        matches.sort(key=lambda match: (match[0], match[1]))
+        results = [entry for _, _, entry in matches]
+        return results[:limit] if limit else results
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._entries
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            return dict(entry) if entry else None
+
+    def start(self):
+        """
+        Builds the index and keeps it current in the background.
+        """
+        self.refresh()
+        if self._thread is not None or self._observer is not None:
+            return
+        if Observer is not None and os.path.isdir(self.root):
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_PatternEventHandler(self), self.root, recursive=True)
+                self._observer.daemon = True
+                self._observer.start()
+                logging.info(f"Watching {self.root} for pattern changes")
+                return
+            except Exception as e:
+                logging.warning(f"File watching unavailable, polling patterns instead: {e}")
+                self._observer = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+        self._thread = None
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Failed to refresh pattern index: {e}")
+
+class _PatternEventHandler(FileSystemEventHandler):
+    def __init__(self, index):
+        self.index = index
+
+    def on_any_event(self, event):
+        path = os.path.relpath(event.src_path, self.index.root)
+        name = path.split(os.sep)[0]
+        if name in (".", ".."):
+            self.index.refresh()
+        elif getattr(event, "dest_path", None):
+            # Renames affect both the old and the new name
+            self.index.refresh()
+        else:
+            self.index.refresh(name)
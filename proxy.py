@@ -2,79 +2,177 @@ import subprocess
 import os
 import asyncio
 import sys
+import time
+import codecs
+import signal
+from scheduler import scheduler
+from metrics import SUBPROCESS_SPAWN, SUBPROCESS_DURATION, SUBPROCESS_EXITS, SUBPROCESS_BYTES, CHILD_PROCESSES, SUBPROCESS_KILLS
+from executors import default_executor
 
-# Use os.path.expanduser to get the current user's home directory
-if sys.platform == "darwin":
-    HOME_DIR = os.path.expanduser("~")
-    FABRIC_PATH = os.path.join(HOME_DIR, ".local", "bin", "fabric")
-    YT_PATH = os.path.join(HOME_DIR, ".local", "bin", "yt")
-elif sys.platform == "win32":
-    HOME_DIR = os.path.expanduser("~").replace("Users", "home").replace("C:", "")
-    FABRIC_PATH = os.path.join(HOME_DIR, ".local", "bin", "fabric").replace("\\", "/")
-    YT_PATH = os.path.join(HOME_DIR, ".local", "bin", "yt").replace("\\", "/")
-else:
-    print("Unsupported operating system")
-    sys.exit(1)
+def parse_fabric_output(command, output, goCompatible=False):
+    if goCompatible:
+        if command == "--listpatterns":
+            # Split the output into lines and create a list of pattern names
+            patterns = [{"name": line.strip()} for line in output.split('\n') if line.strip()][1:]
+            return patterns
+    else:
+        if command == "--list":
+            # Split the output into lines and create a list of pattern names
+            patterns = [{"name": line.strip()} for line in output.split('\n') if line.strip()]
+            return patterns
+        if command == "--listmodels":
+            # Split the output into lines and create a list of pattern names
+            models = [{"name": line.strip()} for line in output.split('\n') if line.strip()]
+            return models
 
-def execute_fabric_command(command, path, goCompatible=False):
-    try:
-        if sys.platform == "darwin":
-            result = subprocess.run([path, command], capture_output=True, text=True, check=True)
-        elif sys.platform == "win32":
-            if goCompatible:
-                result = subprocess.run(["C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe", "-WindowStyle", "Hidden", "-Command", path, command], capture_output=True, text=True, check=True)
-            else:
-                result = subprocess.run(["C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe", "-WindowStyle", "Hidden", "-Command", "wsl -e", path, command], capture_output=True, text=True, check=True)
-        output = result.stdout.strip()
-        
-        if goCompatible:
-            if command == "--listpatterns":
-                # Split the output into lines and create a list of pattern names
-                patterns = [{"name": line.strip()} for line in output.split('\n') if line.strip()][1:]
-                return patterns
-        else:
-            if command == "--list":
-                # Split the output into lines and create a list of pattern names
-                patterns = [{"name": line.strip()} for line in output.split('\n') if line.strip()]
-                return patterns
-            if command == "--listmodels":
-                # Split the output into lines and create a list of pattern names
-                models = [{"name": line.strip()} for line in output.split('\n') if line.strip()]
-                return models
-        
-        return output
-    except subprocess.CalledProcessError as e:
-        return f"Error executing Fabric command: {e.stderr}"
+    return output
 
-def execute_yt_command(command):
-    try:
-        result = subprocess.run([YT_PATH, command], capture_output=True, text=True, check=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        return f"Error executing YT command: {e.stderr}"
-    
-async def run_command(command):
-    process = await asyncio.create_subprocess_exec(
-        *command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
-    stdout, stderr = await process.communicate()
+async def fabric_listing(command, executor, goCompatible=False):
+    """
+    Runs a fabric listing command like --list or --listmodels in a scheduler slot and
+    parses its output. Raises CalledProcessError when fabric fails.
+    """
+    output = await run_command(executor.fabric(command))
+    return parse_fabric_output(command, output, goCompatible)
+
+async def run_command(command, pool="default", model=None, input_data=None, merge_stderr=False):
+    """
+    Runs a command in a scheduler slot of the given pool and returns its stdout.
+    input_data, if given, is written to the child's stdin; no shell is involved, so
+    the arguments need no quoting. merge_stderr returns stderr along with stdout, for
+    tools like ffmpeg that report on stderr.
+    """
+    stdin = None if input_data is None else input_data.encode('utf-8')
+    async with scheduler.slot(pool, model):
+        process, started = await _spawn(command, pool, stdin is not None, merge_stderr)
+        try:
+            stdout, stderr = await process.communicate(stdin)
+        except asyncio.CancelledError:
+            # Nobody is waiting for the output anymore
+            if process.returncode is None:
+                await _kill_tree(process, pool)
+            raise
+        finally:
+            _exited(process, pool, started)
+        SUBPROCESS_BYTES.labels(pool, "stdin").inc(len(stdin or b""))
+        SUBPROCESS_BYTES.labels(pool, "stdout").inc(len(stdout))
     
     # Decode bytes to strings
-    stdout = stdout.decode('utf-8')
-    stderr = stderr.decode('utf-8')
+    stdout = stdout.decode('utf-8', errors='replace')
+    stderr = (stderr or b'').decode('utf-8', errors='replace')
     
     if process.returncode != 0:
         raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
     
     return stdout.strip()
 
-def replace_drive(match):
-    drive_letter = match.group(1).lower()  # Get the drive letter and convert to lowercase
-    return f'/mnt/{drive_letter}/'
+async def stream_command(command, pool="default", model=None, input_data=None, env=None):
+    """
+    Runs a command in a scheduler slot of the given pool and yields its stdout as it is
+    produced instead of waiting for the process to exit. input_data is streamed to stdin.
+    env adds variables to the child's environment.
+    """
+    async with scheduler.slot(pool, model):
+        async for chunk in _stream_process(command, input_data, pool, env):
+            yield chunk
+
+async def _write_stdin(process, data):
+    try:
+        process.stdin.write(data)
+        await process.stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # The child exited without reading all of its input; its exit status tells why
+        pass
+    finally:
+        process.stdin.close()
+
+# Children lead their own process group, so everything they start (the interpreter behind
+# a wrapper script, ffmpeg under whisper, the Linux side of wsl) can be killed with them
+if sys.platform == "win32":
+    PROCESS_GROUP = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+else:
+    PROCESS_GROUP = {"start_new_session": True}
+
+async def _spawn(command, pool, pipe_stdin, merge_stderr=False, env=None):
+    """
+    Starts a child process and records how long that took.
+    """
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.PIPE if pipe_stdin else None,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT if merge_stderr else asyncio.subprocess.PIPE,
+        env=None if env is None else {**os.environ, **env},
+        **PROCESS_GROUP
+    )
+    SUBPROCESS_SPAWN.labels(pool).observe(time.perf_counter() - started)
+    CHILD_PROCESSES.labels(pool).inc()
+    return process, started
+
+async def _kill_tree(process, pool):
+    """
+    Kills a child together with every process it started and waits for it to exit.
+    """
+    if sys.platform == "win32":
+        killer = await asyncio.create_subprocess_exec(
+            "taskkill", "/F", "/T", "/PID", str(process.pid),
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+        )
+        await killer.wait()
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+    await process.wait()
+    SUBPROCESS_KILLS.labels(pool).inc()
+
+def _exited(process, pool, started):
+    CHILD_PROCESSES.labels(pool).dec()
+    SUBPROCESS_DURATION.labels(pool).observe(time.perf_counter() - started)
+    SUBPROCESS_EXITS.labels(pool, str(process.returncode)).inc()
+
+async def _stream_process(command, input_data=None, pool="default", env=None):
+    process, started = await _spawn(command, pool, input_data is not None, env=env)
+    # Feed stdin and drain stderr concurrently so the child can't block on a full pipe
+    stdin_task = None
+    if input_data is not None:
+        stdin = input_data.encode('utf-8')
+        SUBPROCESS_BYTES.labels(pool, "stdin").inc(len(stdin))
+        stdin_task = asyncio.ensure_future(_write_stdin(process, stdin))
+    stderr_task = asyncio.ensure_future(process.stderr.read())
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    try:
+        while True:
+            chunk = await process.stdout.read(4096)
+            if not chunk:
+                break
+            SUBPROCESS_BYTES.labels(pool, "stdout").inc(len(chunk))
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
+
+        stderr = (await stderr_task).decode('utf-8', errors='replace')
+        await process.wait()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command, None, stderr)
+    finally:
+        if process.returncode is None:
+            await _kill_tree(process, pool)
+        _exited(process, pool, started)
+        stderr_task.cancel()
+        if stdin_task is not None:
+            stdin_task.cancel()
 
 # Example usage
 if __name__ == "__main__":
-    print(execute_fabric_command("get-patterns"))
-    print(execute_yt_command("example query"))
\ No newline at end of file
+    print(asyncio.run(fabric_listing("--list", default_executor)))
\ No newline at end of file
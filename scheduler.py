@@ -0,0 +1,214 @@
+import os
+import time
+import asyncio
+import logging
+import itertools
+import contextvars
+from contextlib import asynccontextmanager
+from timing import stage
+from metrics import SCHEDULER_REJECTED
+from shared import shared_limits
+
+# Lower value is served first
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+# Priority class of the work running in the current request, set from the X-Priority header
+current_priority = contextvars.ContextVar("current_priority", default="interactive")
+
+class QueueFullError(Exception):
+    """
+    Raised when a pool's wait queue is full. retry_after is a hint in seconds.
+    """
+    def __init__(self, pool, retry_after):
+        super().__init__(f"Too many queued '{pool}' processes, retry in {retry_after}s")
+        self.pool = pool
+        self.retry_after = retry_after
+
+def parse_limits(value):
+    """
+    Parses "model=limit,model=limit" into a dict.
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, limit = item.rpartition("=")
+        limits[name.strip()] = int(limit)
+    return limits
+
+class Pool:
+    """
+    A bounded set of process slots with a priority ordered, bounded wait queue and
+    optional per-model caps.
+    """
+    def __init__(self, name, limit, max_queue=64, model_limit=None, model_limits=None):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.model_limit = model_limit
+        self.model_limits = model_limits or {}
+        self.running = 0
+        self.model_running = {}
+        self._waiters = []  # [priority, sequence, model, future, enqueued_at]
+        self._sequence = itertools.count()
+        # Observability counters
+        self.granted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    def _model_cap(self, model):
+        if model is None:
+            return None
+        return self.model_limits.get(model, self.model_limit)
+
+    def _can_run(self, model):
+        if self.running >= self.limit:
+            return False
+        cap = self._model_cap(model)
+        return cap is None or self.model_running.get(model, 0) < cap
+
+    def _grant(self, model, waited):
+        self.running += 1
+        if model is not None:
+            self.model_running[model] = self.model_running.get(model, 0) + 1
+        self.granted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def retry_after(self):
+        # Rough estimate: the time the queue ahead needs to drain at the average run time
+        average_run = self.total_run / self.granted if self.granted else 1.0
+        return max(1, int(average_run * (len(self._waiters) + 1) / self.limit))
+
+    async def acquire(self, model, priority):
+        if not self._waiters and self._can_run(model):
+            self._grant(model, 0.0)
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            SCHEDULER_REJECTED.labels(self.name).inc()
+            raise QueueFullError(self.name, self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._sequence), model, future, time.monotonic()]
+        self._waiters.append(entry)
+        self._waiters.sort(key=lambda waiter: (waiter[0], waiter[1]))
+        # Waiters ahead of us may be held back by their model cap while a slot is free
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled, give it back
+                self.release(model, 0.0)
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+            raise
+        waited = time.monotonic() - entry[4]
+        if waited > 1:
+            logging.info(f"Waited {waited:.1f}s for a '{self.name}' process slot")
+
+    def release(self, model, elapsed):
+        self.running -= 1
+        self.total_run += elapsed
+        if model is not None:
+            self.model_running[model] -= 1
+            if not self.model_running[model]:
+                del self.model_running[model]
+        self._dispatch()
+
+    def _dispatch(self):
+        # Grant slots in priority order, skipping waiters whose model is at its cap
+        now = time.monotonic()
+        for entry in list(self._waiters):
+            if self.running >= self.limit:
+                break
+            priority, _, model, future, enqueued_at = entry
+            if future.done():
+                self._waiters.remove(entry)
+            elif self._can_run(model):
+                self._waiters.remove(entry)
+                self._grant(model, now - enqueued_at)
+                future.set_result(None)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "queued": len(self._waiters),
+            "max_queue": self.max_queue,
+            "queued_by_priority": {
+                name: sum(1 for waiter in self._waiters if waiter[0] == value)
+                for name, value in PRIORITIES.items()
+            },
+            "oldest_wait": max((now - waiter[4] for waiter in self._waiters), default=0.0),
+            "running_by_model": dict(self.model_running),
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "average_wait": self.total_wait / self.granted if self.granted else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+class Scheduler:
+    """
+    Every child process is started inside a slot of one of the pools, which bounds how
+    many fabric, whisper and helper processes run at the same time. With shared limits
+    a slot also needs a lease from them, so the limits hold across worker processes.
+    """
+    def __init__(self, pools, shared=None):
+        self.pools = {pool.name: pool for pool in pools}
+        self.shared = shared
+
+    @asynccontextmanager
+    async def slot(self, pool="default", model=None, priority=None):
+        pool = self.pools[pool]
+        priority = PRIORITIES[priority or current_priority.get()]
+        lease = None
+        with stage("queue", pool.name):
+            await pool.acquire(model, priority)
+            if self.shared is not None:
+                try:
+                    lease = await self.shared.acquire(pool.name, pool.limit, model, pool._model_cap(model))
+                except BaseException:
+                    pool.release(model, 0.0)
+                    raise
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            pool.release(model, time.monotonic() - started)
+            if lease is not None:
+                self.shared.release_soon(lease)
+
+    def stats(self):
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+def _optional_int(value):
+    return int(value) if value else None
+
+scheduler = Scheduler([
+    Pool(
+        "llm",
+        limit=int(os.environ.get("FABRIC_CONNECTOR_LLM_SLOTS", 8)),
+        max_queue=int(os.environ.get("FABRIC_CONNECTOR_LLM_QUEUE", 64)),
+        model_limit=_optional_int(os.environ.get("FABRIC_CONNECTOR_MODEL_LIMIT")),
+        model_limits=parse_limits(os.environ.get("FABRIC_CONNECTOR_MODEL_LIMITS", "")),
+    ),
+    Pool(
+        "whisper",
+        limit=int(os.environ.get("FABRIC_CONNECTOR_WHISPER_SLOTS", 1)),
+        max_queue=int(os.environ.get("FABRIC_CONNECTOR_WHISPER_QUEUE", 8)),
+    ),
+    # ffmpeg and whisper processes of segmented transcriptions, which run inside a whisper slot
+    Pool(
+        "segments",
+        limit=int(os.environ.get("FABRIC_CONNECTOR_SEGMENT_SLOTS", os.cpu_count() or 1)),
+        max_queue=int(os.environ.get("FABRIC_CONNECTOR_SEGMENT_QUEUE", 1024)),
+    ),
+    Pool(
+        "default",
+        limit=int(os.environ.get("FABRIC_CONNECTOR_DEFAULT_SLOTS", 4)),
+        max_queue=int(os.environ.get("FABRIC_CONNECTOR_DEFAULT_QUEUE", 32)),
+    ),
+], shared=shared_limits)
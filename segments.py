@@ -0,0 +1,132 @@
+import os
+import re
+import shutil
+import asyncio
+import logging
+from proxy import run_command
+from timing import stage
+from whisper_pool import format_timestamp
+
+FFMPEG_PATH = os.environ.get("FABRIC_CONNECTOR_FFMPEG_PATH", "ffmpeg")
+# Quieter than this for at least SILENCE_SECONDS counts as a pause to cut at
+SILENCE_NOISE = os.environ.get("FABRIC_CONNECTOR_SILENCE_NOISE", "-30dB")
+SILENCE_SECONDS = float(os.environ.get("FABRIC_CONNECTOR_SILENCE_SECONDS", 0.5))
+# Segments are at least MIN_SEGMENT_SECONDS long, so short files aren't cut up for
+# nothing, and at most MAX_SEGMENT_SECONDS, so long files keep every core busy
+MIN_SEGMENT_SECONDS = float(os.environ.get("FABRIC_CONNECTOR_MIN_SEGMENT_SECONDS", 120))
+MAX_SEGMENT_SECONDS = float(os.environ.get("FABRIC_CONNECTOR_MAX_SEGMENT_SECONDS", 900))
+
+DURATION = re.compile(r"Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)")
+SILENCE_START = re.compile(r"silence_start: (-?\d+(?:\.\d+)?)")
+SILENCE_END = re.compile(r"silence_end: (\d+(?:\.\d+)?)")
+TIMESTAMPS = re.compile(r"^\[((?:\d+:)?\d+:\d{2}\.\d{3}) --> ((?:\d+:)?\d+:\d{2}\.\d{3})\]", re.MULTILINE)
+
+def parse_silencedetect(output):
+    """
+    Reads the duration and the (start, end) pauses from ffmpeg's silencedetect output.
+    """
+    match = DURATION.search(output)
+    duration = int(match.group(1)) * 3600 + int(match.group(2)) * 60 + float(match.group(3)) if match else None
+    silences = []
+    start = None
+    for line in output.splitlines():
+        match = SILENCE_START.search(line)
+        if match:
+            start = max(0.0, float(match.group(1)))
+            continue
+        match = SILENCE_END.search(line)
+        if match and start is not None:
+            silences.append((start, float(match.group(1))))
+            start = None
+    if start is not None and duration is not None:
+        # Silence up to the end of the file
+        silences.append((start, duration))
+    return duration, silences
+
+def plan_segments(duration, silences, workers):
+    """
+    Splits [0, duration] into about equal segments, one per worker as long as they stay
+    between MIN_SEGMENT_SECONDS and MAX_SEGMENT_SECONDS. Each cut is moved to the middle
+    of the nearest pause within a quarter segment, so no word is cut in half.
+    """
+    length = min(MAX_SEGMENT_SECONDS, max(MIN_SEGMENT_SECONDS, duration / max(1, workers)))
+    count = max(1, int(duration // length))
+    length = duration / count
+    cuts = [0.0]
+    for index in range(1, count):
+        target = index * length
+        pauses = [(start + end) / 2 for start, end in silences if abs((start + end) / 2 - target) <= length / 4]
+        cut = min(pauses, key=lambda pause: abs(pause - target)) if pauses else target
+        if cut > cuts[-1]:
+            cuts.append(cut)
+    cuts.append(duration)
+    return list(zip(cuts, cuts[1:]))
+
+def parse_timestamp(value):
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def shift_timestamps(transcript, offset):
+    """
+    Moves the "[start --> end]" timestamps of a segment's transcript by offset seconds.
+    """
+    def shift(match):
+        start = format_timestamp(parse_timestamp(match.group(1)) + offset)
+        end = format_timestamp(parse_timestamp(match.group(2)) + offset)
+        return f"[{start} --> {end}]"
+    return TIMESTAMPS.sub(shift, transcript)
+
+def ffmpeg_available():
+    return shutil.which(FFMPEG_PATH) is not None
+
+async def find_silences(path):
+    output = await run_command(
+        [FFMPEG_PATH, "-hide_banner", "-nostdin", "-nostats", "-i", path,
+         "-af", f"silencedetect=noise={SILENCE_NOISE}:d={SILENCE_SECONDS}", "-f", "null", "-"],
+        pool="segments", merge_stderr=True,
+    )
+    return parse_silencedetect(output)
+
+async def extract_segment(path, start, end, output_path):
+    # 16 kHz mono is what whisper resamples to anyway
+    await run_command(
+        [FFMPEG_PATH, "-hide_banner", "-nostdin", "-loglevel", "error", "-y", "-ss", f"{start:.3f}", "-t", f"{end - start:.3f}",
+         "-i", path, "-vn", "-ac", "1", "-ar", "16000", output_path],
+        pool="segments",
+    )
+
+async def transcribe_segmented(path, output_dir, transcribe, workers):
+    """
+    Cuts the audio at pauses into segments in output_dir, transcribes them concurrently
+    with `await transcribe(segment_path)` and joins the transcripts with timestamps
+    relative to the whole file. Returns None when the file is too short to split.
+    """
+    with stage("silencedetect"):
+        duration, silences = await find_silences(path)
+    if duration is None:
+        logging.warning(f"ffmpeg reported no duration for {path}, transcribing it in one piece")
+        return None
+    segments = plan_segments(duration, silences, workers)
+    if len(segments) == 1:
+        return None
+    logging.info(f"Transcribing {path} ({duration:.0f}s) in {len(segments)} segments")
+
+    async def run(index, start, end):
+        segment_path = os.path.join(output_dir, f"segment{index:04d}.wav")
+        with stage("segment", str(index)):
+            await extract_segment(path, start, end, segment_path)
+            transcript = await transcribe(segment_path)
+        return shift_timestamps(transcript, start)
+
+    tasks = [asyncio.create_task(run(index, start, end)) for index, (start, end) in enumerate(segments)]
+    try:
+        transcripts = await asyncio.gather(*tasks)
+    except BaseException:
+        # One failed or the request was cancelled: stop the others and their processes
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return "\n".join(transcript for transcript in transcripts if transcript)
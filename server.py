@@ -0,0 +1,57 @@
+"""
+Serves the API without the tray application, for headless deployments. With
+--workers N the requests are spread over N processes listening on the same port;
+they share their process slots, job queue and caches, so the configured limits hold
+for the server as a whole.
+
+    python server.py
+    python server.py --workers 4
+"""
+import os
+import shutil
+import logging
+import argparse
+import tempfile
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.environ.get("FABRIC_CONNECTOR_HOST", "0.0.0.0"), help="Address to listen on")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("FABRIC_CONNECTOR_PORT", 49152)), help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("FABRIC_CONNECTOR_WORKERS", 1)),
+                        help="Worker processes serving requests")
+    parser.add_argument("--shutdown-timeout", type=float, default=float(os.environ.get("FABRIC_CONNECTOR_SHUTDOWN_TIMEOUT", 10)),
+                        help="Seconds requests in flight get to finish on shutdown before they are cancelled")
+    args = parser.parse_args()
+    import uvicorn
+
+    metrics_dir = None
+    if args.workers > 1:
+        # Messages of the process that supervises the workers; the workers log to the log
+        # file. A single worker runs in this process and sets up that logging itself
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+        # Read by the workers when they import the app
+        os.environ["FABRIC_CONNECTOR_SHARED_STATE"] = "1"
+        if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            metrics_dir = tempfile.mkdtemp(prefix="fabric-connector-metrics-")
+            os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+        metrics_port = os.environ.get("FABRIC_CONNECTOR_METRICS_PORT")
+        if metrics_port:
+            # Only one process can listen on the port; this one adds up the workers' metrics
+            import metrics
+            metrics.start_metrics_server(int(metrics_port))
+    try:
+        uvicorn.run(
+            "api:app",
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            loop="asyncio",
+            log_config=None,
+            timeout_graceful_shutdown=args.shutdown_timeout,
+        )
+    finally:
+        if metrics_dir is not None:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
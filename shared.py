@@ -0,0 +1,163 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+import sqlite3
+import threading
+from cache import CACHE_DIR
+
+# Set by server.py for its worker processes, which then share their process slots and
+# job queue through STATE_DB_PATH and the job database
+SHARED_STATE = os.environ.get("FABRIC_CONNECTOR_SHARED_STATE") == "1"
+STATE_DB_PATH = os.environ.get("FABRIC_CONNECTOR_STATE_DB", os.path.join(CACHE_DIR, "state.sqlite3"))
+# A worker that hasn't sent a heartbeat for this many seconds is considered gone; its
+# process slots are freed and its running jobs queued again
+HEARTBEAT_TIMEOUT = float(os.environ.get("FABRIC_CONNECTOR_HEARTBEAT_TIMEOUT", 15))
+# Identifies this process in the shared state
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    pool TEXT NOT NULL,
+    model TEXT,
+    worker TEXT NOT NULL,
+    acquired REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leases_pool ON leases (pool, model);
+"""
+
+class SharedLimits:
+    """
+    Process slot leases in a SQLite database, so the limits of the scheduler's pools
+    hold for all worker processes of a server together rather than for each of them.
+    A worker waits for a lease by polling with backoff. Every worker keeps a heartbeat
+    and the leases of a worker that stopped sending it are released by the others.
+    """
+    def __init__(self, path, worker_id, heartbeat_timeout=15, poll_interval=0.02, max_poll_interval=0.25):
+        self.path = path
+        self.worker_id = worker_id
+        self.heartbeat_timeout = heartbeat_timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._lock = threading.Lock()
+        self._connection = None
+        self._heartbeat_task = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def try_acquire(self, pool, limit, model=None, model_limit=None):
+        """
+        Takes a lease on a slot of the pool and returns its ID, or None when the pool,
+        or the model within it, is at its limit across all workers.
+        """
+        with self._lock:
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "DELETE FROM leases WHERE worker NOT IN (SELECT id FROM workers WHERE heartbeat >= ?)",
+                    (time.time() - self.heartbeat_timeout,),
+                )
+                running = connection.execute("SELECT COUNT(*) FROM leases WHERE pool = ?", (pool,)).fetchone()[0]
+                lease = None
+                if running < limit and (model_limit is None or connection.execute(
+                    "SELECT COUNT(*) FROM leases WHERE pool = ? AND model = ?", (pool, model)
+                ).fetchone()[0] < model_limit):
+                    lease = connection.execute(
+                        "INSERT INTO leases (pool, model, worker, acquired) VALUES (?, ?, ?, ?)",
+                        (pool, model, self.worker_id, time.time()),
+                    ).lastrowid
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return lease
+
+    async def acquire(self, pool, limit, model=None, model_limit=None):
+        """
+        Waits for a lease on a slot of the pool and returns its ID.
+        """
+        delay = self.poll_interval
+        while True:
+            attempt = asyncio.ensure_future(asyncio.to_thread(self.try_acquire, pool, limit, model, model_limit))
+            try:
+                lease = await asyncio.shield(attempt)
+            except asyncio.CancelledError:
+                attempt.add_done_callback(self._release_late)
+                raise
+            if lease is not None:
+                return lease
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll_interval)
+
+    def _release_late(self, attempt):
+        # The lease may still be granted after the caller stopped waiting, give it back then
+        if not attempt.cancelled() and attempt.exception() is None:
+            self.release_soon(attempt.result())
+
+    def release(self, lease):
+        with self._lock:
+            self.connection.execute("DELETE FROM leases WHERE id = ?", (lease,))
+
+    def release_soon(self, lease):
+        """
+        Releases a lease from a thread, without waiting, so it happens even while the
+        caller is being cancelled.
+        """
+        if lease is not None:
+            asyncio.get_running_loop().run_in_executor(None, self.release, lease)
+
+    def heartbeat(self):
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO workers (id, pid, heartbeat) VALUES (?, ?, ?)",
+                (self.worker_id, os.getpid(), time.time()),
+            )
+
+    async def start(self):
+        await asyncio.to_thread(self.heartbeat)
+        self._heartbeat_task = asyncio.create_task(self._beat())
+
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_timeout / 3)
+            try:
+                await asyncio.to_thread(self.heartbeat)
+            except sqlite3.Error as e:
+                logging.error(f"Failed to record the worker heartbeat: {e}")
+
+    async def stop(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+        await asyncio.to_thread(self.leave)
+
+    def leave(self):
+        with self._lock:
+            self.connection.execute("DELETE FROM leases WHERE worker = ?", (self.worker_id,))
+            self.connection.execute("DELETE FROM workers WHERE id = ?", (self.worker_id,))
+
+    def stats(self):
+        with self._lock:
+            workers = self.connection.execute(
+                "SELECT COUNT(*) FROM workers WHERE heartbeat >= ?", (time.time() - self.heartbeat_timeout,)
+            ).fetchone()[0]
+            leases = self.connection.execute("SELECT pool, COUNT(*) FROM leases GROUP BY pool").fetchall()
+        return {"worker": self.worker_id, "workers": workers, "running": dict(leases)}
+
+shared_limits = SharedLimits(STATE_DB_PATH, WORKER_ID, HEARTBEAT_TIMEOUT) if SHARED_STATE else None
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+
+class _Call:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+class _Broadcast:
+    """
+    Replays the items a source generator has produced so far to every subscriber and
+    then follows it live.
+    """
+    def __init__(self):
+        self.items = []
+        self.finished = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self._changed = asyncio.Event()
+
+    async def produce(self, source):
+        try:
+            async for item in source:
+                self.items.append(item)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+            self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self):
+        position = 0
+        while True:
+            while position < len(self.items):
+                yield self.items[position]
+                position += 1
+            if self.finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+class SingleFlight:
+    """
+    Coalesces identical work that is in flight at the same time: the first caller for a
+    key starts it in a task of its own and later callers attach to that task. The work
+    keeps running as long as any caller still waits for it, so cancelling the caller
+    that started it doesn't fail the others; it is cancelled once every caller left.
+    """
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key, function):
+        """
+        Returns the result of `await function()`, shared with concurrent calls for key.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(function()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task: self._forget(self._calls, key, call))
+            self.started += 1
+        else:
+            self.coalesced += 1
+            logging.info(f"Joining in-flight work for {key[0]}")
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                # Wait until the work is stopped, so its processes are gone and its
+                # scheduler slots free by the time the caller's cancellation completes
+                call.task.cancel()
+                await asyncio.gather(call.task, return_exceptions=True)
+
+    async def stream(self, key, factory):
+        """
+        Yields the items of the async generator `factory()`, shared with concurrent
+        streams for key. Late subscribers first receive the items produced so far.
+        """
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = _Broadcast()
+            broadcast.task = asyncio.create_task(broadcast.produce(factory()))
+            self._streams[key] = broadcast
+            broadcast.task.add_done_callback(lambda task: self._forget(self._streams, key, broadcast))
+            self.started += 1
+        else:
+            self.coalesced += 1
+            logging.info(f"Joining in-flight stream for {key[0]}")
+        broadcast.subscribers += 1
+        try:
+            async for item in broadcast.subscribe():
+                yield item
+        finally:
+            broadcast.subscribers -= 1
+            if not broadcast.subscribers and not broadcast.task.done():
+                broadcast.task.cancel()
+                await asyncio.gather(broadcast.task, return_exceptions=True)
+
+    def _forget(self, flights, key, flight):
+        if flights.get(key) is flight:
+            del flights[key]
+        if not flight.task.cancelled():
+            # Every caller re-raises the error itself, don't report it as never retrieved
+            flight.task.exception()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls) + len(self._streams),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
+
+single_flight = SingleFlight()
@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import time
+import logging
+import builtins
+import threading
+from collections import defaultdict
+
+# Where the startup report is also written as JSON, to compare builds with each other
+STARTUP_REPORT_PATH = os.environ.get("FABRIC_CONNECTOR_STARTUP_REPORT")
+# How many packages the import breakdown lists
+STARTUP_REPORT_TOP = int(os.environ.get("FABRIC_CONNECTOR_STARTUP_REPORT_TOP", 12))
+
+class ImportTimer:
+    """
+    Times imports by wrapping builtins.__import__, which also works in the frozen
+    PyInstaller build, where -X importtime isn't available. Every package is charged
+    its self time, the time of its imports minus that of the imports they started,
+    so the breakdown adds up to the total import time.
+    """
+    def __init__(self):
+        self.self_times = defaultdict(float)  # top-level package -> seconds
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._original = None
+        self._installed = False
+
+    def install(self):
+        if not self._installed:
+            self._original = builtins.__import__
+            builtins.__import__ = self._import
+            self._installed = True
+
+    def uninstall(self):
+        # _original stays set for imports other threads are still in the middle of
+        if self._installed and builtins.__import__ == self._import:
+            builtins.__import__ = self._original
+        self._installed = False
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level and globals:
+            # Relative imports stay inside the package of the importing module
+            package = globals.get("__package__") or globals.get("__name__", "")
+        else:
+            package = name
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                self.self_times[package.partition(".")[0]] += elapsed - children
+
+    def breakdown(self, top=None):
+        with self._lock:
+            times = sorted(self.self_times.items(), key=lambda item: item[1], reverse=True)
+        return dict(times[:top] if top else times)
+
+    def total(self):
+        with self._lock:
+            return sum(self.self_times.values())
+
+class StartupReport:
+    """
+    Seconds from the start of main.py to each startup phase, such as the API accepting
+    requests and the tray icon showing, with a breakdown of the time spent importing.
+    Only recorded for the application, begin() is called by main.py.
+    """
+    def __init__(self):
+        self.started = None
+        self.marks = {}
+        self.imports = ImportTimer()
+        self._reported = False
+
+    def begin(self):
+        self.started = time.perf_counter()
+        self.imports.install()
+
+    def mark(self, phase):
+        if self.started is None:
+            return
+        self.marks[phase] = time.perf_counter() - self.started
+        logging.info(f"Startup: {phase} after {self.marks[phase]:.2f}s")
+
+    def finish(self):
+        """
+        Stops timing imports and logs the report, once.
+        """
+        if self.started is None or self._reported:
+            return
+        self._reported = True
+        self.imports.uninstall()
+        report = self.report()
+        phases = ", ".join(f"{phase} after {seconds:.2f}s" for phase, seconds in report["phases"].items())
+        packages = ", ".join(f"{package} {seconds:.2f}s" for package, seconds in report["imports"].items())
+        logging.info(f"Startup: {phases}; imports took {report['import_total']:.2f}s: {packages}", extra={"data": {"startup": report}})
+        if STARTUP_REPORT_PATH:
+            try:
+                with open(STARTUP_REPORT_PATH, "w", encoding="utf-8") as f:
+                    json.dump(report, f, indent=2)
+            except OSError as e:
+                logging.warning(f"Failed to write the startup report to {STARTUP_REPORT_PATH}: {e}")
+
+    def report(self):
+        return {
+            "frozen": bool(getattr(sys, "frozen", False)),
+            "phases": {phase: round(seconds, 4) for phase, seconds in self.marks.items()},
+            "import_total": round(self.imports.total(), 4),
+            "imports": {package: round(seconds, 4) for package, seconds in self.imports.breakdown(STARTUP_REPORT_TOP).items()},
+        }
+
+startup_report = StartupReport()
@@ -0,0 +1,101 @@
+import time
+import uuid
+import logging
+import contextvars
+from contextlib import contextmanager
+
+# ID of the request being handled, attached to every log record written while handling it
+request_id = contextvars.ContextVar("request_id", default=None)
+# Stages recorded for the request being handled; tasks started by the request share the list
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+# Longer Server-Timing headers are cut off; the log record keeps every stage
+MAX_HEADER_STAGES = 50
+
+class Timings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = []  # (name, description, duration in ms)
+
+    def add(self, name, description, duration):
+        self.stages.append((name, description, duration * 1000))
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self):
+        entries = []
+        for name, description, duration in self.stages[:MAX_HEADER_STAGES]:
+            entry = f"{name};dur={duration:.1f}"
+            if description:
+                entry += ';desc="' + description.replace('"', "'").replace("\\", "/") + '"'
+            entries.append(entry)
+        entries.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(entries)
+
+    def records(self):
+        return [
+            {"stage": name, "description": description, "duration_ms": round(duration, 1)}
+            for name, description, duration in self.stages
+        ]
+
+@contextmanager
+def stage(name, description=None):
+    """
+    Times a pipeline stage of the current request. Does nothing outside of a request.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = request_timings.get()
+        if timings is not None:
+            timings.add(name, description, time.perf_counter() - started)
+
+class TimingMiddleware:
+    """
+    ASGI middleware that gives every request an ID (the client's X-Request-ID when sent),
+    returns the stages timed so far as a Server-Timing header and writes one structured
+    log record with every stage once the response is complete. Streamed responses send
+    their headers before the pipeline runs, so their stages only appear in the log.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        current_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex[:16]
+        timings = Timings()
+        id_token = request_id.set(current_id)
+        timings_token = request_timings.set(timings)
+        status = 500
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", timings.server_timing().encode("latin-1")),
+                    (b"x-request-id", current_id.encode("latin-1")),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            logging.info(
+                f"{scope['method']} {scope['path']} {status} {timings.elapsed_ms():.0f}ms",
+                extra={"data": {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "duration_ms": round(timings.elapsed_ms(), 1),
+                    "stages": timings.records(),
+                }},
+            )
+            request_timings.reset(timings_token)
+            request_id.reset(id_token)
@@ -0,0 +1,91 @@
+import os
+import re
+import hashlib
+from urllib.parse import urlparse, parse_qs
+from cache import CACHE_DIR, DiskStore, LRUCache, digest
+
+VIDEO_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{11}$')
+YOUTUBE_HOSTS = ("youtube.com", "youtube-nocookie.com", "youtu.be")
+
+# Transcripts are compressed on disk; the least recently used ones are evicted past the size cap
+yt_transcript_cache = DiskStore(
+    os.path.join(CACHE_DIR, "yt_transcripts"),
+    max_bytes=int(os.environ.get("FABRIC_CONNECTOR_YT_CACHE_MB", 100)) * 1024 * 1024,
+    compress=True,
+    name="yt_transcripts",
+)
+
+# Filtered whisper transcripts keyed by audio fingerprint and whisper settings
+ts_transcript_cache = DiskStore(
+    os.path.join(CACHE_DIR, "ts_transcripts"),
+    max_bytes=int(os.environ.get("FABRIC_CONNECTOR_TS_CACHE_MB", 100)) * 1024 * 1024,
+    compress=True,
+    name="ts_transcripts",
+)
+
+def youtube_video_id(url):
+    """
+    Extracts the video ID from the various youtube URL forms (watch, youtu.be, shorts,
+    embed, live, music/mobile hosts) or a bare ID. Returns None if no ID can be found.
+    """
+    url = url.strip()
+    if VIDEO_ID_PATTERN.match(url):
+        return url
+    if "://" not in url:
+        url = "https://" + url
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    if not any(host == h or host.endswith("." + h) for h in YOUTUBE_HOSTS):
+        return None
+
+    segments = [segment for segment in parsed.path.split("/") if segment]
+    if host.endswith("youtu.be"):
+        candidate = segments[0] if segments else None
+    elif segments and segments[0] in ("shorts", "embed", "live", "v", "e"):
+        candidate = segments[1] if len(segments) > 1 else None
+    else:
+        candidate = parse_qs(parsed.query).get("v", [None])[0]
+
+    if candidate and VIDEO_ID_PATTERN.match(candidate):
+        return candidate
+    return None
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class AudioFingerprints:
+    """
+    Maps (path, size, mtime) to the sha256 of the file content. An unchanged file is
+    recognised from a single stat call; a new, moved or touched file is hashed once so
+    identical recordings still share a fingerprint.
+    """
+    def __init__(self, directory, max_entries=1024):
+        self.memory = LRUCache(max_entries)
+        self.disk = DiskStore(directory, max_bytes=1024 * 1024)
+
+    def fingerprint(self, path):
+        stat = os.stat(path)
+        fast_key = digest(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        content_hash = self.memory.get(fast_key) or self.disk.get(fast_key)
+        if content_hash is None:
+            content_hash = file_sha256(path)
+            self.disk.put(fast_key, content_hash, "fp")
+        self.memory.put(fast_key, content_hash)
+        return content_hash
+
+audio_fingerprints = AudioFingerprints(os.path.join(CACHE_DIR, "audio_fingerprints"))
+
+def ts_cache_key(path, *settings):
+    """
+    Returns the transcript cache key for an audio file transcribed with the given whisper
+    settings, or None when the file can't be read from here.
+    """
+    try:
+        content_hash = audio_fingerprints.fingerprint(path)
+    except OSError:
+        return None
+    return digest(content_hash, *settings)
@@ -0,0 +1,277 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+import subprocess
+import multiprocessing
+
+try:
+    import resource
+except ImportError:
+    # Windows, where workers are only recycled by job count
+    resource = None
+
+class WhisperPoolError(Exception):
+    """
+    Raised when a transcription fails or the pool can't load its model.
+    """
+
+def format_timestamp(seconds):
+    """
+    Formats seconds like the whisper CLI: mm:ss.mmm, with hours from the first hour on.
+    """
+    milliseconds = round(seconds * 1000)
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    prefix = f"{hours:02d}:" if hours else ""
+    return f"{prefix}{minutes:02d}:{seconds:02d}.{milliseconds:03d}"
+
+def segment_lines(segments):
+    """
+    Renders segments as the "[start --> end] text" lines the whisper CLI prints.
+    """
+    return "\n".join(
+        f"[{format_timestamp(segment['start'])} --> {format_timestamp(segment['end'])}] {segment['text'].strip()}"
+        for segment in segments
+    )
+
+class WhisperBackend:
+    """
+    Transcribes with the openai-whisper package, the library behind the whisper CLI.
+    """
+    def __init__(self, model):
+        import whisper
+        self.model = whisper.load_model(model)
+
+    def transcribe(self, path):
+        return segment_lines(self.model.transcribe(path)["segments"])
+
+class StubBackend:
+    """
+    Returns a fixed transcript after FABRIC_CONNECTOR_WHISPER_STUB_DELAY seconds, for
+    tests and benchmarks on machines without a speech model.
+    """
+    def __init__(self, model):
+        self.delay = float(os.environ.get("FABRIC_CONNECTOR_WHISPER_STUB_DELAY", 0))
+
+    def transcribe(self, path):
+        time.sleep(self.delay)
+        name = os.path.basename(path)
+        return segment_lines([
+            {"start": 0, "end": 2, "text": f"stub transcript of {name}"},
+            {"start": 2, "end": 4, "text": f"{os.path.getsize(path)} bytes of audio"},
+        ])
+
+BACKENDS = {
+    "whisper": WhisperBackend,
+    "stub": StubBackend,
+}
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+def _serve(connection, backend, model):
+    """
+    Worker process: loads the model once, then transcribes the audio paths it receives
+    until it gets None or the connection closes.
+    """
+    if hasattr(os, "setsid"):
+        # Lead a process group, so killing the worker also stops ffmpeg under whisper
+        os.setsid()
+    try:
+        engine = BACKENDS[backend](model)
+    except Exception as e:
+        connection.send(("error", f"Loading the {backend} model '{model}' failed: {e}", None))
+        return
+    connection.send(("ready", None, _peak_rss_mb()))
+    while True:
+        try:
+            path = connection.recv()
+        except EOFError:
+            return
+        if path is None:
+            return
+        try:
+            connection.send(("ok", engine.transcribe(path), _peak_rss_mb()))
+        except Exception as e:
+            connection.send(("error", str(e), _peak_rss_mb()))
+
+class _Worker:
+    def __init__(self, context, backend, model):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child_connection, backend, model), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.jobs = 0
+        self.rss_mb = None
+
+    def receive(self):
+        status, detail, rss_mb = self.connection.recv()
+        self.rss_mb = rss_mb
+        return status, detail
+
+    def transcribe(self, path):
+        self.jobs += 1
+        self.connection.send(path)
+        return self.receive()
+
+    def stop(self, timeout=10):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.kill()
+        self.connection.close()
+
+    def kill(self):
+        if sys.platform == "win32":
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(self.process.pid)], capture_output=True)
+        else:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        self.process.kill()
+        # A thread may still be blocked reading the connection; the worker's exit ends
+        # that read, and the connection is closed once it's garbage collected
+        self.process.join()
+
+class WhisperPool:
+    """
+    Long-lived transcription processes that keep the speech model loaded, so a request
+    doesn't pay for loading it. Jobs are sent to idle workers over a pipe. A worker is
+    replaced after max_jobs transcriptions or once its peak RSS passes max_rss_mb, and
+    killed and replaced when the request waiting for it is cancelled. If the model can't
+    be loaded the pool marks itself unavailable and callers fall back to the CLI.
+    """
+    def __init__(self, backend="whisper", model="small", workers=1, max_jobs=50, max_rss_mb=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown whisper pool backend '{backend}', expected one of {list(BACKENDS)}")
+        self.backend = backend
+        self.model = model
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.available = True
+        # Workers are started with spawn: forking a process that runs an event loop and
+        # threads isn't safe, and macOS and Windows spawn anyway
+        self._context = multiprocessing.get_context("spawn")
+        self._idle = None
+        self._workers = set()
+        self._tasks = set()
+        self.transcriptions = 0
+        self.recycled = 0
+        self.killed = 0
+
+    async def start(self):
+        self._idle = asyncio.Queue()
+        for _ in range(self.workers):
+            self._launch()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        workers, self._workers = self._workers, set()
+        await asyncio.gather(*(asyncio.to_thread(worker.stop) for worker in workers))
+
+    def _launch(self):
+        task = asyncio.create_task(self._start_worker())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _start_worker(self):
+        started = time.perf_counter()
+        worker = await asyncio.to_thread(_Worker, self._context, self.backend, self.model)
+        self._workers.add(worker)
+        try:
+            status, detail = await asyncio.to_thread(worker.receive)
+        except (EOFError, OSError):
+            status, detail = "error", "the worker exited while loading the model"
+        except asyncio.CancelledError:
+            self._retire(worker, kill=True)
+            raise
+        if status != "ready":
+            logging.error(f"Whisper pool unavailable, falling back to the whisper CLI: {detail}")
+            self._retire(worker, kill=True)
+            self.available = False
+            # Wake every request waiting for a worker
+            for _ in range(self.workers):
+                self._idle.put_nowait(None)
+            return
+        logging.info(f"Whisper worker {worker.process.pid} loaded '{self.model}' in {time.perf_counter() - started:.1f}s")
+        self._idle.put_nowait(worker)
+
+    def _retire(self, worker, kill=False):
+        self._workers.discard(worker)
+        if kill:
+            self.killed += 1
+        asyncio.get_running_loop().run_in_executor(None, worker.kill if kill else worker.stop)
+
+    def _release(self, worker):
+        if worker.jobs >= self.max_jobs or (self.max_rss_mb and (worker.rss_mb or 0) > self.max_rss_mb):
+            logging.info(f"Recycling whisper worker {worker.process.pid} after {worker.jobs} jobs, peak RSS {worker.rss_mb or 0:.0f}MB")
+            self.recycled += 1
+            self._retire(worker)
+            self._launch()
+        else:
+            self._idle.put_nowait(worker)
+
+    async def transcribe(self, path):
+        """
+        Transcribes the audio file at path on an idle worker and returns the timestamped
+        lines. Raises WhisperPoolError when the pool is unavailable or the run failed.
+        """
+        worker = await self._idle.get()
+        if worker is None:
+            self._idle.put_nowait(None)
+            raise WhisperPoolError("The whisper pool is unavailable")
+        try:
+            status, detail = await asyncio.to_thread(worker.transcribe, path)
+        except asyncio.CancelledError:
+            # The model can't be interrupted mid-run; kill the worker to free its CPU now
+            self._retire(worker, kill=True)
+            self._launch()
+            raise
+        except (EOFError, OSError):
+            self._retire(worker, kill=True)
+            self._launch()
+            raise WhisperPoolError("The whisper worker exited during the transcription")
+        self._release(worker)
+        if status != "ok":
+            raise WhisperPoolError(detail)
+        self.transcriptions += 1
+        return detail
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "model": self.model,
+            "available": self.available,
+            "workers": len(self._workers),
+            "idle": self._idle.qsize() if self._idle is not None and self.available else 0,
+            "transcriptions": self.transcriptions,
+            "recycled": self.recycled,
+            "killed": self.killed,
+        }
+
+def _optional_float(value):
+    return float(value) if value else None
+
+# Off unless FABRIC_CONNECTOR_WHISPER_POOL names a backend; /ts then runs whisper in the pool
+# instead of starting the CLI at TS_PATH for every file
+whisper_pool = WhisperPool(
+    backend=os.environ["FABRIC_CONNECTOR_WHISPER_POOL"],
+    model=os.environ.get("FABRIC_CONNECTOR_WHISPER_MODEL", "small"),
+    workers=int(os.environ.get("FABRIC_CONNECTOR_WHISPER_POOL_WORKERS", os.environ.get("FABRIC_CONNECTOR_WHISPER_SLOTS", 1))),
+    max_jobs=int(os.environ.get("FABRIC_CONNECTOR_WHISPER_POOL_MAX_JOBS", 50)),
+    max_rss_mb=_optional_float(os.environ.get("FABRIC_CONNECTOR_WHISPER_POOL_MAX_RSS_MB")),
+) if os.environ.get("FABRIC_CONNECTOR_WHISPER_POOL") else None
@@ -6,10 +6,10 @@ import webbrowser
 import logging
 import sys
 from PIL import Image
-from api import start_api_server, stop_api_server, API_KEY
+from api import start_api_server, stop_api_server, load_api_key, SHUTDOWN_TIMEOUT
+from startup import startup_report
 import winreg
 import sys
-import pyperclip
 
 
 # Set up logging
@@ -23,12 +23,17 @@ def handle_exception(exc_type, exc_value, exc_traceback):
 sys.excepthook = handle_exception
 
 class FabricYTProxyApp:
-    def __init__(self):
+    def __init__(self, api_thread=None):
         logging.info("Initializing FabricYTProxyApp")
         self.icon = pystray.Icon("FabricYTProxy")
-        self.api_thread = None
+        # main.py starts the API before it imports this module
+        self.api_thread = api_thread
         self.setup_icon()
-        self.start_api()
+        if api_thread is not None and api_thread.is_alive():
+            logging.info("API thread already started")
+            self.update_menu_status(True)
+        else:
+            self.start_api()
 
     def setup_icon(self):
         logging.info("Setting up icon")
@@ -57,7 +62,8 @@ class FabricYTProxyApp:
 
     def copy_api_key(self):
         try:
-            pyperclip.copy(API_KEY)
+            import pyperclip
+            pyperclip.copy(load_api_key())
             logging.info("API key copied to clipboard")
             self.icon.notify("API Key Copied", "The API key has been copied to your clipboard")
         except Exception as e:
@@ -122,7 +128,7 @@ class FabricYTProxyApp:
         if self.api_thread and self.api_thread.is_alive():
             try:
                 stop_api_server()
-                self.api_thread.join(timeout=5)
+                self.api_thread.join(timeout=SHUTDOWN_TIMEOUT + 5)
                 if not self.api_thread.is_alive():
                     self.api_thread = None
                     logging.info("API stopped successfully")
@@ -199,14 +205,21 @@ class FabricYTProxyApp:
             logging.error(f"Failed to disable start at login: {e}")
             self.icon.notify("Error", "Failed to disable start at login")
 
+    def on_ready(self, icon):
+        # Called by pystray in a thread once the icon shows; run() doesn't show it itself
+        # when a setup function is given
+        icon.visible = True
+        startup_report.mark("tray ready")
+        startup_report.finish()
+
     def run(self):
         logging.info("Running FabricYTProxyApp")
-        self.icon.run()
+        self.icon.run(setup=self.on_ready)
 
-def run():
+def run(api_thread=None):
     logging.info("Starting FabricYTProxyApp")
     try:
-        FabricYTProxyApp().run()
+        FabricYTProxyApp(api_thread).run()
     except Exception as e:
         logging.critical(f"Critical error in FabricYTProxyApp: {e}")
         raise
\ No newline at end of file